@@ -16,11 +16,27 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'postgresql://localhost/kyc_db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+    # /metrics requires the admin key unless it is only reachable from a trusted network
+    app.config['METRICS_PUBLIC'] = os.getenv('METRICS_PUBLIC', 'false').lower() in ('1', 'true', 'yes')
     
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
     
+    # Shared Sumsub client (one pooled session per worker, warmed on boot)
+    # and the adaptive rate limiter every outbound Sumsub call goes through
+    from app.services import sumsub_client, rate_limiter
+    rate_limiter.init_app(app)
+    sumsub_client.init_app(app)
+    
+    # Per-request deadlines (outbound calls, DB statements and rendering use the remaining budget)
+    from app.utils import deadline
+    deadline.init_app(app, db)
+    
+    # CLI commands (flask kyc ...)
+    from app.cli import kyc_cli
+    app.cli.add_command(kyc_cli)
+    
     # Health check endpoint
     @app.route('/health')
     def health_check():
@@ -31,6 +47,32 @@ def create_app():
             'version': '1.0.0'
         }), 200
     
+    # Runtime metrics endpoint
+    @app.route('/metrics')
+    def metrics():
+        """运行时指标端点（需要管理员认证：X-Admin-Key 请求头或管理后台会话）"""
+        from app.routes.admin_manual import check_admin_auth
+        if not app.config['METRICS_PUBLIC'] and not check_admin_auth():
+            return jsonify({'error': '未认证'}), 401
+        
+        from app.services import token_cache, single_flight, hedging, token_prewarmer, circuit_breaker, job_queue, report_renderer, report_prefetcher, report_storage, webhook_dedup, admission
+        
+        return jsonify({
+            'sumsub_client': sumsub_client.get_client().get_stats(),
+            'sumsub_rate_limiter': rate_limiter.get_limiter().get_stats(),
+            'sumsub_circuit_breakers': circuit_breaker.get_stats(),
+            'token_cache': token_cache.get_cache().get_stats(),
+            'single_flight': single_flight.get_stats(),
+            'sumsub_hedging': hedging.get_stats(),
+            'token_prewarm': token_prewarmer.get_stats(),
+            'job_queue': job_queue.get_stats(),
+            'report_renderer': report_renderer.get_stats(),
+            'sumsub_report_prefetch': report_prefetcher.get_stats(),
+            'report_storage': report_storage.get_stats(),
+            'webhook_dedup': webhook_dedup.get_stats(),
+            'webhook_admission': admission.get_stats(),
+        }), 200
+    
     # Register blueprints
     try:
         from app.routes import webhook
@@ -97,6 +139,10 @@ def create_app():
         try:
             db.create_all()
             print("✅ 数据库表已创建或已存在")
+            # 已部署的数据库：补上新版本增加的列和索引
+            from app.utils import schema
+            for column in schema.upgrade(db):
+                print(f"✅ 已添加数据库列/索引: {column}")
         except Exception as e:
             print(f"⚠️  警告: 无法创建数据库表: {e}")
             # 仍然继续，让应用运行
@@ -0,0 +1,156 @@
+"""
+Command line tools: flask kyc <command>
+"""
+
+import threading
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+kyc_cli = AppGroup('kyc', help='KYC 系统运维命令')
+
+
+@kyc_cli.command('worker')
+@click.option('--batch', type=int, default=None, help='每次领取的任务数')
+@click.option('--poll-interval', type=float, default=None, help='队列为空时的轮询间隔（秒）')
+@click.option('--once', is_flag=True, help='处理完当前到期的任务后退出')
+def worker(batch, poll_interval, once):
+    """处理后台任务队列（可同时运行多个进程）"""
+    from app.services import job_queue
+
+    stop_event = threading.Event()
+    job_queue.install_signal_handlers(stop_event)
+    click.echo("👷 任务 worker 已启动")
+
+    processed = job_queue.work(
+        current_app._get_current_object(),
+        batch=batch,
+        poll_interval=poll_interval,
+        once=once,
+        stop_event=stop_event
+    )
+    click.echo(f"✅ worker 退出，共处理 {processed} 个任务")
+
+
+@kyc_cli.command('jobs')
+def jobs():
+    """查看各状态的任务数量"""
+    from app.services import job_queue
+
+    counts = job_queue.counts()
+    if not counts:
+        click.echo("队列为空")
+        return
+    for status, count in sorted(counts.items()):
+        click.echo(f"{status:10s} {count}")
+
+
+@kyc_cli.command('retry-dead')
+@click.option('--kind', default=None, help='只重试该类型的任务')
+def retry_dead(kind):
+    """将死信任务重新放回队列"""
+    from app.services import job_queue
+
+    count = job_queue.retry_dead(kind)
+    click.echo(f"🔁 已重新入队 {count} 个死信任务")
+
+
+@kyc_cli.command('prune-jobs')
+@click.option('--days', type=float, default=None, help='保留最近多少天完成的任务')
+def prune_jobs(days):
+    """删除过期的已完成任务（worker 也会定期清理）"""
+    from app.services import job_queue
+
+    count = job_queue.prune(days)
+    click.echo(f"🧹 已删除 {count} 个已完成任务")
+
+
+@kyc_cli.command('prune-webhook-events')
+@click.option('--days', type=int, default=None, help='保留最近多少天的记录')
+def prune_webhook_events(days):
+    """删除过期的 Webhook 去重记录"""
+    from app.services import webhook_dedup
+
+    count = webhook_dedup.get_deduplicator().prune(days)
+    click.echo(f"🧹 已删除 {count} 条 Webhook 去重记录")
+
+
+@kyc_cli.command('reconcile')
+@click.option('--min-age', type=int, default=None, help='只检查等待超过多少分钟的验证')
+@click.option('--batch-size', type=int, default=None, help='每批扫描的验证数')
+@click.option('--workers', type=int, default=None, help='并发查询 Sumsub 的线程数')
+@click.option('--max-batches', type=int, default=None, help='处理多少批后停止（保留断点）')
+@click.option('--restart', is_flag=True, help='忽略断点，从头扫描')
+def reconcile(min_age, batch_size, workers, max_batches, restart):
+    """向 Sumsub 查询长时间处于 pending 的验证并更新状态（适合用 cron 定时运行）"""
+    from app.services import reconciler
+
+    def progress(stats):
+        click.echo(
+            f"  批次 {stats['batches']}: 已扫描 {stats['scanned']}, "
+            f"通过 {stats['approved']}, 拒绝 {stats['rejected']}, 未完成 {stats['unchanged']}, "
+            f"错误 {stats['errors']}, {stats['per_second']:.1f} 条/秒"
+        )
+
+    click.echo("🔎 开始对账 pending 验证")
+    stats = reconciler.reconcile(
+        current_app._get_current_object(),
+        min_age_minutes=min_age,
+        batch_size=batch_size,
+        workers=workers,
+        restart=restart,
+        max_batches=max_batches,
+        progress=progress
+    )
+    state = '完成全部扫描' if stats['completed'] else '已保存断点，下次从此继续'
+    click.echo(
+        f"✅ 对账结束（{state}）: {stats['scanned']} 条, 更新 {stats['approved'] + stats['rejected']} 条, "
+        f"用时 {stats['seconds']:.1f}s, {stats['per_second']:.1f} 条/秒"
+    )
+
+
+@kyc_cli.command('backfill-report-files')
+@click.option('--batch-size', type=int, default=500, help='每批提交的文件数')
+@click.option('--no-hash', is_flag=True, help='不计算 sha256（只记录路径和大小）')
+def backfill_report_files(batch_size, no_hash):
+    """扫描报告目录，把已有的 Sumsub 报告文件写入 report_files 清单（可重复运行）"""
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    def progress(stats):
+        click.echo(f"  已扫描 {stats['scanned']}, 写入 {stats['recorded']}, 未变 {stats['unchanged']}, 跳过 {stats['skipped']}")
+
+    click.echo(f"📂 回填报告清单: {SumsubReportDownloader.REPORT_STORAGE_DIR}")
+    stats = SumsubReportDownloader.backfill_report_files(
+        batch_size=batch_size,
+        compute_sha256=not no_hash,
+        progress=progress
+    )
+    click.echo(
+        f"✅ 回填完成: 扫描 {stats['scanned']} 个文件, 写入 {stats['recorded']} 条, "
+        f"未变 {stats['unchanged']} 条, 跳过 {stats['skipped']} 个"
+    )
+
+
+@kyc_cli.command('migrate-report-layout')
+@click.option('--batch-size', type=int, default=500, help='每批移动的文件数')
+@click.option('--dry-run', is_flag=True, help='只统计，不移动文件')
+def migrate_report_layout(batch_size, dry_run):
+    """把平铺目录中的报告文件在线迁移到分片目录（迁移期间两种布局都可读，可重复运行）"""
+    from app.services import report_service
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    def progress(stats):
+        click.echo(f"  已扫描 {stats['scanned']}, 已移动 {stats['moved']}, 跳过 {stats['skipped']}, 冲突 {stats['conflicts']}")
+
+    for name, base_dir, migrate in (
+        ('生成的 PDF 报告', report_service.REPORTS_DIR, report_service.migrate_reports_layout),
+        ('Sumsub 报告', SumsubReportDownloader.REPORT_STORAGE_DIR, SumsubReportDownloader.migrate_storage_layout),
+    ):
+        click.echo(f"📦 迁移{name}: {base_dir}")
+        stats = migrate(batch_size=batch_size, dry_run=dry_run, progress=progress)
+        action = '可移动' if dry_run else '已移动'
+        click.echo(
+            f"✅ {name}: 扫描 {stats['scanned']} 个文件, {action} {stats['moved']} 个, "
+            f"跳过 {stats['skipped']} 个, 冲突 {stats['conflicts']} 个"
+        )
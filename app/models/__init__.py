@@ -1,5 +1,11 @@
 from .order import Order
 from .verification import Verification
 from .report import Report
+from .rate_limit import RateLimitBucket
+from .job import Job
+from .webhook_event import WebhookEvent
+from .checkpoint import Checkpoint
+from .report_fetch import ReportFetch
+from .report_file import ReportFile
 
-__all__ = ['Order', 'Verification', 'Report']
+__all__ = ['Order', 'Verification', 'Report', 'RateLimitBucket', 'Job', 'WebhookEvent', 'Checkpoint', 'ReportFetch', 'ReportFile']
@@ -0,0 +1,13 @@
+from app import db
+from datetime import datetime
+
+class Checkpoint(db.Model):
+    """Resume position of a long-running batch command (e.g. flask kyc reconcile)"""
+    __tablename__ = 'checkpoints'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    cursor = db.Column(db.JSON)  # last position processed, command-specific
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Checkpoint {self.name}>'
@@ -0,0 +1,15 @@
+from app import db
+
+class RateLimitBucket(db.Model):
+    """Shared token bucket state for the cross-process Sumsub rate limiter"""
+    __tablename__ = 'rate_limit_buckets'
+
+    name = db.Column(db.String(64), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    rate = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix epoch seconds
+    blocked_until = db.Column(db.Float, nullable=False, default=0.0)
+    last_decrease_at = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<RateLimitBucket {self.name} rate={self.rate:.2f}>'
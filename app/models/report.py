@@ -11,6 +11,7 @@ class Report(db.Model):
     verification_details = db.Column(db.JSON)
     pdf_url = db.Column(db.String(512))
     pdf_path = db.Column(db.String(512))
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')  # generating, ready, failed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
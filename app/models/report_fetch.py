@@ -0,0 +1,24 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class ReportFetch(db.Model):
+    """Download state of one Sumsub report file (language + format) for a verification"""
+    __tablename__ = 'report_fetches'
+    __table_args__ = (
+        db.UniqueConstraint('verification_id', 'lang', 'format', name='uq_report_fetches_file'),
+    )
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    verification_id = db.Column(db.String(36), db.ForeignKey('verifications.id'), nullable=False, index=True)
+    lang = db.Column(db.String(10), nullable=False)
+    format = db.Column(db.String(10), nullable=False)  # pdf, json
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, downloading, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    path = db.Column(db.String(512))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReportFetch {self.verification_id} {self.lang}.{self.format} {self.status}>'
@@ -0,0 +1,22 @@
+from app import db
+from datetime import datetime
+import uuid
+
+class ReportFile(db.Model):
+    """Manifest entry of a Sumsub report file saved to the report storage directory"""
+    __tablename__ = 'report_files'
+    __table_args__ = (
+        db.UniqueConstraint('verification_id', 'lang', 'format', name='uq_report_files_file'),
+    )
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    verification_id = db.Column(db.String(36), db.ForeignKey('verifications.id'), nullable=False, index=True)
+    lang = db.Column(db.String(10), nullable=False)
+    format = db.Column(db.String(10), nullable=False)  # pdf, json
+    path = db.Column(db.String(512), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReportFile {self.verification_id} {self.lang}.{self.format} {self.size}>'
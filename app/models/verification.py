@@ -4,6 +4,10 @@ import uuid
 
 class Verification(db.Model):
     __tablename__ = 'verifications'
+    __table_args__ = (
+        # Keyset scan of old pending verifications (flask kyc reconcile)
+        db.Index('ix_verifications_status_created', 'status', 'created_at', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     order_id = db.Column(db.String(36), db.ForeignKey('orders.id'), nullable=False, unique=True)
@@ -0,0 +1,14 @@
+from app import db
+from datetime import datetime
+
+class WebhookEvent(db.Model):
+    """Digest of a webhook delivery already accepted; a second insert of the same digest is a redelivery"""
+    __tablename__ = 'webhook_events'
+    
+    digest = db.Column(db.String(64), primary_key=True)  # sha256 hex of the canonical payload
+    source = db.Column(db.String(32), nullable=False)
+    subject = db.Column(db.String(255))  # e.g. Sumsub applicant id
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<WebhookEvent {self.source} {self.digest[:12]}>'
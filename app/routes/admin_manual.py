@@ -3,10 +3,11 @@
 仅供管理员使用，需要密钥认证
 """
 
-from flask import Blueprint, request, jsonify, render_template, session
+from flask import Blueprint, request, jsonify, render_template, session, url_for
 from app.models import Order, Verification
 from app.services import sumsub_service
-from app.services.sumsub_report_downloader import SumsubReportDownloader
+from app.services import report_prefetcher
+from app.utils import deadline
 from app import db
 import os
 from datetime import datetime
@@ -202,6 +203,7 @@ def generate_verification_link():
         }), 201
     
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         print(f"  ❌ 错误: {e}")
         import traceback
         traceback.print_exc()
@@ -298,9 +300,10 @@ def check_verification_status():
             }
         }
         
-        # 如果已批准，添加报告链接
+        # 如果已批准，添加报告链接（缺少的报告按需下载，短暂等待）
         if verification.status == 'approved':
-            reports = SumsubReportDownloader.list_reports_for_verification(verification.id)
+            fetch = report_prefetcher.read_through(verification)
+            reports = fetch['reports']
             
             if reports:
                 report_urls = {}
@@ -316,8 +319,17 @@ def check_verification_status():
                 response['report_urls'] = report_urls
                 response['report_status'] = 'available'
             else:
-                response['report_status'] = 'downloading'
-                response['report_message'] = '报告生成中，请稍候'
+                download = report_prefetcher.fetch_status(verification.id)
+                if fetch['pending'] or download['status'] != 'failed':
+                    response['report_status'] = 'downloading'
+                    response['report_message'] = '报告生成中，请稍候'
+                    response['poll_url'] = url_for(
+                        'report.list_sumsub_reports', verification_token=verification.verification_token
+                    )
+                else:
+                    response['report_status'] = 'failed'
+                    response['report_message'] = '报告下载失败，请稍后重新查询'
+                response['report_files'] = download['files']
         else:
             response['report_status'] = 'not_available'
             response['report_message'] = f'验证未完成 (状态: {verification.status})'
@@ -327,9 +339,12 @@ def check_verification_status():
         print(f"  状态: {verification.status}")
         print(f"  报告: {response.get('report_status', 'N/A')}")
         
+        if response.get('report_status') == 'downloading':
+            return jsonify(response), 202, {'Retry-After': str(report_prefetcher.READ_THROUGH_RETRY_AFTER)}
         return jsonify(response), 200
     
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         print(f"  ❌ 错误: {e}")
         import traceback
         traceback.print_exc()
@@ -399,6 +414,7 @@ def list_manual_orders():
         }), 200
     
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         print(f"  ❌ 错误: {e}")
         import traceback
         traceback.print_exc()
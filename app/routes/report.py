@@ -1,10 +1,15 @@
-from flask import Blueprint, render_template, send_file, jsonify
+from flask import Blueprint, render_template, jsonify, url_for
 from app.models import Order, Report, Verification
 from app.services.sumsub_report_downloader import SumsubReportDownloader
+from app.services import report_prefetcher, report_service, report_storage
+from app.utils import deadline
 import os
 
 bp = Blueprint('report', __name__, url_prefix='/report')
 
+# How often the report page reloads while the PDF is still being generated
+REPORT_PAGE_REFRESH_SECONDS = 5
+
 @bp.route('/<order_id>', methods=['GET'])
 def view_report(order_id):
     """
@@ -21,6 +26,14 @@ def view_report(order_id):
         if not report:
             return render_template('error.html', message='Report not available yet'), 404
         
+        if report.status == 'generating':
+            # Rendered in the background; the page refreshes itself until the PDF is ready
+            return render_template(
+                'report.html',
+                order=order,
+                report=report
+            ), 200, {'Refresh': str(REPORT_PAGE_REFRESH_SECONDS)}
+        
         return render_template(
             'report.html',
             order=order,
@@ -28,6 +41,7 @@ def view_report(order_id):
         ), 200
         
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         return render_template('error.html', message=str(e)), 500
 
 
@@ -57,8 +71,12 @@ def list_sumsub_reports(verification_token):
               "created_at": "2025-12-08T10:30:00"
             }
           ],
-          "report_count": 2
+          "report_count": 2,
+          "download_status": {"status": "available", "files": {"en_pdf": "done", "json": "done"}}
         }
+    
+    缺少的报告会按需从 Sumsub 下载（同一文件只下载一次，并发请求共享）并短暂等待；
+    仍未完成时返回 202，附 poll_url 和 Retry-After，稍后重新请求即可
     """
     try:
         # 查询验证记录
@@ -75,12 +93,13 @@ def list_sumsub_reports(verification_token):
                 'status': verification.status
             }), 403
         
-        # 列出报告
-        reports = SumsubReportDownloader.list_reports_for_verification(verification.id)
+        # 列出报告（缺少的按需下载）
+        fetch = report_prefetcher.read_through(verification)
+        reports = fetch['reports']
         
         order = Order.query.get(verification.order_id)
         
-        return jsonify({
+        response = {
             'verification_id': verification.id,
             'order_id': verification.order_id,
             'order_number': order.taobao_order_id if order else None,
@@ -88,16 +107,36 @@ def list_sumsub_reports(verification_token):
             'status': verification.status,
             'verified_at': verification.updated_at.isoformat() if verification.updated_at else None,
             'reports': reports,
-            'report_count': len(reports)
-        }), 200
+            'report_count': len(reports),
+            'download_status': report_prefetcher.fetch_status(verification.id)
+        }
+        
+        if fetch['pending']:
+            return _still_downloading(response, fetch, request_url=url_for(
+                'report.list_sumsub_reports', verification_token=verification_token
+            ))
+        
+        return jsonify(response), 200
     
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         print(f"❌ 错误: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 
+def _still_downloading(response, fetch, request_url):
+    """
+    202：报告仍在下载，客户端 Retry-After 秒后轮询 poll_url
+    """
+    response['report_status'] = 'downloading'
+    response['pending_files'] = fetch['pending']
+    response['failed_files'] = fetch['failed']
+    response['poll_url'] = request_url
+    return jsonify(response), 202, {'Retry-After': str(report_prefetcher.READ_THROUGH_RETRY_AFTER)}
+
+
 @bp.route('/sumsub/download/<verification_token>/<filename>', methods=['GET'])
 def download_sumsub_report(verification_token, filename):
     """
@@ -129,39 +168,28 @@ def download_sumsub_report(verification_token, filename):
         if '..' in filename or '/' in filename or '\\' in filename:
             return jsonify({'error': 'Invalid filename'}), 400
         
-        # 构建文件路径
-        filepath = os.path.join(SumsubReportDownloader.REPORT_STORAGE_DIR, filename)
-        
-        # 验证文件存在且属于此验证
-        if not os.path.exists(filepath):
+        # 从报告清单查找（只能找到属于此验证的文件）
+        report = SumsubReportDownloader.find_report(verification.id, filename)
+        if report is None:
             return jsonify({'error': 'Report file not found'}), 404
+        filepath = report['path']
         
-        # 验证文件属于此验证（文件名应包含 verification_id）
-        if str(verification.id) not in filename:
-            return jsonify({'error': 'Report not belong to this verification'}), 403
-        
-        # 确定文件类型
-        if filename.endswith('.pdf'):
-            mimetype = 'application/pdf'
-        elif filename.endswith('.json'):
-            mimetype = 'application/json'
-        else:
-            mimetype = 'application/octet-stream'
+        if report_storage.is_local(filepath) and not os.path.exists(filepath):
+            return jsonify({'error': 'Report file not found'}), 404
         
         print(f"📥 下载报告: {filename}")
         
         try:
-            return send_file(
-                filepath,
-                mimetype=mimetype,
-                as_attachment=True,
-                download_name=filename
+            # 本地文件交给 nginx (X-Accel-Redirect) 或直接发送；S3 报告重定向到预签名 URL
+            return report_storage.download_response(
+                filepath, filename, SumsubReportDownloader._mimetype(filename.rsplit('.', 1)[-1])
             )
         except Exception as e:
             print(f"❌ 文件发送失败: {e}")
             return jsonify({'error': 'Failed to send file'}), 500
     
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         print(f"❌ 错误: {e}")
         import traceback
         traceback.print_exc()
@@ -192,6 +220,8 @@ def preview_sumsub_report(verification_token, lang='en'):
           "json_url": "/report/sumsub/download/token/kyc_report_123_xxx_en.json",
           "json_size": 456789
         }
+    
+    报告不在磁盘上时同 list_sumsub_reports：按需下载并短暂等待，仍未完成时返回 202
     """
     try:
         # 查询验证记录
@@ -210,8 +240,9 @@ def preview_sumsub_report(verification_token, lang='en'):
         
         order = Order.query.get(verification.order_id)
         
-        # 列出此语言的报告
-        reports = SumsubReportDownloader.list_reports_for_verification(verification.id)
+        # 列出此语言的报告（缺少的按需下载）
+        fetch = report_prefetcher.read_through(verification, report_prefetcher.preview_files(lang))
+        reports = fetch['reports']
         
         # 过滤出指定语言的报告
         pdf_report = next((r for r in reports if r['lang'] == lang and r['format'] == 'pdf'), None)
@@ -237,9 +268,15 @@ def preview_sumsub_report(verification_token, lang='en'):
             response['json_url'] = f"/report/sumsub/download/{verification_token}/{json_report['filename']}"
             response['json_size'] = json_report['size']
         
+        if fetch['pending']:
+            return _still_downloading(response, fetch, request_url=url_for(
+                'report.preview_sumsub_report', verification_token=verification_token, lang=lang
+            ))
+        
         return jsonify(response), 200
     
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         print(f"❌ 错误: {e}")
         import traceback
         traceback.print_exc()
@@ -259,17 +296,21 @@ def download_report(order_id):
         
         report = order.report
         
+        if report and report.status == 'generating':
+            return jsonify({
+                'status': 'generating',
+                'retry_after': REPORT_PAGE_REFRESH_SECONDS
+            }), 202, {'Retry-After': str(REPORT_PAGE_REFRESH_SECONDS)}
+        
         if not report or not report.pdf_path:
             return jsonify({'error': 'PDF not available'}), 404
         
-        if not os.path.exists(report.pdf_path):
+        pdf_path = report_service.resolve_report_pdf(report)
+        if not pdf_path:
             return jsonify({'error': 'PDF file not found'}), 404
         
-        return send_file(
-            report.pdf_path,
-            as_attachment=True,
-            download_name=f"kyc_report_{order_id}.pdf"
-        )
+        return report_storage.download_response(pdf_path, f"kyc_report_{order_id}.pdf", 'application/pdf')
         
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         return jsonify({'error': str(e)}), 500
@@ -2,15 +2,32 @@ from flask import Blueprint, render_template, jsonify, redirect, request
 from app import db
 from app.models import Order, Verification
 from app.services import sumsub_service
+from app.utils import deadline
 import os
 
 bp = Blueprint('verification', __name__, url_prefix='/verify')
 
+# Render the page from DB data only and let the browser fetch the SDK token
+VERIFY_ASYNC_TOKEN = os.getenv('VERIFY_ASYNC_TOKEN', 'false').lower() in ('1', 'true', 'yes')
+
+def _retry_after_seconds(error) -> int:
+    return max(int(getattr(error, 'retry_after', 5) + 0.999), 1)
+
+def _try_again_shortly_page(error):
+    """
+    Degraded response while Sumsub is unavailable
+    """
+    retry_after = _retry_after_seconds(error)
+    return render_template(
+        'error.html',
+        message='验证服务暂时繁忙，请稍后刷新页面重试'
+    ), 503, {'Retry-After': str(retry_after), 'Refresh': str(max(retry_after, 5))}
+
 @bp.route('/<verification_token>', methods=['GET'])
 def verification_page(verification_token):
     """
     Display KYC verification page with Sumsub WebSDK iframe
-    Generates fresh access token on page load
+    Access token is generated on page load unless a cached one is still valid
     """
     try:
         verification = Verification.query.filter_by(
@@ -28,13 +45,28 @@ def verification_page(verification_token):
         
         order = verification.order
         
-        # Generate fresh access token for WebSDK
+        if VERIFY_ASYNC_TOKEN:
+            # Never block on Sumsub here: use a cached token if there is one,
+            # otherwise the page JS fetches it from /verify/refresh-token
+            cached = sumsub_service.peek_access_token(f"order_{order.id}")
+            return render_template(
+                'verification.html',
+                order=order,
+                verification=verification,
+                verification_token=verification_token,
+                verification_token_for_sdk=cached[0] if cached else ''
+            ), 200
+        
+        # Get access token for WebSDK (cached while still comfortably valid)
         try:
-            access_token = sumsub_service._generate_access_token(
+            access_token, _ = sumsub_service.get_access_token(
                 verification.sumsub_applicant_id,
                 f"order_{order.id}",
                 order.buyer_email
             )
+        except sumsub_service.SUMSUB_UNAVAILABLE_ERRORS as e:
+            # Sumsub is failing or throttled: answer quickly instead of hanging the worker
+            return _try_again_shortly_page(e)
         except Exception as e:
             return render_template('error.html', message=f'Failed to generate verification token: {str(e)}'), 500
         
@@ -47,6 +79,7 @@ def verification_page(verification_token):
         ), 200
         
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         return render_template('error.html', message=str(e)), 500
 
 @bp.route('/status/<verification_token>', methods=['GET'])
@@ -68,6 +101,7 @@ def check_status(verification_token):
         }), 200
         
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/refresh-token', methods=['POST'])
@@ -93,8 +127,8 @@ def refresh_token():
         
         order = verification.order
         
-        # Generate fresh access token
-        access_token = sumsub_service._generate_access_token(
+        # Get access token (cached while still comfortably valid)
+        access_token, expires_in = sumsub_service.get_access_token(
             verification.sumsub_applicant_id,
             f"order_{order.id}",
             order.buyer_email
@@ -102,8 +136,16 @@ def refresh_token():
         
         return jsonify({
             'token': access_token,
-            'expires_in': 1800
+            'expires_in': expires_in
         }), 200
         
+    except sumsub_service.SUMSUB_UNAVAILABLE_ERRORS as e:
+        retry_after = _retry_after_seconds(e)
+        return jsonify({
+            'error': 'Verification service is busy, please try again shortly',
+            'retry_after': retry_after
+        }), 503, {'Retry-After': str(retry_after)}
+        
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         return jsonify({'error': str(e)}), 500
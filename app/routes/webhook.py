@@ -1,13 +1,55 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, g
 import hmac
 import hashlib
+import json
 import os
 from app import db
-from app.models import Order
-from app.services import sumsub_service
+from app.services import sumsub_service, order_service, job_queue, webhook_dedup, admission
+from app.utils import batch_stream, deadline
 
 bp = Blueprint('webhook', __name__, url_prefix='/webhook')
 
+# Persist the event as a job and answer 202 instead of doing the work inline
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', 'false').lower() in ('1', 'true', 'yes')
+
+# Batch order endpoint limits
+WEBHOOK_BATCH_MAX_ITEMS = int(os.getenv('WEBHOOK_BATCH_MAX_ITEMS', '1000'))
+WEBHOOK_BATCH_MAX_BYTES = int(os.getenv('WEBHOOK_BATCH_MAX_BYTES', str(10 * 1024 * 1024)))
+# Orders per multi-row INSERT
+WEBHOOK_BATCH_CHUNK = int(os.getenv('WEBHOOK_BATCH_CHUNK', '500'))
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+# Admission class per endpoint; each class has its own in-flight and queue limits
+ADMISSION_CLASSES = {
+    'webhook.sumsub_verification_webhook': 'sumsub',
+}
+
+@bp.before_request
+def _admit():
+    """
+    Shed load before it reaches the database or Sumsub
+    """
+    limiter = admission.get_limiter(ADMISSION_CLASSES.get(request.endpoint, 'orders'))
+    try:
+        if WEBHOOK_ASYNC:
+            admission.check_backlog()
+        g._admission = (limiter, limiter.acquire())
+    except admission.AdmissionRejected as e:
+        retry_after = max(int(e.retry_after + 0.999), 1)
+        print(f"⚠️  Webhook 过载，拒绝请求: {e}")
+        return jsonify({
+            'error': str(e),
+            'type': 'Overloaded',
+            'retry_after': retry_after
+        }), 503, {'Retry-After': str(retry_after)}
+
+@bp.teardown_request
+def _release(exc=None):
+    admitted = g.pop('_admission', None)
+    if admitted is not None:
+        limiter, admitted_at = admitted
+        limiter.release(admitted_at)
+
 @bp.route('/taobao/order', methods=['POST'])
 def taobao_order_webhook():
     """
@@ -39,79 +81,248 @@ def taobao_order_webhook():
         
         data = request.get_json()
         
-        # Extract order information
-        # buyer_id is optional - if not provided, use buyer_name or order_id
-        buyer_id = data.get('buyer_id')
-        if not buyer_id:
-            # Generate buyer_id from buyer_name or order_id
-            buyer_id = data.get('buyer_name', data.get('order_id', 'unknown'))
-        
-        order_data = {
-            'taobao_order_id': data.get('taobao_order_id') or data.get('order_id'),
-            'buyer_id': buyer_id,
-            'buyer_name': data.get('buyer_name'),
-            'buyer_email': data.get('buyer_email'),
-            'buyer_phone': data.get('buyer_phone'),
-            'platform': data.get('platform', 'taobao'),
-            'order_amount': data.get('order_amount'),
-        }
+        if WEBHOOK_ASYNC:
+            # Reject what the worker could never process before acknowledging it
+            if not data or not (data.get('taobao_order_id') or data.get('order_id')):
+                return jsonify({'error': 'order_id is required'}), 400
+            job = job_queue.enqueue(order_service.JOB_ORDER_CREATED, data)
+            return jsonify({
+                'status': 'accepted',
+                'job_id': job.id
+            }), 202
         
-        # Create order in database
-        existing_order = Order.query.filter_by(
-            taobao_order_id=order_data['taobao_order_id']
-        ).first()
+        result = order_service.create_order(order_service.build_order_data(data))
         
-        if existing_order:
+        if not result.created:
             return jsonify({
                 'status': 'already_exists',
-                'order_id': existing_order.id
+                'order_id': result.order_id
             }), 200
         
-        order = Order(**order_data)
-        db.session.add(order)
-        db.session.commit()
-        
-        # Generate Sumsub verification link
-        verification = sumsub_service.create_verification(order)
-        db.session.commit()
-        
         return jsonify({
             'status': 'success',
-            'order_id': order.id,
-            'verification_id': verification.id,
-            'verification_link': verification.verification_link
+            'order_id': result.order_id,
+            'verification_id': result.verification_id,
+            'verification_link': result.verification_link
         }), 201
         
     except Exception as e:
         db.session.rollback()
+        deadline.raise_if_exceeded(e)
         print(f"❌ Webhook 错误: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/taobao/orders', methods=['POST'])
+def taobao_orders_batch_webhook():
+    """
+    Batch webhook for Taobao/Xianyu order events (backlog replays, sale peaks)
+    Body: a JSON array of orders, or NDJSON (one order per line) with an NDJSON content type
+    Signed like /taobao/order; responds with one result per item, in input order
+    """
+    if request.content_length and request.content_length > WEBHOOK_BATCH_MAX_BYTES:
+        return jsonify({'error': f'Batch exceeds {WEBHOOK_BATCH_MAX_BYTES} bytes'}), 413
+    
+    webhook_secret = os.getenv('WEBHOOK_SECRET')
+    signature = request.headers.get('X-Webhook-Signature')
+    
+    # Spool the body (memory first, then disk) and sign it in the same pass
+    try:
+        spool, digest = batch_stream.spool_body(
+            request.stream,
+            WEBHOOK_BATCH_MAX_BYTES,
+            webhook_secret if signature else None
+        )
+    except batch_stream.BodyTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    
+    # Same rules as /taobao/order: verify only if both signature and secret are provided
+    if signature and webhook_secret:
+        if not hmac.compare_digest(signature, digest):
+            spool.close()
+            return jsonify({'error': 'Invalid signature'}), 401
+    elif signature and not webhook_secret:
+        print("⚠️  警告: 提供了签名但 WEBHOOK_SECRET 未配置")
+    
+    ndjson = request.mimetype in NDJSON_MIMETYPES
+    
+    # First pass: the body must be a JSON array (or NDJSON) within the item limit before anything
+    # is written; a malformed item doesn't fail the batch, it is reported 'invalid' in the second
+    try:
+        count = sum(1 for _ in batch_stream.iter_items(spool, ndjson))
+    except ValueError as e:
+        spool.close()
+        return jsonify({'error': str(e)}), 400
+    
+    if count > WEBHOOK_BATCH_MAX_ITEMS:
+        spool.close()
+        return jsonify({'error': f'Batch has {count} orders, limit is {WEBHOOK_BATCH_MAX_ITEMS}'}), 413
+    
+    spool.seek(0)
+    return Response(stream_with_context(_batch_results(spool, ndjson)), mimetype='application/json')
+
+def _batch_results(spool, ndjson: bool):
+    """
+    Second pass: insert orders chunk by chunk and stream the per-item results
+    """
+    summary = {'created': 0, 'already_exists': 0, 'invalid': 0, 'error': 0}
+    pending = []  # (index, order_data or None, error)
+    first = True
+    
+    def flush():
+        valid = [order_data for _, order_data, error in pending if error is None]
+        try:
+            created = iter(order_service.create_orders(valid) if valid else [])
+            failure = None
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ 批量订单写入失败: {e}")
+            created, failure = None, str(e)
+        
+        for index, order_data, error in pending:
+            taobao_order_id = order_data.get('taobao_order_id') if order_data else None
+            if error is not None:
+                item = {'index': index, 'taobao_order_id': taobao_order_id, 'status': 'invalid', 'error': error}
+            elif failure is not None:
+                item = {'index': index, 'taobao_order_id': taobao_order_id, 'status': 'error', 'error': failure}
+            else:
+                result = next(created)
+                item = {
+                    'index': index,
+                    'taobao_order_id': taobao_order_id,
+                    'status': 'created' if result.created else 'already_exists',
+                    'order_id': result.order_id,
+                }
+                if result.created:
+                    item['verification_id'] = result.verification_id
+                    item['verification_link'] = result.verification_link
+            summary[item['status']] += 1
+            yield item
+        pending.clear()
+    
+    try:
+        yield '{"results": ['
+        for index, (raw, error) in enumerate(batch_stream.iter_items(spool, ndjson)):
+            order_data = None
+            if error is None:
+                if isinstance(raw, dict):
+                    order_data = order_service.build_order_data(raw)
+                    error = order_service.validate_order_data(order_data)
+                else:
+                    error = 'order must be a JSON object'
+            pending.append((index, order_data, error))
+            
+            if len(pending) >= WEBHOOK_BATCH_CHUNK:
+                for item in flush():
+                    yield ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+                    first = False
+        
+        for item in flush():
+            yield ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+            first = False
+        yield '], "summary": ' + json.dumps(summary) + '}'
+    finally:
+        spool.close()
+
 @bp.route('/sumsub/verification', methods=['POST'])
 def sumsub_verification_webhook():
     """
     Webhook endpoint for Sumsub verification status updates
+    A JSON array of events (batched or replayed deliveries) is claimed with one commit
     """
     try:
         data = request.get_json()
+        if isinstance(data, list):
+            return _sumsub_verification_batch(data)
         
-        applicant_id = data.get('applicantId')
-        review_status = data.get('reviewStatus')
-        
-        # Update verification status
-        verification = sumsub_service.update_verification_status(
-            applicant_id,
-            review_status
-        )
+        # Sumsub retries deliveries; an event already accepted is acknowledged without reprocessing.
+        # In async mode the claim is committed together with the job
+        dedup = webhook_dedup.get_deduplicator()
+        digest = webhook_dedup.event_digest('sumsub', data)
+        if not dedup.claim(digest, 'sumsub', data.get('applicantId'), commit=not WEBHOOK_ASYNC):
+            return jsonify({'status': 'duplicate'}), 200
         
-        if verification:
-            # Generate PDF report if verification is complete
-            if review_status in ['approved', 'rejected']:
-                sumsub_service.generate_pdf_report(verification.order_id)
+        try:
+            if WEBHOOK_ASYNC:
+                job = job_queue.enqueue(sumsub_service.JOB_SUMSUB_VERIFICATION, data)
+                return jsonify({
+                    'status': 'accepted',
+                    'job_id': job.id
+                }), 202
+            
+            # Update verification status and generate the PDF report if verification is complete;
+            # events for an applicant already being processed are merged into one follow-up run
+            _coalesce_verification_event(data)
+        except Exception:
+            # Let Sumsub's retry of this event through
+            dedup.release(digest)
+            raise
         
         return jsonify({'status': 'success'}), 200
         
+    except sumsub_service.SUMSUB_UNAVAILABLE_ERRORS as e:
+        # Fail fast; Sumsub redelivers the webhook, which retries the report
+        retry_after = max(int(e.retry_after + 0.999), 1)
+        return jsonify({
+            'error': str(e),
+            'retry_after': retry_after
+        }), 503, {'Retry-After': str(retry_after)}
+        
     except Exception as e:
+        deadline.raise_if_exceeded(e)
         return jsonify({'error': str(e)}), 500
+
+def _sumsub_verification_batch(events: list):
+    """
+    Apply a batch of Sumsub events; their claims take one lookup and one commit
+    """
+    if not all(isinstance(event, dict) for event in events):
+        return jsonify({'error': 'Every event must be a JSON object'}), 400
+    
+    dedup = webhook_dedup.get_deduplicator()
+    digests = [webhook_dedup.event_digest('sumsub', event) for event in events]
+    accepted = dedup.claim_many(
+        [(digest, 'sumsub', event.get('applicantId')) for digest, event in zip(digests, events)],
+        commit=not WEBHOOK_ASYNC
+    )
+    
+    if WEBHOOK_ASYNC:
+        # Claims and jobs go out in a single commit
+        jobs = [
+            job_queue.enqueue(sumsub_service.JOB_SUMSUB_VERIFICATION, event, commit=False) if ok else None
+            for event, ok in zip(events, accepted)
+        ]
+        db.session.commit()
+        results = [{'status': 'accepted', 'job_id': job.id} if job else {'status': 'duplicate'} for job in jobs]
+        return jsonify({'results': results}), 202
+    
+    results = []
+    for digest, event, ok in zip(digests, events, accepted):
+        if not ok:
+            results.append({'status': 'duplicate'})
+            continue
+        try:
+            _coalesce_verification_event(event)
+            results.append({'status': 'success'})
+        except Exception as e:
+            # Let a redelivery of this event through
+            dedup.release(digest)
+            results.append({'status': 'error', 'error': str(e)})
+    return jsonify({'results': results}), 200
+
+def _coalesce_verification_event(data: dict):
+    # Merged events are ranked by their own timestamp, so a late older delivery is dropped
+    webhook_dedup.get_coalescer('sumsub_applicant').submit(
+        data.get('applicantId'),
+        _apply_verification_event,
+        data,
+        order=webhook_dedup.event_order(data)
+    )
+
+def _apply_verification_event(data: dict):
+    sumsub_service.handle_verification_event(
+        data.get('applicantId'),
+        data.get('reviewStatus'),
+        data
+    )
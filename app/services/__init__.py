@@ -1,4 +1,19 @@
+from . import rate_limiter
+from . import circuit_breaker
+from . import sumsub_client
+from . import token_cache
+from . import single_flight
+from . import hedging
+from . import job_queue
+from . import webhook_dedup
+from . import admission
 from . import sumsub_service
+from . import order_service
+from . import token_prewarmer
+from . import report_storage
 from . import report_service
+from . import report_renderer
+from . import report_prefetcher
+from . import reconciler
 
-__all__ = ['sumsub_service', 'report_service']
+__all__ = ['rate_limiter', 'circuit_breaker', 'sumsub_client', 'token_cache', 'single_flight', 'hedging', 'job_queue', 'webhook_dedup', 'admission', 'sumsub_service', 'order_service', 'token_prewarmer', 'report_storage', 'report_service', 'report_renderer', 'report_prefetcher', 'reconciler']
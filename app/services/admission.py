@@ -0,0 +1,224 @@
+"""
+Admission control for inbound webhooks
+Each traffic class (order ingestion, Sumsub callbacks) has its own bound on requests
+in flight and on requests queued for a slot, so a flood of one can't starve the other.
+Beyond those bounds requests are shed immediately with a Retry-After estimate instead
+of piling up in server threads until they time out.
+"""
+
+import math
+import os
+import threading
+import time
+
+from app.utils import deadline
+
+# Defaults per class; override with WEBHOOK_<CLASS>_MAX_IN_FLIGHT / WEBHOOK_<CLASS>_MAX_QUEUE
+# (MAX_IN_FLIGHT=0 disables admission control for the class)
+DEFAULT_LIMITS = {
+    'orders': {'max_in_flight': 16, 'max_queue': 32},
+    'sumsub': {'max_in_flight': 8, 'max_queue': 16},
+}
+# Longest a queued request waits for a slot (also capped by the request deadline)
+WEBHOOK_ADMISSION_QUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ADMISSION_QUEUE_TIMEOUT', '2'))
+# Shed asynchronously accepted webhooks while this many jobs are queued (0 = no limit)
+WEBHOOK_MAX_JOB_BACKLOG = int(os.getenv('WEBHOOK_MAX_JOB_BACKLOG', '0'))
+# How long a job backlog count is reused before querying again
+JOB_BACKLOG_CHECK_INTERVAL = 1.0
+
+# Weight of the newest sample in the service time average
+_SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of admitted"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def limits_for(name: str) -> dict:
+    defaults = DEFAULT_LIMITS.get(name, DEFAULT_LIMITS['orders'])
+    return {
+        key: int(os.getenv(f'WEBHOOK_{name.upper()}_{key.upper()}', str(value)))
+        for key, value in defaults.items()
+    }
+
+
+class AdmissionLimiter:
+    """
+    Bounded in-flight requests with a bounded, time-limited wait queue
+    """
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, queue_timeout: float = None):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = WEBHOOK_ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._service_time = None
+        self._stats = {
+            'admitted': 0,
+            'queued': 0,
+            'shed_queue_full': 0,
+            'shed_timeout': 0,
+            'peak_in_flight': 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_in_flight > 0
+
+    def retry_after(self) -> float:
+        """
+        Time for the requests ahead to drain, from the average service time (lock held)
+        """
+        if not self._service_time:
+            return 1.0
+        ahead = self._waiting + 1
+        return max(math.ceil(self._service_time * ahead / self.max_in_flight), 1)
+
+    def acquire(self) -> float:
+        """
+        Take an in-flight slot, waiting in the queue if there is room
+
+        Returns:
+            monotonic admission time, to pass back to release()
+
+        Raises:
+            AdmissionRejected: if the queue is full or no slot freed up in time
+        """
+        if not self.enabled:
+            return time.monotonic()
+
+        with self._cond:
+            if self._in_flight >= self.max_in_flight:
+                if self._waiting >= self.max_queue:
+                    self._stats['shed_queue_full'] += 1
+                    raise AdmissionRejected(
+                        f'{self.name}: {self._in_flight} in flight, {self._waiting} queued',
+                        self.retry_after()
+                    )
+
+                wait = self.queue_timeout
+                left = deadline.remaining()
+                if left is not None:
+                    wait = min(wait, max(left, 0.0))
+                wait_until = time.monotonic() + wait
+
+                self._waiting += 1
+                self._stats['queued'] += 1
+                try:
+                    while self._in_flight >= self.max_in_flight:
+                        left = wait_until - time.monotonic()
+                        if left <= 0:
+                            self._stats['shed_timeout'] += 1
+                            raise AdmissionRejected(
+                                f'{self.name}: no slot within {wait:.2f}s',
+                                self.retry_after()
+                            )
+                        self._cond.wait(left)
+                finally:
+                    self._waiting -= 1
+
+            self._in_flight += 1
+            self._stats['admitted'] += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._in_flight)
+        return time.monotonic()
+
+    def release(self, admitted_at: float = None):
+        if not self.enabled:
+            return
+        with self._cond:
+            self._in_flight -= 1
+            if admitted_at is not None:
+                elapsed = time.monotonic() - admitted_at
+                if self._service_time is None:
+                    self._service_time = elapsed
+                else:
+                    self._service_time += _SERVICE_TIME_ALPHA * (elapsed - self._service_time)
+            self._cond.notify()
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+            stats['waiting'] = self._waiting
+            stats['avg_service_seconds'] = self._service_time or 0.0
+        stats['max_in_flight'] = self.max_in_flight
+        stats['max_queue'] = self.max_queue
+        stats['shed'] = stats['shed_queue_full'] + stats['shed_timeout']
+        stats['saturation'] = stats['in_flight'] / self.max_in_flight if self.enabled else 0.0
+        return stats
+
+
+class _BacklogProbe:
+    """
+    Cached count of queued jobs; a backlog the workers can't keep up with sheds async intake
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._queued = 0
+        self._shed = 0
+
+    def exceeded(self) -> bool:
+        if WEBHOOK_MAX_JOB_BACKLOG <= 0:
+            return False
+        from app.services import job_queue
+
+        now = time.monotonic()
+        if now - self._checked_at >= JOB_BACKLOG_CHECK_INTERVAL:
+            queued = job_queue.queued_count()
+            with self._lock:
+                self._queued, self._checked_at = queued, now
+        with self._lock:
+            if self._queued < WEBHOOK_MAX_JOB_BACKLOG:
+                return False
+            self._shed += 1
+            return True
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {'queued': self._queued, 'max_backlog': WEBHOOK_MAX_JOB_BACKLOG, 'shed': self._shed}
+
+
+_limiters = {}
+_lock = threading.Lock()
+_backlog = _BacklogProbe()
+
+
+def get_limiter(name: str) -> AdmissionLimiter:
+    """
+    Return the process-wide limiter for a traffic class, creating it on first use
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = AdmissionLimiter(name, **limits_for(name))
+                _limiters[name] = limiter
+    return limiter
+
+
+def check_backlog():
+    """
+    Raises:
+        AdmissionRejected: if the job queue backlog is over WEBHOOK_MAX_JOB_BACKLOG
+    """
+    if _backlog.exceeded():
+        raise AdmissionRejected(
+            f'job backlog over {WEBHOOK_MAX_JOB_BACKLOG}',
+            max(JOB_BACKLOG_CHECK_INTERVAL, 1.0)
+        )
+
+
+def get_stats() -> dict:
+    stats = {name: limiter.get_stats() for name, limiter in list(_limiters.items())}
+    stats['job_backlog'] = _backlog.get_stats()
+    return stats
@@ -0,0 +1,140 @@
+"""
+Circuit breakers for Sumsub endpoint families
+After repeated failures a breaker opens and callers fail fast instead of waiting on
+timeouts; after a cool-down a limited number of probe requests decide whether it closes
+"""
+
+import os
+import threading
+import time
+
+# Breaker configuration (shared by all families)
+SUMSUB_BREAKER_FAILURE_THRESHOLD = int(os.getenv('SUMSUB_BREAKER_FAILURE_THRESHOLD', '5'))
+SUMSUB_BREAKER_RESET_TIMEOUT = float(os.getenv('SUMSUB_BREAKER_RESET_TIMEOUT', '30'))
+SUMSUB_BREAKER_HALF_OPEN_PROBES = int(os.getenv('SUMSUB_BREAKER_HALF_OPEN_PROBES', '1'))
+
+# Sumsub endpoint families, each with its own breaker
+FAMILY_TOKENS = 'tokens'
+FAMILY_APPLICANT_REVIEW = 'applicant_review'
+FAMILY_REPORT_DOWNLOAD = 'report_download'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Sumsub while a breaker is open"""
+
+    def __init__(self, family: str, retry_after: float):
+        super().__init__(f'Sumsub {family} circuit is open, retry in {retry_after:.0f}s')
+        self.family = family
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures
+    Open -> half-open after `reset_timeout` seconds
+    Half-open -> closed on a successful probe, back to open on a failed one
+    """
+
+    def __init__(self, family: str, failure_threshold: int = None, reset_timeout: float = None,
+                 half_open_probes: int = None):
+        self.family = family
+        self.failure_threshold = failure_threshold or SUMSUB_BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = SUMSUB_BREAKER_RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self.half_open_probes = half_open_probes or SUMSUB_BREAKER_HALF_OPEN_PROBES
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._stats = {
+            'calls': 0,
+            'successes': 0,
+            'failures': 0,
+            'rejected': 0,
+            'opened': 0,
+        }
+
+    def before_call(self):
+        """
+        Admit a call or raise CircuitOpenError
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    self._stats['rejected'] += 1
+                    raise CircuitOpenError(self.family, remaining)
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self._stats['rejected'] += 1
+                    raise CircuitOpenError(self.family, 1.0)
+                self._probes_in_flight += 1
+
+            self._stats['calls'] += 1
+
+    def record_success(self):
+        with self._lock:
+            self._stats['successes'] += 1
+            self._failures = 0
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._probes_in_flight = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self._stats['opened'] += 1
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probes_in_flight = 0
+
+    def record_neutral(self):
+        """
+        The call ended without telling us anything about Sumsub health (e.g. local rate limit)
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self._failures
+            if self.state == OPEN:
+                stats['retry_after'] = max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+        return stats
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(family: str) -> CircuitBreaker:
+    """
+    Return the process-wide breaker for a Sumsub endpoint family
+    """
+    breaker = _breakers.get(family)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(family)
+            if breaker is None:
+                breaker = CircuitBreaker(family)
+                _breakers[family] = breaker
+    return breaker
+
+
+def get_stats() -> dict:
+    return {family: breaker.get_stats() for family, breaker in list(_breakers.items())}
@@ -0,0 +1,301 @@
+"""
+Hedged requests for idempotent-enough Sumsub calls
+If the first attempt hasn't answered by a percentile of recent latencies, a second
+attempt is sent; the first good answer wins. A budget caps the extra load, and bounded
+pools cap the threads: when one is full the call goes unhedged, never queued.
+The losing attempt is told to stop: it gives up at its next retry or backoff (see
+check_cancelled/pause); an HTTP request already on the wire is left to complete.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from app.utils import deadline
+
+# Hedging configuration (off by default)
+SUMSUB_HEDGING = os.getenv('SUMSUB_HEDGING', 'false').lower() in ('1', 'true', 'yes')
+# Send the hedge once the primary is slower than this percentile of recent calls
+SUMSUB_HEDGE_PERCENTILE = float(os.getenv('SUMSUB_HEDGE_PERCENTILE', '95'))
+SUMSUB_HEDGE_MIN_DELAY = float(os.getenv('SUMSUB_HEDGE_MIN_DELAY', '0.2'))
+# Delay used until enough latency samples have been collected
+SUMSUB_HEDGE_DEFAULT_DELAY = float(os.getenv('SUMSUB_HEDGE_DEFAULT_DELAY', '1.0'))
+# Hedges allowed per primary call (0.1 = at most ~10% extra requests)
+SUMSUB_HEDGE_BUDGET = float(os.getenv('SUMSUB_HEDGE_BUDGET', '0.1'))
+# Concurrent hedges process-wide
+SUMSUB_HEDGE_WORKERS = int(os.getenv('SUMSUB_HEDGE_WORKERS', '8'))
+# Concurrent hedgeable primaries process-wide; beyond it primaries run unhedged in the caller's thread
+SUMSUB_HEDGE_PRIMARY_WORKERS = int(os.getenv('SUMSUB_HEDGE_PRIMARY_WORKERS', '32'))
+
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+MAX_BUDGET_TOKENS = 10.0
+
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        index = min(int(len(ordered) * pct / 100.0), len(ordered) - 1)
+        return ordered[index]
+
+
+class HedgeBudget:
+    """Every primary call earns `ratio` tokens; every hedge spends one"""
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+        self._tokens = 1.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, MAX_BUDGET_TOKENS)
+
+    def available(self) -> bool:
+        with self._lock:
+            return self._tokens >= 1.0
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class HedgeCancelled(Exception):
+    """Raised inside the losing attempt once the other one has answered"""
+
+
+_cancel_event = contextvars.ContextVar('hedge_cancel', default=None)
+
+
+def check_cancelled():
+    """
+    Raise HedgeCancelled if the attempt running in this context lost the race
+    Called by the Sumsub client before each retry
+    """
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise HedgeCancelled('The other attempt already answered')
+
+
+def pause(seconds: float):
+    """
+    time.sleep() for retry backoff that ends early (raising HedgeCancelled) if this attempt lost
+    """
+    event = _cancel_event.get()
+    if event is None:
+        time.sleep(seconds)
+    elif event.wait(seconds):
+        raise HedgeCancelled('The other attempt already answered')
+
+
+class _BoundedPool:
+    """Thread pool whose callers take a slot first; with no slot free they don't submit at all"""
+
+    def __init__(self, workers: int, name: str):
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def acquire(self) -> bool:
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        """Run fn on the pool; the caller holds a slot, released when fn finishes"""
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+_primary_pool = None
+_hedge_pool = None
+_pools_lock = threading.Lock()
+
+
+def _get_pools():
+    global _primary_pool, _hedge_pool
+    if _hedge_pool is None:
+        with _pools_lock:
+            if _hedge_pool is None:
+                _primary_pool = _BoundedPool(SUMSUB_HEDGE_PRIMARY_WORKERS, 'sumsub-primary')
+                _hedge_pool = _BoundedPool(SUMSUB_HEDGE_WORKERS, 'sumsub-hedge')
+    return _primary_pool, _hedge_pool
+
+
+class Hedger:
+    """
+    Hedging policy and metrics for one Sumsub call family
+    """
+
+    def __init__(self, name: str, percentile: float = None, budget: float = None, enabled: bool = None):
+        self.name = name
+        self.percentile = percentile or SUMSUB_HEDGE_PERCENTILE
+        self.enabled = SUMSUB_HEDGING if enabled is None else enabled
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget(SUMSUB_HEDGE_BUDGET if budget is None else budget)
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'hedges_sent': 0,
+            'primary_wins': 0,
+            'hedge_wins': 0,
+            'budget_denied': 0,
+            'hedge_pool_full': 0,
+            'primary_pool_full': 0,
+            'losers_cancelled': 0,
+            'losers_completed': 0,
+        }
+
+    def delay(self) -> float:
+        observed = self.latency.percentile(self.percentile)
+        if observed is None:
+            return SUMSUB_HEDGE_DEFAULT_DELAY
+        return max(observed, SUMSUB_HEDGE_MIN_DELAY)
+
+    def _timed(self, fn, args, kwargs):
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def _attempt(self, cancel: threading.Event, fn, args, kwargs):
+        _cancel_event.set(cancel)
+        return self._timed(fn, args, kwargs)
+
+    def _submit(self, pool: _BoundedPool, cancel: threading.Event, fn, args, kwargs):
+        # Each attempt runs in its own copy of the caller's context, so the deadline carries over
+        ctx = contextvars.copy_context()
+        return pool.submit(ctx.run, self._attempt, cancel, fn, args, kwargs)
+
+    def _loser_finished(self, future):
+        if isinstance(future.exception(), HedgeCancelled):
+            self._count('losers_cancelled')
+        else:
+            # Stopped only after its in-flight request completed anyway
+            self._count('losers_completed')
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs), hedging with a second attempt if the first is slow
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        self._count('calls')
+        self.budget.earn()
+        if not self.budget.available():
+            # No hedge is possible: the primary runs in the caller's thread
+            self._count('budget_denied')
+            return self._timed(fn, args, kwargs)
+
+        primary_pool, hedge_pool = _get_pools()
+        if not primary_pool.acquire():
+            self._count('primary_pool_full')
+            return self._timed(fn, args, kwargs)
+
+        cancel = {}
+        primary_cancel = threading.Event()
+        primary = self._submit(primary_pool, primary_cancel, fn, args, kwargs)
+        cancel[primary] = primary_cancel
+        hedge_delay = self.delay()
+        left = deadline.remaining()
+        if left is not None:
+            hedge_delay = min(hedge_delay, max(left, 0.0))
+
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+        if not deadline.allows(0):
+            # Request deadline too close to start a second attempt
+            return primary.result()
+        if not hedge_pool.acquire():
+            # Every hedge slot is busy: skip the hedge rather than queue it
+            self._count('hedge_pool_full')
+            return primary.result()
+        if not self.budget.spend():
+            hedge_pool.release()
+            self._count('budget_denied')
+            return primary.result()
+
+        self._count('hedges_sent')
+        hedge_cancel = threading.Event()
+        hedge = self._submit(hedge_pool, hedge_cancel, fn, args, kwargs)
+        cancel[hedge] = hedge_cancel
+        pending = {primary, hedge}
+        first_error = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # First good answer wins; the loser stops at its next retry
+                    for other in pending:
+                        if other.cancel():
+                            self._count('losers_cancelled')
+                        else:
+                            cancel[other].set()
+                            other.add_done_callback(self._loser_finished)
+                    self._count('hedge_wins' if future is hedge else 'primary_wins')
+                    return future.result()
+                if first_error is None or future is primary:
+                    first_error = future.exception()
+
+        raise first_error
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['enabled'] = self.enabled
+        stats['current_delay'] = round(self.delay(), 4)
+        stats['hedge_win_rate'] = (
+            stats['hedge_wins'] / stats['hedges_sent'] if stats['hedges_sent'] else 0.0
+        )
+        return stats
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(name: str) -> Hedger:
+    hedger = _hedgers.get(name)
+    if hedger is None:
+        with _hedgers_lock:
+            hedger = _hedgers.get(name)
+            if hedger is None:
+                hedger = Hedger(name)
+                _hedgers[name] = hedger
+    return hedger
+
+
+def get_stats() -> dict:
+    return {name: hedger.get_stats() for name, hedger in list(_hedgers.items())}
@@ -0,0 +1,436 @@
+"""
+Durable background job queue backed by the application database
+Webhooks persist their event as a job row and return; `flask kyc worker` processes
+jobs, claiming them with SELECT ... FOR UPDATE SKIP LOCKED so any number of workers
+can run side by side without a separate broker
+"""
+
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, func
+
+from app import db
+from app.models import Job
+from app.utils import deadline
+
+# Job queue configuration
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+# Retry delay: JOB_RETRY_BACKOFF * 2**(attempt-1) seconds with jitter, capped at JOB_RETRY_MAX_DELAY
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '5'))
+JOB_RETRY_MAX_DELAY = float(os.getenv('JOB_RETRY_MAX_DELAY', '600'))
+# A running job whose worker hasn't finished it within the lease is handed to another worker
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '300'))
+# Time budget for one job; outbound Sumsub calls and DB statements use what is left of it
+JOB_DEADLINE = float(os.getenv('JOB_DEADLINE', '120'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '10'))
+# Finished jobs are deleted after this many days (the worker prunes every JOB_PRUNE_INTERVAL seconds)
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', '7'))
+JOB_PRUNE_INTERVAL = float(os.getenv('JOB_PRUNE_INTERVAL', '3600'))
+JOB_PRUNE_BATCH = int(os.getenv('JOB_PRUNE_BATCH', '1000'))
+# Whether `flask kyc worker` processes run (default: when webhooks are accepted asynchronously);
+# without them, callers hand the jobs they queue to run_in_background()
+JOB_WORKER_ENABLED = os.getenv(
+    'JOB_WORKER_ENABLED', os.getenv('WEBHOOK_ASYNC', 'false')
+).lower() in ('1', 'true', 'yes')
+# Threads per process that run those jobs when there is no worker process
+JOB_INLINE_WORKERS = int(os.getenv('JOB_INLINE_WORKERS', '2'))
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_DEAD = 'dead'
+
+_handlers = {}
+_dead_handlers = {}
+
+_inline_executor = None
+_inline_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    'enqueued': 0,
+    'claimed': 0,
+    'succeeded': 0,
+    'retried': 0,
+    'dead': 0,
+    'lease_expired': 0,
+    'lease_lost': 0,
+    'pruned': 0,
+    'background': 0,
+}
+
+
+def _count(name: str, n: int = 1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def register(kind: str, handler, on_dead=None):
+    """
+    Register the function that processes jobs of `kind`; it receives the job payload
+    on_dead(payload), if given, runs in the same transaction that dead-letters a job
+    """
+    _handlers[kind] = handler
+    if on_dead is not None:
+        _dead_handlers[kind] = on_dead
+    return handler
+
+
+def enqueue(kind: str, payload: dict, delay: float = 0, max_attempts: int = None, commit: bool = True) -> Job:
+    """
+    Persist a job; with commit=False it joins the caller's transaction
+    """
+    job = Job(
+        kind=kind,
+        payload=payload,
+        status=STATUS_QUEUED,
+        max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+        run_at=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+    _count('enqueued')
+    return job
+
+
+def claim(worker_id: str, limit: int = None) -> list:
+    """
+    Claim up to `limit` due jobs for this worker; returns their ids
+    Rows locked by another worker's claim are skipped rather than waited on. The lease
+    is renewed when each job starts (see start()), so jobs waiting their turn in the
+    batch don't expire
+    """
+    now = datetime.utcnow()
+    jobs = db.session.execute(
+        select(Job)
+        .where(Job.status == STATUS_QUEUED, Job.run_at <= now)
+        .order_by(Job.run_at)
+        .limit(limit or JOB_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    for job in jobs:
+        job.status = STATUS_RUNNING
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.attempts += 1
+    job_ids = [job.id for job in jobs]
+    db.session.commit()
+
+    _count('claimed', len(job_ids))
+    return job_ids
+
+
+def run_now(job_ids: list, worker_id: str = None) -> list:
+    """
+    Claim specific queued jobs and run them in the calling thread (no worker process)
+    A job that fails is left queued for a retry like any other; returns the new statuses
+    """
+    worker_id = worker_id or f'inline:{socket.gethostname()}:{os.getpid()}'
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(job_ids), Job.status == STATUS_QUEUED)
+        .values(status=STATUS_RUNNING, locked_by=worker_id, locked_at=datetime.utcnow(),
+                attempts=Job.attempts + 1)
+        .returning(Job.id)
+    ).scalars().all()
+    db.session.commit()
+
+    _count('claimed', len(claimed))
+    return [run_job(job_id, worker_id) for job_id in claimed]
+
+
+def _get_inline_executor() -> ThreadPoolExecutor:
+    global _inline_executor
+    if _inline_executor is None:
+        with _inline_lock:
+            if _inline_executor is None:
+                _inline_executor = ThreadPoolExecutor(
+                    max_workers=JOB_INLINE_WORKERS, thread_name_prefix='job-inline'
+                )
+    return _inline_executor
+
+
+def run_in_background(app, job_ids: list) -> Future:
+    """
+    Run committed jobs with run_now() on a small thread pool, outside the caller's request
+    For setups without a worker process; jobs still queued if this process exits are
+    left for `flask kyc worker` or a later run
+    """
+    def _run():
+        with app.app_context():
+            try:
+                return run_now(job_ids)
+            except Exception as e:
+                print(f"⚠️  后台任务运行失败: {e}")
+                raise
+
+    _count('background', len(job_ids))
+    return _get_inline_executor().submit(_run)
+
+
+def retry_delay(attempts: int, error: Exception = None) -> float:
+    """
+    Exponential backoff with jitter; honours a retry_after hint on the error
+    """
+    delay = min(JOB_RETRY_BACKOFF * (2 ** max(attempts - 1, 0)), JOB_RETRY_MAX_DELAY)
+    delay *= random.uniform(0.8, 1.2)
+    hint = getattr(error, 'retry_after', None)
+    if hint:
+        delay = max(delay, float(hint))
+    return delay
+
+
+def start(job_id: str, worker_id: str) -> bool:
+    """
+    Renew a claimed job's lease as it starts running
+    Returns False if the lease was lost meanwhile (the job went back to the queue,
+    possibly to another worker) and the job must not run here
+    """
+    started = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == STATUS_RUNNING, Job.locked_by == worker_id)
+        .values(locked_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return started == 1
+
+
+def run_job(job_id: str, worker_id: str) -> str:
+    """
+    Run one job claimed by this worker and record the outcome; returns the job's new status
+    Nothing runs or is recorded unless the worker still holds the job's lease
+    """
+    if not start(job_id, worker_id):
+        _count('lease_lost')
+        job = db.session.get(Job, job_id)
+        return job.status if job else None
+
+    job = db.session.get(Job, job_id)
+    handler = _handlers.get(job.kind)
+    kind, payload, attempts, max_attempts = job.kind, job.payload, job.attempts, job.max_attempts
+    error = None
+    if handler is None:
+        error = LookupError(f'No handler registered for job kind {kind!r}')
+    else:
+        # A caller's own budget (e.g. a request running jobs) is never extended
+        token = deadline.start_within(JOB_DEADLINE)
+        try:
+            handler(payload)
+        except Exception as e:
+            db.session.rollback()
+            error = e
+        finally:
+            deadline.clear(token)
+
+    values = {'locked_by': None, 'locked_at': None}
+    if error is None:
+        values.update(status=STATUS_DONE, last_error=None)
+    elif attempts >= max_attempts or handler is None:
+        values.update(status=STATUS_DEAD, last_error=_format_error(error))
+    else:
+        values.update(
+            status=STATUS_QUEUED,
+            run_at=datetime.utcnow() + timedelta(seconds=retry_delay(attempts, error)),
+            last_error=_format_error(error)
+        )
+
+    # Only the lease holder records the outcome; a job whose lease expired mid-run belongs to another worker now
+    finished = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == STATUS_RUNNING, Job.locked_by == worker_id)
+        .values(**values)
+    ).rowcount
+    if not finished:
+        db.session.rollback()
+        _count('lease_lost')
+        print(f"⚠️  任务租约已失效，不记录结果 ({kind} {job_id})")
+        return None
+
+    status = values['status']
+    if status == STATUS_DONE:
+        _count('succeeded')
+    elif status == STATUS_DEAD:
+        _run_dead_handler(kind, payload)
+        _count('dead')
+        print(f"☠️  任务进入死信 ({kind} {job_id}, 第 {attempts} 次): {error}")
+    else:
+        _count('retried')
+        print(f"🔁 任务稍后重试 ({kind} {job_id}, 第 {attempts} 次): {error}")
+    db.session.commit()
+    return status
+
+
+def _run_dead_handler(kind: str, payload: dict):
+    on_dead = _dead_handlers.get(kind)
+    if on_dead is None:
+        return
+    try:
+        on_dead(payload)
+    except Exception as e:
+        print(f"⚠️  死信回调失败 ({kind}): {e}")
+
+
+def _format_error(error: Exception) -> str:
+    return ''.join(traceback.format_exception(type(error), error, error.__traceback__))[-4000:]
+
+
+def release(job_ids: list, worker_id: str):
+    """
+    Hand claimed but unstarted jobs back to the queue (e.g. on shutdown)
+    """
+    db.session.execute(
+        update(Job)
+        .where(Job.id.in_(job_ids), Job.status == STATUS_RUNNING, Job.locked_by == worker_id)
+        .values(status=STATUS_QUEUED, attempts=Job.attempts - 1, locked_by=None, locked_at=None)
+    )
+    db.session.commit()
+
+
+def release_expired_leases() -> int:
+    """
+    Return jobs held by a worker that died mid-job to the queue (or the dead letters)
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS)
+    jobs = db.session.execute(
+        select(Job)
+        .where(Job.status == STATUS_RUNNING, Job.locked_at < cutoff)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    for job in jobs:
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = STATUS_DEAD
+            job.last_error = 'Worker lease expired'
+            _run_dead_handler(job.kind, job.payload)
+            _count('dead')
+        else:
+            job.status = STATUS_QUEUED
+            job.run_at = datetime.utcnow()
+    db.session.commit()
+
+    if jobs:
+        _count('lease_expired', len(jobs))
+    return len(jobs)
+
+
+def retry_dead(kind: str = None) -> int:
+    """
+    Put dead-lettered jobs back in the queue with a fresh attempt budget
+    """
+    query = update(Job).where(Job.status == STATUS_DEAD)
+    if kind:
+        query = query.where(Job.kind == kind)
+    count = db.session.execute(
+        query.values(status=STATUS_QUEUED, attempts=0, run_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def counts() -> dict:
+    """
+    Number of jobs per status (queries the database)
+    """
+    rows = db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all()
+    return {status: count for status, count in rows}
+
+
+def queued_count() -> int:
+    """
+    Number of queued jobs (index-only on ix_jobs_claim; cheap enough to poll)
+    """
+    return db.session.execute(
+        select(func.count()).select_from(Job).where(Job.status == STATUS_QUEUED)
+    ).scalar_one()
+
+
+def prune(older_than_days: float = None, batch_size: int = None) -> int:
+    """
+    Delete finished jobs older than the retention period, a batch per transaction
+    Dead-lettered jobs are kept for retry_dead
+    """
+    days = JOB_RETENTION_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    batch_size = batch_size or JOB_PRUNE_BATCH
+    total = 0
+    while True:
+        ids = db.session.execute(
+            select(Job.id).where(Job.status == STATUS_DONE, Job.updated_at < cutoff).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.execute(delete(Job).where(Job.id.in_(ids), Job.status == STATUS_DONE))
+        db.session.commit()
+        total += len(ids)
+    if total:
+        _count('pruned', total)
+    return total
+
+
+def work(app, worker_id: str = None, batch: int = None, poll_interval: float = None,
+         once: bool = False, stop_event: threading.Event = None) -> int:
+    """
+    Worker loop: claim due jobs and run them until stopped; returns jobs processed
+    With once=True it drains what is due now and returns
+    """
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    poll_interval = JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    stop_event = stop_event or threading.Event()
+    processed = 0
+    pruned_at = 0.0
+
+    while not stop_event.is_set():
+        with app.app_context():
+            if JOB_PRUNE_INTERVAL > 0 and time.monotonic() - pruned_at >= JOB_PRUNE_INTERVAL:
+                prune()
+                pruned_at = time.monotonic()
+            release_expired_leases()
+            job_ids = claim(worker_id, batch)
+            for index, job_id in enumerate(job_ids):
+                if stop_event.is_set():
+                    release(job_ids[index:], worker_id)
+                    break
+                run_job(job_id, worker_id)
+                processed += 1
+            db.session.remove()
+
+        if not job_ids:
+            if once:
+                break
+            stop_event.wait(poll_interval)
+
+    return processed
+
+
+def install_signal_handlers(stop_event: threading.Event):
+    """
+    Stop the worker loop after the current job on SIGTERM/SIGINT
+    """
+    def _stop(signum, frame):
+        print("🛑 收到停止信号，处理完当前任务后退出")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['handlers'] = sorted(_handlers)
+    return stats
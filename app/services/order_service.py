@@ -0,0 +1,296 @@
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import select, literal, true, false, exists, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Order, Verification
+from app.services import sumsub_service, token_prewarmer, job_queue
+
+JOB_ORDER_CREATED = 'order_created'
+
+# Create order + verification with one INSERT ... ON CONFLICT statement on PostgreSQL
+# (false = the ORM path: SELECT, INSERT, commit, INSERT, commit; kept for benchmarking)
+ORDER_UPSERT = os.getenv('ORDER_UPSERT', 'true').lower() in ('1', 'true', 'yes')
+
+OrderResult = namedtuple('OrderResult', ['order_id', 'verification_id', 'verification_link', 'created'])
+
+# Columns the database requires; a batch row missing one would fail the whole multi-row insert
+REQUIRED_ORDER_FIELDS = ('taobao_order_id', 'buyer_id', 'buyer_name', 'buyer_email', 'platform')
+
+def build_order_data(data: dict) -> dict:
+    """
+    Map a Taobao/Xianyu order webhook payload onto Order columns
+    """
+    # buyer_id is optional - if not provided, use buyer_name or order_id
+    buyer_id = data.get('buyer_id')
+    if not buyer_id:
+        buyer_id = data.get('buyer_name', data.get('order_id', 'unknown'))
+
+    taobao_order_id = data.get('taobao_order_id') or data.get('order_id')
+    if isinstance(taobao_order_id, int) and not isinstance(taobao_order_id, bool):
+        # Marketplace order numbers sometimes arrive as JSON numbers
+        taobao_order_id = str(taobao_order_id)
+
+    return {
+        'taobao_order_id': taobao_order_id,
+        'buyer_id': buyer_id,
+        'buyer_name': data.get('buyer_name'),
+        'buyer_email': data.get('buyer_email'),
+        'buyer_phone': data.get('buyer_phone'),
+        'platform': data.get('platform', 'taobao'),
+        'order_amount': data.get('order_amount'),
+    }
+
+def create_order(order_data: dict) -> OrderResult:
+    """
+    Create the order and its verification, unless the order already exists
+    Duplicate deliveries get the existing order's ids back
+    """
+    if ORDER_UPSERT and db.engine.dialect.name == 'postgresql':
+        result = _create_order_upsert(order_data)
+    else:
+        result = _create_order_orm(order_data)
+
+    if result.created:
+        # Optionally generate the SDK token now so the buyer's first visit hits the cache
+        token_prewarmer.schedule(
+            f"order_{result.order_id}",
+            f"order_{result.order_id}",
+            order_data.get('buyer_email')
+        )
+
+    return result
+
+def _existing_order_query(taobao_order_id: str):
+    orders = Order.__table__
+    verifications = Verification.__table__
+    return (
+        select(
+            orders.c.id.label('order_id'),
+            verifications.c.id.label('verification_id'),
+            verifications.c.verification_link,
+            false().label('created')
+        )
+        .select_from(orders.outerjoin(verifications, verifications.c.order_id == orders.c.id))
+        .where(orders.c.taobao_order_id == taobao_order_id)
+    )
+
+def _create_order_upsert(order_data: dict) -> OrderResult:
+    """
+    One round trip, one transaction:
+
+        WITH new_order AS (INSERT INTO orders ... ON CONFLICT (taobao_order_id) DO NOTHING RETURNING id),
+             new_verification AS (INSERT INTO verifications SELECT ... FROM new_order RETURNING ...)
+        SELECT <new ids> FROM new_verification
+        UNION ALL
+        SELECT <existing ids> FROM orders LEFT JOIN verifications ... WHERE NOT EXISTS (SELECT FROM new_order)
+    """
+    orders = Order.__table__
+    verifications = Verification.__table__
+    now = datetime.utcnow()
+
+    order_id = str(uuid.uuid4())
+    order_values = dict(order_data, id=order_id, order_date=now, created_at=now, updated_at=now)
+    verification_values = dict(
+        sumsub_service.verification_fields(order_id),
+        id=str(uuid.uuid4()),
+        created_at=now,
+        updated_at=now
+    )
+
+    new_order = (
+        postgresql.insert(orders)
+        .values(**order_values)
+        .on_conflict_do_nothing(index_elements=[orders.c.taobao_order_id])
+        .returning(orders.c.id)
+        .cte('new_order')
+    )
+
+    # The verification row is only inserted if the order row was
+    columns = list(verification_values)
+    new_verification = (
+        verifications.insert()
+        .from_select(columns, select(*[
+            new_order.c.id if name == 'order_id'
+            else literal(verification_values[name], type_=verifications.c[name].type)
+            for name in columns
+        ]))
+        .returning(verifications.c.id, verifications.c.order_id, verifications.c.verification_link)
+        .cte('new_verification')
+    )
+
+    inserted = select(
+        new_verification.c.order_id,
+        new_verification.c.id.label('verification_id'),
+        new_verification.c.verification_link,
+        true().label('created')
+    )
+    existing = _existing_order_query(order_data['taobao_order_id']).where(
+        ~exists(select(new_order.c.id))
+    )
+
+    row = db.session.execute(union_all(inserted, existing)).first()
+    if row is None:
+        # A concurrent delivery committed after this statement's snapshot was taken:
+        # ON CONFLICT saw its row, the snapshot didn't. A fresh statement will.
+        row = db.session.execute(_existing_order_query(order_data['taobao_order_id'])).first()
+    db.session.commit()
+
+    return OrderResult(row.order_id, row.verification_id, row.verification_link, bool(row.created))
+
+def _create_order_orm(order_data: dict) -> OrderResult:
+    """
+    Portable path (SQLite, or ORDER_UPSERT=false)
+    """
+    existing_order = Order.query.filter_by(
+        taobao_order_id=order_data['taobao_order_id']
+    ).first()
+
+    if existing_order:
+        return _existing_result(existing_order)
+
+    try:
+        order = Order(**order_data)
+        db.session.add(order)
+        db.session.flush()
+
+        # Generate Sumsub verification link
+        verification = sumsub_service.create_verification(order)
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent delivery of the same order
+        db.session.rollback()
+        existing_order = Order.query.filter_by(
+            taobao_order_id=order_data['taobao_order_id']
+        ).first()
+        if existing_order is None:
+            raise
+        return _existing_result(existing_order)
+
+    return OrderResult(order.id, verification.id, verification.verification_link, True)
+
+def _existing_result(order: Order) -> OrderResult:
+    verification = order.verification
+    return OrderResult(
+        order.id,
+        verification.id if verification else None,
+        verification.verification_link if verification else None,
+        False
+    )
+
+def validate_order_data(order_data: dict):
+    """
+    Return an error message if the order can't be stored, else None
+    """
+    missing = [name for name in REQUIRED_ORDER_FIELDS if not order_data.get(name)]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    for name in ('taobao_order_id', 'buyer_id', 'buyer_name', 'buyer_email', 'platform', 'buyer_phone'):
+        value = order_data.get(name)
+        if value is not None and not isinstance(value, str):
+            return f'{name} must be a string'
+        limit = Order.__table__.c[name].type.length
+        if value and limit and len(value) > limit:
+            return f'{name} is longer than {limit} characters'
+    amount = order_data.get('order_amount')
+    if amount is not None and (isinstance(amount, bool) or not isinstance(amount, (int, float))):
+        return 'order_amount must be a number'
+    return None
+
+def _dialect_insert():
+    """
+    Dialect insert() supporting ON CONFLICT DO NOTHING, or None
+    """
+    return {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(db.engine.dialect.name)
+
+def create_orders(batch: list) -> list:
+    """
+    Create many validated orders with multi-row inserts (three statements, one transaction)
+    Orders that already exist, or repeat earlier in the batch, come back with created=False
+
+    Returns:
+        OrderResult per input order, in order
+    """
+    insert = _dialect_insert()
+    if insert is None:
+        return [create_order(order_data) for order_data in batch]
+
+    orders = Order.__table__
+    verifications = Verification.__table__
+    now = datetime.utcnow()
+
+    # First occurrence of an order id in the batch wins
+    rows = {}
+    for order_data in batch:
+        if order_data['taobao_order_id'] not in rows:
+            rows[order_data['taobao_order_id']] = dict(
+                order_data, id=str(uuid.uuid4()), order_date=now, created_at=now, updated_at=now
+            )
+
+    inserted = db.session.execute(
+        insert(orders)
+        .values(list(rows.values()))
+        .on_conflict_do_nothing(index_elements=[orders.c.taobao_order_id])
+        .returning(orders.c.taobao_order_id)
+    ).scalars().all()
+
+    results = {}
+    if inserted:
+        verification_rows = []
+        for taobao_order_id in inserted:
+            order_id = rows[taobao_order_id]['id']
+            fields = dict(
+                sumsub_service.verification_fields(order_id),
+                id=str(uuid.uuid4()),
+                created_at=now,
+                updated_at=now
+            )
+            verification_rows.append(fields)
+            results[taobao_order_id] = OrderResult(order_id, fields['id'], fields['verification_link'], True)
+        db.session.execute(verifications.insert().values(verification_rows))
+
+    existing_ids = [taobao_order_id for taobao_order_id in rows if taobao_order_id not in results]
+    if existing_ids:
+        existing = db.session.execute(
+            select(
+                orders.c.taobao_order_id,
+                orders.c.id,
+                verifications.c.id,
+                verifications.c.verification_link
+            )
+            .select_from(orders.outerjoin(verifications, verifications.c.order_id == orders.c.id))
+            .where(orders.c.taobao_order_id.in_(existing_ids))
+        ).all()
+        for taobao_order_id, order_id, verification_id, verification_link in existing:
+            results[taobao_order_id] = OrderResult(order_id, verification_id, verification_link, False)
+
+    db.session.commit()
+
+    output = []
+    seen = set()
+    for order_data in batch:
+        taobao_order_id = order_data['taobao_order_id']
+        result = results[taobao_order_id]
+        if taobao_order_id in seen:
+            result = result._replace(created=False)
+        seen.add(taobao_order_id)
+        output.append(result)
+
+    for order_data, result in zip(batch, output):
+        if result.created:
+            token_prewarmer.schedule(f"order_{result.order_id}", f"order_{result.order_id}", order_data.get('buyer_email'))
+
+    return output
+
+def handle_order_event(payload: dict):
+    """
+    Job handler for an order webhook accepted asynchronously
+    """
+    create_order(build_order_data(payload))
+
+job_queue.register(JOB_ORDER_CREATED, handle_order_event)
@@ -0,0 +1,332 @@
+"""
+Adaptive client-side rate limiter for outbound Sumsub calls
+Token bucket shared by every caller in the process (or across processes via the
+database), with AIMD rate control driven by 429 responses and Retry-After
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Rate limiter configuration
+SUMSUB_RATE_LIMIT = float(os.getenv('SUMSUB_RATE_LIMIT', '8'))            # max requests/sec
+SUMSUB_RATE_LIMIT_MIN = float(os.getenv('SUMSUB_RATE_LIMIT_MIN', '0.5'))  # floor after decreases
+SUMSUB_RATE_LIMIT_BURST = float(os.getenv('SUMSUB_RATE_LIMIT_BURST', '8'))
+# Additive increase: requests/sec regained per second without throttling
+SUMSUB_RATE_LIMIT_RECOVERY = float(os.getenv('SUMSUB_RATE_LIMIT_RECOVERY', '0.2'))
+# Multiplicative decrease applied on a 429
+SUMSUB_RATE_LIMIT_BACKOFF = float(os.getenv('SUMSUB_RATE_LIMIT_BACKOFF', '0.5'))
+# Longest a caller may queue for a slot before being rejected
+SUMSUB_RATE_LIMIT_MAX_WAIT = float(os.getenv('SUMSUB_RATE_LIMIT_MAX_WAIT', '10'))
+# memory = shared by threads in this process, database = shared by all processes
+SUMSUB_RATE_LIMIT_BACKEND = os.getenv('SUMSUB_RATE_LIMIT_BACKEND', 'memory')
+
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a caller would have to wait longer than allowed for a slot"""
+
+    def __init__(self, message: str, retry_after: float = DEFAULT_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, default: float = DEFAULT_RETRY_AFTER) -> float:
+    """
+    Parse a Retry-After header (delta-seconds or HTTP date) into seconds
+    """
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class _BucketMath:
+    """
+    Token bucket arithmetic shared by both backends
+    State: tokens, rate, updated_at, blocked_until, last_decrease_at (epoch seconds)
+    """
+
+    def __init__(self, max_rate, min_rate, burst, recovery, backoff):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.recovery = recovery
+        self.backoff = backoff
+
+    def refill(self, state, now):
+        elapsed = max(now - state['updated_at'], 0.0)
+        # Additive increase: regain rate steadily while not throttled
+        if now >= state['blocked_until']:
+            state['rate'] = min(self.max_rate, state['rate'] + self.recovery * elapsed)
+        state['tokens'] = min(self.burst, state['tokens'] + state['rate'] * elapsed)
+        state['updated_at'] = now
+
+    def reserve(self, state, now, max_wait):
+        """
+        Reserve one slot; returns seconds to wait, or None if that exceeds max_wait
+        Tokens may go negative: each waiter is queued behind the ones already reserved
+        """
+        self.refill(state, now)
+        wait = max(state['blocked_until'] - now, 0.0)
+        deficit = 1.0 - state['tokens']
+        if deficit > 0:
+            wait = max(wait, deficit / state['rate'])
+        if wait > max_wait:
+            return None
+        state['tokens'] -= 1.0
+        return wait
+
+    def throttle(self, state, now, retry_after):
+        self.refill(state, now)
+        state['blocked_until'] = max(state['blocked_until'], now + retry_after)
+        state['tokens'] = min(state['tokens'], 0.0)
+        # Multiplicative decrease at most once per second, so a burst of 429s
+        # from requests already in flight does not collapse the rate
+        if now - state['last_decrease_at'] >= 1.0:
+            state['rate'] = max(self.min_rate, state['rate'] * self.backoff)
+            state['last_decrease_at'] = now
+
+
+class MemoryBucket:
+    """Bucket state held in this process"""
+
+    def __init__(self, math: _BucketMath):
+        self.math = math
+        self._lock = threading.Lock()
+        self._state = {
+            'tokens': math.burst,
+            'rate': math.max_rate,
+            'updated_at': time.time(),
+            'blocked_until': 0.0,
+            'last_decrease_at': 0.0,
+        }
+
+    def reserve(self, max_wait):
+        with self._lock:
+            return self.math.reserve(self._state, time.time(), max_wait)
+
+    def throttle(self, retry_after):
+        with self._lock:
+            self.math.throttle(self._state, time.time(), retry_after)
+
+    def current_rate(self):
+        with self._lock:
+            self.math.refill(self._state, time.time())
+            return self._state['rate']
+
+
+class DatabaseBucket:
+    """
+    Bucket state in the rate_limit_buckets table, shared by every worker process
+    Each operation is one short SELECT ... FOR UPDATE transaction
+    """
+
+    STATE_COLUMNS = ('tokens', 'rate', 'updated_at', 'blocked_until', 'last_decrease_at')
+
+    def __init__(self, math: _BucketMath, name: str = 'sumsub', app=None):
+        self.math = math
+        self.name = name
+        self.app = app
+
+    def _initial_state(self, now):
+        return {
+            'tokens': self.math.burst,
+            'rate': self.math.max_rate,
+            'updated_at': now,
+            'blocked_until': 0.0,
+            'last_decrease_at': 0.0,
+        }
+
+    def _insert_missing(self, conn, table, now):
+        """
+        Create the bucket row unless it exists; processes starting together don't collide
+        """
+        values = dict(self._initial_state(now), name=self.name)
+        dialect = conn.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            conn.execute(insert(table).values(**values).on_conflict_do_nothing(index_elements=['name']))
+        elif dialect in ('mysql', 'mariadb'):
+            conn.execute(table.insert().prefix_with('IGNORE').values(**values))
+        else:
+            from sqlalchemy.exc import IntegrityError
+            try:
+                with conn.begin_nested():
+                    conn.execute(table.insert().values(**values))
+            except IntegrityError:
+                pass
+
+    def _run(self, fn):
+        if self.app is not None:
+            with self.app.app_context():
+                return fn()
+        return fn()
+
+    def _transact(self, fn):
+        from app import db
+        from app.models import RateLimitBucket
+
+        def _locked():
+            with db.engine.begin() as conn:
+                table = RateLimitBucket.__table__
+                select_row = table.select().where(table.c.name == self.name).with_for_update()
+                row = conn.execute(select_row).mappings().first()
+                if row is None:
+                    self._insert_missing(conn, table, time.time())
+                    row = conn.execute(select_row).mappings().first()
+                now = time.time()
+                state = {k: row[k] for k in self.STATE_COLUMNS}
+                result = fn(state, now)
+                conn.execute(table.update().where(table.c.name == self.name).values(**state))
+                return result
+
+        return self._run(_locked)
+
+    def reserve(self, max_wait):
+        return self._transact(lambda state, now: self.math.reserve(state, now, max_wait))
+
+    def throttle(self, retry_after):
+        self._transact(lambda state, now: self.math.throttle(state, now, retry_after))
+
+    def current_rate(self):
+        """Rate as of now, from a plain SELECT (no row lock, nothing written)"""
+        from app import db
+        from app.models import RateLimitBucket
+
+        def _read():
+            table = RateLimitBucket.__table__
+            with db.engine.connect() as conn:
+                row = conn.execute(table.select().where(table.c.name == self.name)).mappings().first()
+            if row is None:
+                return self.math.max_rate
+            state = {k: row[k] for k in self.STATE_COLUMNS}
+            self.math.refill(state, time.time())
+            return state['rate']
+
+        return self._run(_read)
+
+
+class AdaptiveRateLimiter:
+    """
+    Process-wide limiter in front of every outbound Sumsub call
+    """
+
+    def __init__(self, bucket=None, max_wait: float = None):
+        self.math = _BucketMath(
+            SUMSUB_RATE_LIMIT,
+            SUMSUB_RATE_LIMIT_MIN,
+            SUMSUB_RATE_LIMIT_BURST,
+            SUMSUB_RATE_LIMIT_RECOVERY,
+            SUMSUB_RATE_LIMIT_BACKOFF
+        )
+        self.bucket = bucket if bucket is not None else MemoryBucket(self.math)
+        self.max_wait = SUMSUB_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'rejections': 0,
+            'throttled': 0,
+            'waiting': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+        }
+
+    def acquire(self, max_wait: float = None) -> float:
+        """
+        Block until a request slot is available; returns the time spent queued
+
+        Raises:
+            RateLimitExceeded: if the slot is further away than max_wait
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        wait = self.bucket.reserve(max_wait)
+        if wait is None:
+            with self._lock:
+                self._stats['rejections'] += 1
+            raise RateLimitExceeded(f'Sumsub rate limit: no slot within {max_wait:.1f}s', retry_after=max_wait)
+
+        if wait > 0:
+            with self._lock:
+                self._stats['waiting'] += 1
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self._stats['waiting'] -= 1
+
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['total_wait_seconds'] += wait
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait)
+        return wait
+
+    def on_throttle(self, retry_after: float = None):
+        """
+        Record a 429: pause everyone for Retry-After and shrink the rate
+        """
+        with self._lock:
+            self._stats['throttled'] += 1
+        self.bucket.throttle(DEFAULT_RETRY_AFTER if retry_after is None else retry_after)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            stats['current_rate'] = round(self.bucket.current_rate(), 3)
+        except Exception as e:
+            stats['current_rate'] = None
+            stats['rate_error'] = str(e)
+        stats['max_rate'] = self.math.max_rate
+        stats['backend'] = type(self.bucket).__name__
+        stats['avg_wait_seconds'] = (
+            stats['total_wait_seconds'] / stats['acquired'] if stats['acquired'] else 0.0
+        )
+        return stats
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> AdaptiveRateLimiter:
+    """
+    Return the process-wide limiter (memory backend until init_app selects otherwise)
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = AdaptiveRateLimiter()
+    return _limiter
+
+
+def init_app(app):
+    """
+    Build the shared limiter; the database backend needs the app for its own transactions
+    """
+    global _limiter
+    with _limiter_lock:
+        if SUMSUB_RATE_LIMIT_BACKEND == 'database':
+            limiter = AdaptiveRateLimiter()
+            limiter.bucket = DatabaseBucket(limiter.math, app=app)
+            _limiter = limiter
+        elif _limiter is None:
+            _limiter = AdaptiveRateLimiter()
+    return _limiter
@@ -0,0 +1,201 @@
+"""
+Reconciliation of verifications stuck in pending
+A lost Sumsub webhook leaves a verification pending forever. This scans pending
+verifications older than a threshold in keyset-paginated batches, fetches their
+reviews through a bounded thread pool (every call still goes through the shared
+Sumsub rate limiter), applies the outcomes with bulk UPDATEs and saves a checkpoint
+after each batch so an interrupted run resumes where it stopped.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, tuple_
+
+from app import db
+from app.models import Verification, Checkpoint
+from app.services import sumsub_service, job_queue
+
+# Only verifications pending for longer than this are checked
+RECONCILE_MIN_AGE_MINUTES = int(os.getenv('RECONCILE_MIN_AGE_MINUTES', '60'))
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '200'))
+# Concurrent review fetches; the Sumsub rate limiter still caps the request rate
+RECONCILE_WORKERS = int(os.getenv('RECONCILE_WORKERS', '4'))
+
+CHECKPOINT_NAME = 'reconcile_pending'
+
+
+def review_outcome(review: dict) -> str:
+    """
+    Verification status a Sumsub review resolves to, or None while it isn't final
+    """
+    if not review or review.get('reviewStatus') != 'completed':
+        return None
+    result = review.get('reviewResult') or {}
+    if result.get('reviewAnswer') == 'GREEN':
+        return 'approved'
+    # RETRY rejections let the applicant resubmit; the verification stays pending
+    if result.get('reviewAnswer') == 'RED' and result.get('reviewRejectType') != 'RETRY':
+        return 'rejected'
+    return None
+
+
+def _load_checkpoint():
+    checkpoint = db.session.get(Checkpoint, CHECKPOINT_NAME)
+    if checkpoint is None or not checkpoint.cursor:
+        return None
+    return datetime.fromisoformat(checkpoint.cursor['created_at']), checkpoint.cursor['id']
+
+
+def _save_checkpoint(cursor):
+    checkpoint = db.session.get(Checkpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        checkpoint = Checkpoint(name=CHECKPOINT_NAME)
+        db.session.add(checkpoint)
+    checkpoint.cursor = {'created_at': cursor[0].isoformat(), 'id': cursor[1]} if cursor else None
+
+
+def _next_batch(cutoff: datetime, cursor, batch_size: int):
+    verifications = Verification.__table__
+    query = (
+        select(
+            verifications.c.id,
+            verifications.c.order_id,
+            verifications.c.sumsub_applicant_id,
+            verifications.c.created_at
+        )
+        .where(verifications.c.status == 'pending', verifications.c.created_at < cutoff)
+        .order_by(verifications.c.created_at, verifications.c.id)
+        .limit(batch_size)
+    )
+    if cursor is not None:
+        query = query.where(tuple_(verifications.c.created_at, verifications.c.id) > tuple_(*cursor))
+    return db.session.execute(query).all()
+
+
+def _fetch_review(app, applicant_id: str):
+    """
+    Returns (review, error); runs in a pool thread
+    """
+    with app.app_context():
+        try:
+            return sumsub_service.get_verification_result(applicant_id), None
+        except Exception as e:
+            return None, e
+
+
+def _apply(rows, fetched, stats: dict):
+    """
+    Bulk-update the verifications whose review is final and queue their reports
+    Rows a webhook resolved in the meantime are left alone (status guard)
+    """
+    verifications = Verification.__table__
+    now = datetime.utcnow()
+    by_status = {'approved': {}, 'rejected': {}}
+
+    for row, (review, error) in zip(rows, fetched):
+        if error is not None:
+            stats['errors'] += 1
+            continue
+        status = review_outcome(review)
+        if status is None:
+            stats['unchanged'] += 1
+        else:
+            by_status[status][row.id] = review
+
+    for status, reviews in by_status.items():
+        if not reviews:
+            continue
+        updated = db.session.execute(
+            update(verifications)
+            .where(verifications.c.id.in_(list(reviews)), verifications.c.status == 'pending')
+            .values(status=status, completed_at=now, updated_at=now)
+            .returning(verifications.c.id, verifications.c.order_id)
+        ).all()
+        for verification_id, order_id in updated:
+            sumsub_service.request_report(order_id, status, reviews[verification_id], commit=False)
+        stats[status] += len(updated)
+
+
+def reconcile(app, min_age_minutes: int = None, batch_size: int = None, workers: int = None,
+              restart: bool = False, max_batches: int = None, progress=None) -> dict:
+    """
+    Resolve old pending verifications from their Sumsub reviews
+
+    Args:
+        restart: ignore the saved checkpoint and scan from the oldest verification
+        max_batches: stop (keeping the checkpoint) after this many batches
+        progress: called with the running stats after each batch
+
+    Returns:
+        stats: batches, scanned, approved, rejected, unchanged, errors, seconds,
+        per_second, completed (False if the run stopped before the end of the scan)
+    """
+    min_age = RECONCILE_MIN_AGE_MINUTES if min_age_minutes is None else min_age_minutes
+    batch_size = batch_size or RECONCILE_BATCH_SIZE
+    workers = workers or RECONCILE_WORKERS
+    cutoff = datetime.utcnow() - timedelta(minutes=min_age)
+
+    stats = {
+        'batches': 0,
+        'scanned': 0,
+        'approved': 0,
+        'rejected': 0,
+        'unchanged': 0,
+        'errors': 0,
+        'completed': False,
+    }
+    started = time.monotonic()
+
+    def snapshot():
+        elapsed = time.monotonic() - started
+        stats['seconds'] = elapsed
+        stats['per_second'] = stats['scanned'] / elapsed if elapsed else 0.0
+        return dict(stats)
+
+    with app.app_context():
+        cursor = None if restart else _load_checkpoint()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as pool:
+            while max_batches is None or stats['batches'] < max_batches:
+                rows = _next_batch(cutoff, cursor, batch_size)
+                if not rows:
+                    # Full pass done; the next run starts from the beginning
+                    _save_checkpoint(None)
+                    db.session.commit()
+                    stats['completed'] = True
+                    break
+
+                fetched = list(pool.map(
+                    lambda row: _fetch_review(app, row.sumsub_applicant_id), rows
+                ))
+                unavailable = next(
+                    (error for _, error in fetched if isinstance(error, sumsub_service.SUMSUB_UNAVAILABLE_ERRORS)),
+                    None
+                )
+
+                _apply(rows, fetched, stats)
+                if unavailable is None:
+                    # Updates and the new position commit together
+                    cursor = (rows[-1].created_at, rows[-1].id)
+                    _save_checkpoint(cursor)
+                db.session.commit()
+
+                stats['batches'] += 1
+                stats['scanned'] += len(rows)
+                if progress is not None:
+                    progress(snapshot())
+
+                if unavailable is not None:
+                    # Keep the checkpoint before this batch; its unresolved rows are retried next run
+                    print(f"⚠️  Sumsub 暂不可用，对账在第 {stats['batches']} 批停止: {unavailable}")
+                    stats['stopped'] = str(unavailable)
+                    break
+
+        if not job_queue.JOB_WORKER_ENABLED:
+            # No worker process: generate the reports queued above before returning
+            job_queue.work(app, worker_id='reconcile', once=True)
+
+    return snapshot()
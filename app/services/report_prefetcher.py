@@ -0,0 +1,459 @@
+"""
+Background prefetch of Sumsub's own multi-language reports
+An approval queues one job per verification; the worker downloads every language's
+PDF and the JSON report concurrently through a bounded, process-wide thread pool,
+retrying each file on its own and recording per-file state in report_fetches so
+the report pages can tell "downloading" from "failed".
+The report pages also read through: a file that isn't on disk yet is downloaded on
+demand, and every request (or prefetch) wanting the same file shares one download.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as wait_futures
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Verification, ReportFetch
+from app.services import job_queue
+from app.services.sumsub_report_downloader import SumsubReportDownloader, ReportDownloadInProgress
+from app.utils import deadline
+
+# Prefetch configuration
+SUMSUB_REPORT_PREFETCH = os.getenv('SUMSUB_REPORT_PREFETCH', 'true').lower() in ('1', 'true', 'yes')
+# One PDF per language, plus the JSON report in the first language
+SUMSUB_REPORT_LANGUAGES = [lang.strip() for lang in os.getenv('SUMSUB_REPORT_LANGUAGES', 'en,zh').split(',') if lang.strip()]
+SUMSUB_REPORT_PREFETCH_WORKERS = int(os.getenv('SUMSUB_REPORT_PREFETCH_WORKERS', '4'))
+SUMSUB_REPORT_FILE_ATTEMPTS = int(os.getenv('SUMSUB_REPORT_FILE_ATTEMPTS', '3'))
+# Delay before the n-th retry of a file = backoff * 2^(n-1)
+SUMSUB_REPORT_RETRY_BACKOFF = float(os.getenv('SUMSUB_REPORT_RETRY_BACKOFF', '2'))
+# Report pages download missing files on demand, waiting up to this long before answering 202
+SUMSUB_REPORT_READ_THROUGH = os.getenv('SUMSUB_REPORT_READ_THROUGH', 'true').lower() in ('1', 'true', 'yes')
+SUMSUB_REPORT_READ_THROUGH_WAIT = float(os.getenv('SUMSUB_REPORT_READ_THROUGH_WAIT', '5'))
+# Retry-After of the 202 answered while a read-through download is still running
+READ_THROUGH_RETRY_AFTER = 2
+# A failed file isn't downloaded on demand again for this long; doubles with every failed round
+SUMSUB_REPORT_FAILED_COOLDOWN = float(os.getenv('SUMSUB_REPORT_FAILED_COOLDOWN', '60'))
+SUMSUB_REPORT_FAILED_MAX_COOLDOWN = float(os.getenv('SUMSUB_REPORT_FAILED_MAX_COOLDOWN', '3600'))
+
+JOB_PREFETCH_SUMSUB_REPORTS = 'prefetch_sumsub_reports'
+
+
+def report_files(languages: list = None) -> list:
+    """
+    (lang, format) of every file fetched for a verification
+    """
+    languages = languages or SUMSUB_REPORT_LANGUAGES
+    files = [(lang, 'pdf') for lang in languages]
+    if languages:
+        files.append((languages[0], 'json'))
+    return files
+
+
+def preview_files(lang: str) -> list:
+    """
+    Files behind a report preview: the language's PDF (configured languages only) and the JSON report
+    """
+    files = [(lang, 'pdf')] if lang in SUMSUB_REPORT_LANGUAGES else []
+    return files + [f for f in report_files() if f[1] == 'json']
+
+
+def file_key(lang: str, output_format: str) -> str:
+    """Key used by auto_download_on_approval's result: 'en_pdf', ..., 'json'"""
+    return 'json' if output_format == 'json' else f'{lang}_{output_format}'
+
+
+class ReportPrefetcher:
+    """
+    Bounded pool shared by every prefetch in this process
+    """
+
+    def __init__(self, workers: int = None, attempts: int = None, backoff: float = None):
+        self.workers = workers or SUMSUB_REPORT_PREFETCH_WORKERS
+        self.attempts = attempts or SUMSUB_REPORT_FILE_ATTEMPTS
+        self.backoff = SUMSUB_REPORT_RETRY_BACKOFF if backoff is None else backoff
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='report-prefetch')
+        self._lock = threading.Lock()
+        # (verification_id, lang, format) -> Future of the download running for it
+        self._downloads = {}
+        self._stats = {
+            'verifications': 0,
+            'files_downloaded': 0,
+            'files_skipped': 0,
+            'files_failed': 0,
+            'retries': 0,
+            'in_flight': 0,
+            'read_through': 0,
+            'read_through_shared': 0,
+            'read_through_timeouts': 0,
+            'read_through_cooldowns': 0,
+            'read_through_locked': 0,
+        }
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self._stats[name] += delta
+
+    def _download(self, app, verification_id: str, applicant_id: str, lang: str, output_format: str):
+        """
+        Download and save one file, retrying on failure; runs in a pool thread
+
+        Returns:
+            (path or None, attempts made, last error or None)
+
+        Raises:
+            ReportDownloadInProgress: another process is downloading the file
+        """
+        self._count('in_flight')
+        try:
+            with app.app_context():
+                for attempt in range(1, self.attempts + 1):
+                    if attempt > 1:
+                        self._count('retries')
+                        time.sleep(self.backoff * 2 ** (attempt - 2))
+                        # Checked through the manifest and the storage backend, so S3 refs are found too
+                        ref = SumsubReportDownloader.stored_report_ref(verification_id, lang, output_format)
+                        if ref:
+                            # Another process finished it while this one backed off
+                            return ref, attempt - 1, None
+                    saved = SumsubReportDownloader.download_report_to_file(
+                        verification_id,
+                        applicant_id,
+                        report_type='applicantReport',
+                        lang=lang,
+                        output_format=output_format
+                    )
+                    if saved:
+                        return saved['path'], attempt, None
+                return None, self.attempts, f'{lang}.{output_format}: no report after {self.attempts} attempts'
+        finally:
+            self._count('in_flight', -1)
+
+    def submit(self, app, verification_id: str, applicant_id: str, lang: str, output_format: str):
+        """
+        Future of the download of one file, joining the one already running for it if any
+
+        Returns:
+            (future, shared): shared is True if the download was already running
+        """
+        key = (verification_id, lang, output_format)
+        with self._lock:
+            future = self._downloads.get(key)
+            if future is not None and not future.done():
+                return future, True
+            future = self._executor.submit(self._download, app, verification_id, applicant_id, lang, output_format)
+            self._downloads[key] = future
+
+        def forget(done, key=key):
+            with self._lock:
+                if self._downloads.get(key) is done:
+                    del self._downloads[key]
+
+        future.add_done_callback(forget)
+        return future, False
+
+    def downloading(self, verification_id: str) -> list:
+        """
+        (lang, format) of the verification's files being downloaded in this process
+        """
+        with self._lock:
+            return [
+                (lang, output_format)
+                for (vid, lang, output_format), future in self._downloads.items()
+                if vid == verification_id and not future.done()
+            ]
+
+    def cooldown(self, row) -> float:
+        """
+        Seconds a failed file is left alone: the base cooldown, doubled for every failed round
+        """
+        rounds = max(1, -(-row.attempts // self.attempts))
+        return min(SUMSUB_REPORT_FAILED_COOLDOWN * 2 ** (rounds - 1), SUMSUB_REPORT_FAILED_MAX_COOLDOWN)
+
+    def _cooling_down(self, row) -> bool:
+        if row is None or row.status != 'failed' or row.updated_at is None:
+            return False
+        return datetime.utcnow() - row.updated_at < timedelta(seconds=self.cooldown(row))
+
+    def _record_failure(self, verification_id: str, lang: str, output_format: str, attempts: int, error: str):
+        """
+        Mark a file failed after a read-through download gave up, starting its cooldown
+        """
+        row = ReportFetch.query.filter_by(verification_id=verification_id, lang=lang, format=output_format).first()
+        if row is None:
+            row = ReportFetch(verification_id=verification_id, lang=lang, format=output_format)
+            db.session.add(row)
+        row.status = 'failed'
+        row.attempts = (row.attempts or 0) + attempts
+        row.last_error = error
+        row.updated_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # The prefetch job created the row meanwhile and records the outcome itself
+            db.session.rollback()
+
+    def read_through(self, verification_id: str, applicant_id: str, files: list, wait: float) -> dict:
+        """
+        Download the files not on disk yet, waiting at most `wait` seconds for them
+
+        Downloads keep running after the wait; asking again joins them instead of starting new ones.
+        A file that failed is answered as failed, without a new download, until its cooldown passes.
+        A file another process is downloading is pending.
+
+        Returns:
+            {'pending': [file_key, ...], 'failed': [file_key, ...]}
+        """
+        app = current_app._get_current_object()
+        fetches = {
+            (row.lang, row.format): row
+            for row in ReportFetch.query.filter_by(verification_id=verification_id).all()
+        }
+        # Read last, just before joining or starting downloads: one finishing in between would run again
+        on_disk = {
+            (report['lang'], report['format'])
+            for report in SumsubReportDownloader.list_reports_for_verification(verification_id)
+        }
+        futures = {}
+        failed = []
+        for lang, output_format in files:
+            if (lang, output_format) in on_disk:
+                continue
+            if self._cooling_down(fetches.get((lang, output_format))):
+                failed.append(file_key(lang, output_format))
+                self._count('read_through_cooldowns')
+                continue
+            future, shared = self.submit(app, verification_id, applicant_id, lang, output_format)
+            futures[future] = (lang, output_format, shared)
+            self._count('read_through_shared' if shared else 'read_through')
+
+        if not futures:
+            return {'pending': [], 'failed': sorted(failed)}
+
+        left = deadline.remaining()
+        if left is not None:
+            wait = min(wait, max(left, 0.0))
+        done, not_done = wait_futures(futures, timeout=wait)
+        if not_done:
+            self._count('read_through_timeouts')
+
+        pending = [file_key(*futures[f][:2]) for f in not_done]
+        for future in done:
+            lang, output_format, shared = futures[future]
+            try:
+                path, attempts, error = future.result()
+            except ReportDownloadInProgress:
+                # Another process holds the download lock: its download is still running
+                pending.append(file_key(lang, output_format))
+                self._count('read_through_locked')
+                continue
+            except Exception as e:
+                path, attempts, error = None, 1, str(e)
+            if path:
+                continue
+            failed.append(file_key(lang, output_format))
+            if not shared:
+                # Shared downloads are recorded by whoever started them
+                self._record_failure(verification_id, lang, output_format, attempts, error)
+        return {'pending': sorted(pending), 'failed': sorted(failed)}
+
+    def prefetch(self, verification_id: str, applicant_id: str, languages: list = None) -> dict:
+        """
+        Fetch every report file not on disk yet, all files concurrently
+        File state is committed to report_fetches as each download finishes
+
+        Returns:
+            {file_key: path} for the files now on disk
+        """
+        app = current_app._get_current_object()
+        files = report_files(languages)
+        rows = _fetch_rows(verification_id, files)
+
+        on_disk = {
+            (report['lang'], report['format']): report['path']
+            for report in SumsubReportDownloader.list_reports_for_verification(verification_id)
+        }
+        result = {}
+        todo = []
+        for lang, output_format in files:
+            row = rows[(lang, output_format)]
+            if (lang, output_format) in on_disk:
+                row.status = 'done'
+                row.path = on_disk[(lang, output_format)]
+                result[file_key(lang, output_format)] = row.path
+                self._count('files_skipped')
+            else:
+                row.status = 'downloading'
+                todo.append((lang, output_format))
+        db.session.commit()
+        self._count('verifications')
+
+        futures = {
+            self.submit(app, verification_id, applicant_id, lang, output_format)[0]: (lang, output_format)
+            for lang, output_format in todo
+        }
+        for future in as_completed(futures):
+            lang, output_format = futures[future]
+            row = rows[(lang, output_format)]
+            try:
+                path, attempts, error = future.result()
+            except ReportDownloadInProgress:
+                # Another process is downloading it; the job retries once that is done
+                continue
+            except Exception as e:
+                path, attempts, error = None, 1, str(e)
+            row.attempts += attempts
+            row.last_error = error
+            if path:
+                row.status = 'done'
+                row.path = path
+                result[file_key(lang, output_format)] = path
+                self._count('files_downloaded')
+            else:
+                row.status = 'failed'
+                self._count('files_failed')
+            db.session.commit()
+
+        return result
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['downloading'] = len(self._downloads)
+        stats['workers'] = self.workers
+        stats['attempts_per_file'] = self.attempts
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+def _fetch_rows(verification_id: str, files: list) -> dict:
+    """
+    report_fetches rows for the files, created as 'queued' if missing (not committed)
+    """
+    rows = {
+        (row.lang, row.format): row
+        for row in ReportFetch.query.filter_by(verification_id=verification_id).all()
+    }
+    for lang, output_format in files:
+        if (lang, output_format) not in rows:
+            row = ReportFetch(verification_id=verification_id, lang=lang, format=output_format, status='queued')
+            db.session.add(row)
+            rows[(lang, output_format)] = row
+    return rows
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> ReportPrefetcher:
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = ReportPrefetcher()
+    return _prefetcher
+
+
+def schedule(verification_id: str, commit: bool = True):
+    """
+    Queue the prefetch of an approved verification's reports (no-op when disabled)
+    Files already downloaded are not fetched again
+    """
+    if not SUMSUB_REPORT_PREFETCH:
+        return None
+    rows = _fetch_rows(verification_id, report_files())
+    if all(row.status == 'done' for row in rows.values()):
+        return None
+    for row in rows.values():
+        if row.status == 'failed':
+            row.status = 'queued'
+    return job_queue.enqueue(JOB_PREFETCH_SUMSUB_REPORTS, {'verification_id': verification_id}, commit=commit)
+
+
+def fetch_status(verification_id: str) -> dict:
+    """
+    Overall download state for the report pages: not_requested, downloading, failed or available
+    """
+    files = {
+        file_key(row.lang, row.format): row.status
+        for row in ReportFetch.query.filter_by(verification_id=verification_id).all()
+    }
+    # Downloads read-through requests started in this process
+    if _prefetcher is not None:
+        for lang, output_format in _prefetcher.downloading(verification_id):
+            files[file_key(lang, output_format)] = 'downloading'
+    statuses = set(files.values())
+    if not files:
+        status = 'not_requested'
+    elif statuses == {'done'}:
+        status = 'available'
+    elif statuses & {'queued', 'downloading'}:
+        status = 'downloading'
+    else:
+        status = 'failed'
+    return {'status': status, 'files': files}
+
+
+def read_through(verification, files: list = None, wait: float = None) -> dict:
+    """
+    Make sure an approved verification's report files are on disk, downloading missing ones on demand
+
+    Waits up to `wait` seconds (SUMSUB_REPORT_READ_THROUGH_WAIT, capped by the request
+    deadline); concurrent requests for the same file share one download
+
+    Returns:
+        {'reports': files on disk (list_reports_for_verification), 'pending': [file_key, ...],
+         'failed': [file_key, ...]}
+    """
+    result = {'pending': [], 'failed': []}
+    if SUMSUB_REPORT_READ_THROUGH and verification.status == 'approved' and verification.sumsub_applicant_id:
+        result = get_prefetcher().read_through(
+            verification.id,
+            verification.sumsub_applicant_id,
+            report_files() if files is None else files,
+            SUMSUB_REPORT_READ_THROUGH_WAIT if wait is None else wait
+        )
+    result['reports'] = SumsubReportDownloader.list_reports_for_verification(verification.id)
+    return result
+
+
+def _handle_prefetch_job(payload: dict):
+    """
+    Job handler: fetch the files; fail the job (retried with backoff) if any file is missing
+    """
+    verification = db.session.get(Verification, payload['verification_id'])
+    if verification is None or verification.status != 'approved':
+        return
+    files = get_prefetcher().prefetch(verification.id, verification.sumsub_applicant_id)
+    missing = len(report_files()) - len(files)
+    if missing:
+        raise Exception(f'{missing} Sumsub report file(s) failed to download')
+
+
+def _prefetch_job_dead(payload: dict):
+    """
+    Out of retries: nothing is downloading any more
+    """
+    ReportFetch.query.filter(
+        ReportFetch.verification_id == payload.get('verification_id'),
+        ReportFetch.status.in_(('queued', 'downloading'))
+    ).update({'status': 'failed'}, synchronize_session=False)
+
+
+job_queue.register(JOB_PREFETCH_SUMSUB_REPORTS, _handle_prefetch_job, on_dead=_prefetch_job_dead)
+
+
+def get_stats() -> dict:
+    if _prefetcher is None:
+        return {'enabled': SUMSUB_REPORT_PREFETCH, 'languages': SUMSUB_REPORT_LANGUAGES}
+    stats = _prefetcher.get_stats()
+    stats['enabled'] = SUMSUB_REPORT_PREFETCH
+    stats['languages'] = SUMSUB_REPORT_LANGUAGES
+    return stats
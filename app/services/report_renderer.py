@@ -0,0 +1,178 @@
+"""
+PDF report rendering in a process pool
+reportlab rendering is CPU-bound; running it in separate processes keeps it from
+holding the GIL while request and worker threads wait on I/O
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from app.services import report_service
+from app.utils import deadline
+from app.utils.deadline import DeadlineExceeded
+
+# Renderer configuration
+REPORT_RENDER_WORKERS = int(os.getenv('REPORT_RENDER_WORKERS', '2'))
+# process = render in the pool, inline = render in the calling thread (debugging, tiny deployments)
+REPORT_RENDER_POOL = os.getenv('REPORT_RENDER_POOL', 'process')
+REPORT_RENDER_TIMEOUT = float(os.getenv('REPORT_RENDER_TIMEOUT', '60'))
+# spawn avoids forking a process that already runs threads (pools, prewarmers, workers)
+REPORT_RENDER_START_METHOD = os.getenv('REPORT_RENDER_START_METHOD', 'spawn')
+
+
+class ReportRenderer:
+    """
+    Bounded pool of rendering processes shared by every thread in this process
+    """
+
+    def __init__(self, workers: int = None, mode: str = None):
+        self.workers = workers or REPORT_RENDER_WORKERS
+        self.mode = mode or REPORT_RENDER_POOL
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'rendered': 0,
+            'failed': 0,
+            'in_flight': 0,
+            'pool_restarts': 0,
+            'timeouts': 0,
+            'abandoned': 0,
+            'total_render_seconds': 0.0,
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(REPORT_RENDER_START_METHOD)
+                )
+            return self._executor
+
+    def _reset_executor(self, terminate: bool = False, executor: ProcessPoolExecutor = None):
+        with self._lock:
+            if executor is not None and self._executor is not executor:
+                # That pool was already replaced
+                return
+            if self._executor is not None:
+                # shutdown() lets running renders finish; a stuck one has to be killed
+                processes = list((self._executor._processes or {}).values()) if terminate else []
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                for process in processes:
+                    process.terminate()
+                self._executor = None
+            self._stats['pool_restarts'] += 1
+
+    def render(self, order_snapshot: dict, verification_result: dict, timeout: float = None) -> str:
+        """
+        Render a report and wait for it; returns the PDF path
+
+        Raises:
+            DeadlineExceeded: if the caller's time budget can't cover the wait, or the
+                render doesn't finish within it. A render that exceeds its own limit
+                (REPORT_RENDER_TIMEOUT) is killed with the pool; one that only outlasts
+                the caller's budget is left to finish without anyone waiting for it
+        """
+        limit = REPORT_RENDER_TIMEOUT if timeout is None else timeout
+        timeout = deadline.timeout(limit, what='PDF rendering')
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['in_flight'] += 1
+        started = time.monotonic()
+        try:
+            if self.mode == 'inline':
+                pdf_path = report_service.render_report_pdf(order_snapshot, verification_result)
+            else:
+                executor = self._get_executor()
+                future = executor.submit(
+                    report_service.render_report_pdf, order_snapshot, verification_result
+                )
+                try:
+                    pdf_path = future.result(timeout=timeout)
+                except FutureTimeoutError:
+                    if not future.cancel():
+                        if timeout < limit:
+                            # Only the caller's budget ran out: killing the pool would also
+                            # kill other callers' renders, so stop waiting and let it finish
+                            self._watch(future, executor, limit - timeout)
+                        else:
+                            # Stuck past its own limit: the only way to stop it is to kill the pool
+                            self._reset_executor(terminate=True, executor=executor)
+                    with self._lock:
+                        self._stats['timeouts'] += 1
+                    raise DeadlineExceeded(f'PDF rendering took longer than {timeout:.1f}s')
+        except BrokenProcessPool:
+            # A rendering process died (e.g. OOM-killed); start a fresh pool for the next call
+            self._reset_executor()
+            self._count_failure()
+            raise
+        except BaseException:
+            self._count_failure()
+            raise
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+
+        with self._lock:
+            self._stats['rendered'] += 1
+            self._stats['total_render_seconds'] += time.monotonic() - started
+        return pdf_path
+
+    def _watch(self, future, executor: ProcessPoolExecutor, seconds: float):
+        """
+        Kill the pool if an abandoned render is still running once it reaches its own limit
+        """
+        def _expire():
+            if not future.done():
+                self._reset_executor(terminate=True, executor=executor)
+
+        timer = threading.Timer(seconds, _expire)
+        timer.daemon = True
+        future.add_done_callback(lambda _: timer.cancel())
+        timer.start()
+        with self._lock:
+            self._stats['abandoned'] += 1
+
+    def _count_failure(self):
+        with self._lock:
+            self._stats['failed'] += 1
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['mode'] = self.mode
+        stats['avg_render_seconds'] = (
+            stats['total_render_seconds'] / stats['rendered'] if stats['rendered'] else 0.0
+        )
+        return stats
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> ReportRenderer:
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = ReportRenderer()
+    return _renderer
+
+
+def get_stats() -> dict:
+    if _renderer is None:
+        return {'workers': REPORT_RENDER_WORKERS, 'mode': REPORT_RENDER_POOL, 'submitted': 0}
+    return _renderer.get_stats()
@@ -6,17 +6,40 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.pdfgen import canvas
 from datetime import datetime
 import os
-from app.models import Order
+import re
+import tempfile
+from app import db
+from app.models import Order, Report
+from app.services import report_storage
+from app.utils import storage_layout
 
-REPORTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'reports')
+# Generated PDFs; shared by the web and worker processes (same volume in docker-compose)
+REPORTS_DIR = os.getenv('REPORTS_DIR', os.path.join(os.path.dirname(__file__), '..', 'reports'))
+# kyc_report_{order_id}_{YYYYmmdd}_{HHMMSS}.pdf
+REPORT_FILENAME_PATTERN = re.compile(r'^kyc_report_(.+)_\d{8}_\d{6}\.pdf$')
 
 def ensure_reports_dir():
     """Ensure reports directory exists"""
     os.makedirs(REPORTS_DIR, exist_ok=True)
 
+def snapshot_order(order: Order) -> dict:
+    """
+    Plain-data copy of everything the PDF needs, so rendering can run in another process
+    """
+    return {
+        'id': order.id,
+        'taobao_order_id': order.taobao_order_id,
+        'platform': order.platform,
+        'buyer_name': order.buyer_name,
+        'buyer_email': order.buyer_email,
+        'order_amount': order.order_amount,
+        'order_date': order.order_date.strftime('%Y-%m-%d %H:%M:%S') if order.order_date else None,
+        'verification_status': order.verification.status if order.verification else None,
+    }
+
 def generate_report_pdf(order: Order, verification_result: dict) -> str:
     """
-    Generate PDF report for KYC verification
+    Generate PDF report for KYC verification in this process
     
     Args:
         order: Order object
@@ -25,16 +48,24 @@ def generate_report_pdf(order: Order, verification_result: dict) -> str:
     Returns:
         Path to generated PDF file
     """
+    return render_report_pdf(snapshot_order(order), verification_result)
+
+def render_report_pdf(order: dict, verification_result: dict) -> str:
+    """
+    Render the PDF from an order snapshot (see snapshot_order)
+    Only takes plain data, so it can run in the report renderer's process pool
+    
+    Returns:
+        Storage ref of the generated PDF (local path or s3://bucket/key, see report_storage)
+    """
     try:
-        ensure_reports_dir()
-        
         # Create PDF filename
         timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        pdf_filename = f"kyc_report_{order.id}_{timestamp}.pdf"
-        pdf_path = os.path.join(REPORTS_DIR, pdf_filename)
+        pdf_filename = f"kyc_report_{order['id']}_{timestamp}.pdf"
         
-        # Create PDF document
-        doc = SimpleDocTemplate(pdf_path, pagesize=A4)
+        # Create PDF document (built in a temp file, then streamed to report storage)
+        buffer = tempfile.TemporaryFile()
+        doc = SimpleDocTemplate(buffer, pagesize=A4)
         elements = []
         
         # Get styles
@@ -72,9 +103,9 @@ def generate_report_pdf(order: Order, verification_result: dict) -> str:
         elements.append(Paragraph("报告信息", heading_style))
         
         report_info = [
-            ['报告ID', order.id],
+            ['报告ID', order['id']],
             ['生成时间', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')],
-            ['验证状态', order.verification.status.upper() if order.verification else 'N/A'],
+            ['验证状态', order['verification_status'].upper() if order['verification_status'] else 'N/A'],
         ]
         
         table = Table(report_info, colWidths=[2*inch, 4*inch])
@@ -95,12 +126,12 @@ def generate_report_pdf(order: Order, verification_result: dict) -> str:
         elements.append(Paragraph("订单信息", heading_style))
         
         order_info = [
-            ['订单ID', order.taobao_order_id],
-            ['平台', order.platform.upper()],
-            ['买家名称', order.buyer_name],
-            ['买家邮箱', order.buyer_email],
-            ['订单金额', f"¥ {order.order_amount:.2f}" if order.order_amount else 'N/A'],
-            ['订单日期', order.order_date.strftime('%Y-%m-%d %H:%M:%S') if order.order_date else 'N/A'],
+            ['订单ID', order['taobao_order_id']],
+            ['平台', order['platform'].upper()],
+            ['买家名称', order['buyer_name']],
+            ['买家邮箱', order['buyer_email']],
+            ['订单金额', f"¥ {order['order_amount']:.2f}" if order['order_amount'] else 'N/A'],
+            ['订单日期', order['order_date'] or 'N/A'],
         ]
         
         table2 = Table(order_info, colWidths=[2*inch, 4*inch])
@@ -120,7 +151,7 @@ def generate_report_pdf(order: Order, verification_result: dict) -> str:
         # Add verification result
         elements.append(Paragraph("验证结果", heading_style))
         
-        verification_status = order.verification.status.upper() if order.verification else 'UNKNOWN'
+        verification_status = order['verification_status'].upper() if order['verification_status'] else 'UNKNOWN'
         status_color = colors.green if verification_status == 'APPROVED' else colors.red if verification_status == 'REJECTED' else colors.orange
         
         status_text = f"<font color='{status_color.hexval()}' size='14'><b>{verification_status}</b></font>"
@@ -150,9 +181,54 @@ def generate_report_pdf(order: Order, verification_result: dict) -> str:
         )))
         
         # Build PDF
-        doc.build(elements)
+        with buffer:
+            doc.build(elements)
+            buffer.seek(0)
+            saved = report_storage.get_backend().save(
+                'reports', REPORTS_DIR, order['id'], pdf_filename,
+                report_storage.iter_file(buffer), content_type='application/pdf'
+            )
         
-        return pdf_path
+        return saved['ref']
         
     except Exception as e:
         raise Exception(f'Failed to generate PDF: {str(e)}')
+
+def resolve_report_pdf(report: Report):
+    """
+    Path of a report's PDF on disk, looking in both storage layouts if the stored path moved
+    PDFs in remote storage are returned as stored
+    
+    Returns:
+        Path or storage ref, or None if the file is gone
+    """
+    if not report.pdf_path:
+        return None
+    if not report_storage.is_local(report.pdf_path):
+        return report.pdf_path
+    if os.path.isfile(report.pdf_path):
+        return report.pdf_path
+    return storage_layout.resolve(REPORTS_DIR, report.order_id, os.path.basename(report.pdf_path))
+
+def migrate_reports_layout(batch_size: int = 500, dry_run: bool = False, progress=None) -> dict:
+    """
+    Move generated PDFs from the flat reports directory into their shards,
+    repointing reports.pdf_path batch by batch (see storage_layout.migrate_flat_files)
+    """
+    def owner_of(filename):
+        match = REPORT_FILENAME_PATTERN.match(filename)
+        return match.group(1) if match else None
+    
+    def on_moved(moves):
+        for report in Report.query.filter(Report.pdf_path.in_(list(moves))):
+            report.pdf_path = moves[report.pdf_path]
+        db.session.commit()
+    
+    return storage_layout.migrate_flat_files(
+        REPORTS_DIR,
+        owner_of,
+        on_moved=on_moved,
+        batch_size=batch_size,
+        dry_run=dry_run,
+        progress=progress
+    )
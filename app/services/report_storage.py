@@ -0,0 +1,491 @@
+"""
+Pluggable storage for report files
+Reports are written and read through a backend chosen by REPORT_STORAGE_BACKEND:
+'local' keeps them on this container's disk (sharded, see app.utils.storage_layout),
+'s3' puts them in an S3-compatible bucket (AWS S3, MinIO, ...) so any replica can
+serve any report. Both stream: writes go out in parts of bounded size, reads come
+back in chunks, and downloads can be handed off (pre-signed URL redirect, or nginx
+X-Accel-Redirect for local files) so report bytes don't pass through Flask workers.
+
+What the database stores for a file is its ref: the local path, or s3://bucket/key.
+Reads pick the backend from the ref, so both kinds of ref stay readable after the
+write backend is switched.
+"""
+
+import hashlib
+import hmac
+import os
+import tempfile
+import threading
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+import requests
+from flask import Response, jsonify, redirect, send_file
+from requests.adapters import HTTPAdapter
+
+from app.utils import storage_layout
+
+# 'local' (default) or 's3'; where new report files are written
+REPORT_STORAGE_BACKEND = os.getenv('REPORT_STORAGE_BACKEND', 'local').lower()
+# Local downloads: internal nginx location mapped to the report directories ('' = send from Flask)
+REPORT_STORAGE_LOCAL_ACCEL_PREFIX = os.getenv('REPORT_STORAGE_LOCAL_ACCEL_PREFIX', '')
+
+# S3-compatible backend
+REPORT_STORAGE_S3_ENDPOINT = os.getenv('REPORT_STORAGE_S3_ENDPOINT', 'https://s3.amazonaws.com')
+REPORT_STORAGE_S3_BUCKET = os.getenv('REPORT_STORAGE_S3_BUCKET', 'kyc-reports')
+REPORT_STORAGE_S3_REGION = os.getenv('REPORT_STORAGE_S3_REGION', 'us-east-1')
+REPORT_STORAGE_S3_ACCESS_KEY = os.getenv('REPORT_STORAGE_S3_ACCESS_KEY', '')
+REPORT_STORAGE_S3_SECRET_KEY = os.getenv('REPORT_STORAGE_S3_SECRET_KEY', '')
+REPORT_STORAGE_S3_PREFIX = os.getenv('REPORT_STORAGE_S3_PREFIX', '')
+# Multipart part size; S3 requires at least 5 MB for every part but the last
+REPORT_STORAGE_S3_PART_SIZE = int(os.getenv('REPORT_STORAGE_S3_PART_SIZE', str(8 * 1024 * 1024)))
+# Lifetime of pre-signed download URLs
+REPORT_STORAGE_URL_EXPIRES = int(os.getenv('REPORT_STORAGE_URL_EXPIRES', '300'))
+
+READ_CHUNK = 64 * 1024
+S3_SCHEME = 's3://'
+
+
+class StorageError(Exception):
+    """Raised when the storage backend rejects or fails an operation"""
+
+
+def is_local(ref: str) -> bool:
+    return not ref.startswith(S3_SCHEME)
+
+
+def iter_file(fileobj, chunk_size: int = READ_CHUNK):
+    return iter(lambda: fileobj.read(chunk_size), b'')
+
+
+def write_atomically(filepath: str, chunks, expected_size: int = None) -> dict:
+    """
+    Write chunks to a hidden temp file next to filepath, fsync it and rename it into place
+
+    Returns:
+        {'path': ..., 'size': ..., 'sha256': ...}
+
+    Raises:
+        IOError: if fewer bytes than expected_size arrived (the connection broke)
+    """
+    directory = os.path.dirname(filepath)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filepath)}.", suffix='.tmp')
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if expected_size is not None and size != expected_size:
+            raise IOError(f'Truncated report: got {size} of {expected_size} bytes')
+
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    fsync_dir(directory)
+    return {'path': filepath, 'size': size, 'sha256': digest.hexdigest()}
+
+
+def fsync_dir(directory: str):
+    """Persist directory entries so a rename survives a power loss"""
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+class LocalStorage:
+    """
+    Files on this container's disk, in each namespace's base directory
+    """
+
+    name = 'local'
+
+    def __init__(self, accel_prefix: str = None):
+        self.accel_prefix = REPORT_STORAGE_LOCAL_ACCEL_PREFIX if accel_prefix is None else accel_prefix
+
+    def save(self, namespace: str, base_dir: str, owner_id, filename: str, chunks, content_type: str = None) -> dict:
+        """
+        Returns:
+            {'ref': ..., 'size': ..., 'sha256': ...}
+        """
+        saved = write_atomically(storage_layout.write_path(base_dir, owner_id, filename), chunks)
+        saved['ref'] = saved.pop('path')
+        return saved
+
+    def save_file(self, namespace: str, base_dir: str, owner_id, filename: str, path: str,
+                  content_type: str = None) -> dict:
+        """
+        Store a finished local file (already in place when it was written to its write path)
+        """
+        target = storage_layout.write_path(base_dir, owner_id, filename)
+        if os.path.abspath(path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        digest = hashlib.sha256()
+        with open(target, 'rb') as f:
+            for chunk in iter_file(f):
+                digest.update(chunk)
+        return {'ref': target, 'size': os.path.getsize(target), 'sha256': digest.hexdigest()}
+
+    def exists(self, ref: str) -> bool:
+        return os.path.isfile(ref)
+
+    def open(self, ref: str):
+        """Iterator over the file's bytes in chunks"""
+        with open(ref, 'rb') as f:
+            yield from iter_file(f)
+
+    def delete(self, ref: str):
+        try:
+            os.remove(ref)
+        except FileNotFoundError:
+            pass
+
+    def download_response(self, ref: str, download_name: str, mimetype: str):
+        if not os.path.isfile(ref):
+            return jsonify({'error': 'Report file not found'}), 404
+        if self.accel_prefix:
+            # nginx serves the file from its internal location (aliased to '/'); the worker only sends headers
+            response = Response(status=200, mimetype=mimetype)
+            response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+            response.headers['X-Accel-Redirect'] = self.accel_prefix.rstrip('/') + quote(os.path.abspath(ref))
+            return response
+        return send_file(ref, mimetype=mimetype, as_attachment=True, download_name=download_name)
+
+    def get_stats(self) -> dict:
+        return {'backend': self.name, 'accel_redirect': bool(self.accel_prefix)}
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def _uri_encode(value: str, safe: str = '-_.~') -> str:
+    return quote(value, safe=safe)
+
+
+def _query_string(query: dict) -> str:
+    return '&'.join(f'{_uri_encode(k)}={_uri_encode(str(v))}' for k, v in sorted(query.items()))
+
+
+class S3Storage:
+    """
+    Objects in an S3-compatible bucket, addressed path-style (endpoint/bucket/key)
+
+    Requests are signed with AWS Signature Version 4. Uploads are multipart once they
+    outgrow one part, so memory use is bounded by part_size whatever the report size.
+    """
+
+    name = 's3'
+
+    def __init__(self, endpoint: str = None, bucket: str = None, region: str = None, access_key: str = None,
+                 secret_key: str = None, prefix: str = None, part_size: int = None, url_expires: int = None,
+                 pool_size: int = 10):
+        self.endpoint = (endpoint or REPORT_STORAGE_S3_ENDPOINT).rstrip('/')
+        self.bucket = bucket or REPORT_STORAGE_S3_BUCKET
+        self.region = region or REPORT_STORAGE_S3_REGION
+        self.access_key = REPORT_STORAGE_S3_ACCESS_KEY if access_key is None else access_key
+        self.secret_key = REPORT_STORAGE_S3_SECRET_KEY if secret_key is None else secret_key
+        self.prefix = REPORT_STORAGE_S3_PREFIX if prefix is None else prefix
+        self.part_size = part_size or REPORT_STORAGE_S3_PART_SIZE
+        self.url_expires = url_expires or REPORT_STORAGE_URL_EXPIRES
+        self._host = urlsplit(self.endpoint).netloc
+
+        self.session = requests.Session()
+        self.session.mount(self.endpoint, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._lock = threading.Lock()
+        self._stats = {
+            'uploads': 0,
+            'multipart_uploads': 0,
+            'parts': 0,
+            'aborted_uploads': 0,
+            'bytes_uploaded': 0,
+            'presigned_urls': 0,
+            'errors': 0,
+        }
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self._stats[name] += delta
+
+    # -- refs and keys ---------------------------------------------------
+
+    def key_for(self, namespace: str, owner_id, filename: str) -> str:
+        """<prefix><namespace>/<shard>/<filename>, sharded like the local layout"""
+        return self.prefix + '/'.join([namespace, storage_layout.sharded_path('', owner_id, filename).lstrip('/')])
+
+    def _split_ref(self, ref: str):
+        bucket, _, key = ref[len(S3_SCHEME):].partition('/')
+        return bucket, key
+
+    # -- signing ---------------------------------------------------------
+
+    def _scope(self, date: str) -> str:
+        return f'{date}/{self.region}/s3/aws4_request'
+
+    def _signature(self, date: str, string_to_sign: str) -> str:
+        key = _hmac(f'AWS4{self.secret_key}'.encode(), date)
+        for part in (self.region, 's3', 'aws4_request'):
+            key = _hmac(key, part)
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def _canonical(self, method: str, path: str, query: dict, headers: dict, payload_hash: str):
+        canonical_query = _query_string(query)
+        names = sorted(headers)
+        canonical_headers = ''.join(f'{name}:{str(headers[name]).strip()}\n' for name in names)
+        signed_headers = ';'.join(names)
+        request = '\n'.join([method, _uri_encode(path, safe='/-_.~'), canonical_query,
+                             canonical_headers, signed_headers, payload_hash])
+        return request, signed_headers
+
+    def _path(self, bucket: str, key: str) -> str:
+        return f'/{bucket}/{key}'
+
+    def _request(self, method: str, key: str, query: dict = None, body: bytes = b'', headers: dict = None,
+                 stream: bool = False, bucket: str = None):
+        bucket = bucket or self.bucket
+        path = self._path(bucket, key)
+        query = query or {}
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        payload_hash = hashlib.sha256(body).hexdigest()
+
+        signed = {'host': self._host, 'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date}
+        canonical_request, signed_headers = self._canonical(method, path, query, signed, payload_hash)
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, self._scope(now.strftime('%Y%m%d')),
+            hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+        request_headers = dict(headers or {})
+        request_headers.update({
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+            'Authorization': (
+                f'AWS4-HMAC-SHA256 Credential={self.access_key}/{self._scope(now.strftime("%Y%m%d"))}, '
+                f'SignedHeaders={signed_headers}, '
+                f'Signature={self._signature(now.strftime("%Y%m%d"), string_to_sign)}'
+            ),
+        })
+
+        url = self.endpoint + _uri_encode(path, safe='/-_.~')
+        if query:
+            # Same encoding as the signed canonical query string
+            url += '?' + _query_string(query)
+        try:
+            response = self.session.request(method, url, data=body or None,
+                                            headers=request_headers, stream=stream, timeout=60)
+        except requests.RequestException as e:
+            self._count('errors')
+            raise StorageError(f'{method} {key}: {e}')
+        if response.status_code >= 300 and not (method == 'HEAD' and response.status_code == 404):
+            self._count('errors')
+            detail = response.text[:300] if not stream else response.reason
+            response.close()
+            raise StorageError(f'{method} {key}: HTTP {response.status_code} {detail}')
+        return response
+
+    def presign(self, ref: str, method: str = 'GET', expires: int = None, params: dict = None) -> str:
+        """
+        URL granting `method` on the object for `expires` seconds, without credentials
+        """
+        bucket, key = self._split_ref(ref)
+        path = self._path(bucket, key)
+        now = datetime.now(timezone.utc)
+        date = now.strftime('%Y%m%d')
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        query = dict(params or {})
+        query.update({
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f'{self.access_key}/{self._scope(date)}',
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(expires or self.url_expires),
+            'X-Amz-SignedHeaders': 'host',
+        })
+        canonical_request, _ = self._canonical(method, path, query, {'host': self._host}, 'UNSIGNED-PAYLOAD')
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, self._scope(date),
+            hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+        query['X-Amz-Signature'] = self._signature(date, string_to_sign)
+        self._count('presigned_urls')
+        return self.endpoint + _uri_encode(path, safe='/-_.~') + '?' + _query_string(query)
+
+    # -- writes ----------------------------------------------------------
+
+    def save(self, namespace: str, base_dir: str, owner_id, filename: str, chunks, content_type: str = None) -> dict:
+        """
+        Stream chunks into the bucket: one PUT if they fit in a part, a multipart upload otherwise
+
+        Returns:
+            {'ref': 's3://bucket/key', 'size': ..., 'sha256': ...}
+        """
+        key = self.key_for(namespace, owner_id, filename)
+        headers = {'Content-Type': content_type or 'application/octet-stream'}
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                digest.update(chunk)
+                size += len(chunk)
+                buffer += chunk
+                while len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        upload_id = self._start_multipart(key, headers)
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer[:self.part_size])))
+                    del buffer[:self.part_size]
+
+            if upload_id is None:
+                self._request('PUT', key, body=bytes(buffer), headers=headers).close()
+            else:
+                if buffer:
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                self._complete_multipart(key, upload_id, parts)
+        except BaseException:
+            if upload_id is not None:
+                self._abort_multipart(key, upload_id)
+            raise
+
+        self._count('uploads')
+        self._count('bytes_uploaded', size)
+        return {'ref': f'{S3_SCHEME}{self.bucket}/{key}', 'size': size, 'sha256': digest.hexdigest()}
+
+    def save_file(self, namespace: str, base_dir: str, owner_id, filename: str, path: str,
+                  content_type: str = None) -> dict:
+        """Upload a finished local file, reading it part by part"""
+        with open(path, 'rb') as f:
+            return self.save(namespace, base_dir, owner_id, filename, iter_file(f, self.part_size), content_type)
+
+    def _start_multipart(self, key: str, headers: dict) -> str:
+        response = self._request('POST', key, query={'uploads': ''}, headers=headers)
+        upload_id = ElementTree.fromstring(response.content).findtext('{*}UploadId')
+        if not upload_id:
+            raise StorageError(f'POST {key}?uploads: no UploadId in response')
+        self._count('multipart_uploads')
+        return upload_id
+
+    def _upload_part(self, key: str, upload_id: str, number: int, data: bytes):
+        response = self._request('PUT', key, query={'partNumber': str(number), 'uploadId': upload_id}, body=data)
+        response.close()
+        self._count('parts')
+        return number, response.headers.get('ETag', '')
+
+    def _complete_multipart(self, key: str, upload_id: str, parts: list):
+        body = '<CompleteMultipartUpload>' + ''.join(
+            f'<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>' for number, etag in parts
+        ) + '</CompleteMultipartUpload>'
+        response = self._request('POST', key, query={'uploadId': upload_id}, body=body.encode(),
+                                 headers={'Content-Type': 'application/xml'})
+        # S3 can report a failed completion in a 200 response
+        if b'<Error>' in response.content:
+            raise StorageError(f'POST {key}?uploadId: {response.text[:300]}')
+
+    def _abort_multipart(self, key: str, upload_id: str):
+        self._count('aborted_uploads')
+        try:
+            self._request('DELETE', key, query={'uploadId': upload_id}).close()
+        except StorageError as e:
+            print(f"⚠️  分片上传取消失败 (将由存储桶生命周期规则清理): {e}")
+
+    # -- reads -----------------------------------------------------------
+
+    def exists(self, ref: str) -> bool:
+        bucket, key = self._split_ref(ref)
+        response = self._request('HEAD', key, bucket=bucket)
+        response.close()
+        return response.status_code == 200
+
+    def open(self, ref: str):
+        """Iterator over the object's bytes in chunks"""
+        bucket, key = self._split_ref(ref)
+        response = self._request('GET', key, bucket=bucket, stream=True)
+        try:
+            yield from response.iter_content(chunk_size=READ_CHUNK)
+        finally:
+            response.close()
+
+    def delete(self, ref: str):
+        bucket, key = self._split_ref(ref)
+        self._request('DELETE', key, bucket=bucket).close()
+
+    def download_response(self, ref: str, download_name: str, mimetype: str):
+        """Redirect to a pre-signed URL; the bucket serves the bytes"""
+        url = self.presign(ref, params={
+            'response-content-disposition': f'attachment; filename="{download_name}"',
+            'response-content-type': mimetype,
+        })
+        return redirect(url, code=302)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'backend': self.name, 'bucket': self.bucket, 'part_size': self.part_size})
+        return stats
+
+
+_backends = {}
+_lock = threading.Lock()
+
+
+def _get(name: str):
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = S3Storage() if name == 's3' else LocalStorage()
+                _backends[name] = backend
+    return backend
+
+
+def get_backend():
+    """
+    Process-wide backend new report files are written to (REPORT_STORAGE_BACKEND)
+    """
+    return _get('s3' if REPORT_STORAGE_BACKEND == 's3' else 'local')
+
+
+def backend_for(ref: str):
+    """
+    Backend holding the file a stored ref points to
+    """
+    return _get('local' if is_local(ref) else 's3')
+
+
+def download_response(ref: str, download_name: str, mimetype: str = 'application/octet-stream'):
+    """
+    Response for downloading a stored report, handed off to the storage where possible
+    """
+    return backend_for(ref).download_response(ref, download_name, mimetype)
+
+
+def get_stats() -> dict:
+    stats = {name: backend.get_stats() for name, backend in list(_backends.items())}
+    stats['write_backend'] = REPORT_STORAGE_BACKEND
+    return stats
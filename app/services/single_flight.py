@@ -0,0 +1,133 @@
+"""
+Single-flight request coalescing
+Concurrent callers asking for the same key wait on one in-flight call and share its result
+"""
+
+import os
+import threading
+
+from app.utils import deadline
+
+# Default time a follower waits for the in-flight call before giving up
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '20'))
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when a follower stops waiting for the in-flight call"""
+
+    retry_after = 1.0
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    A group of keyed calls; at most one call per key runs at a time
+    """
+
+    def __init__(self, name: str, default_timeout: float = None):
+        self.name = name
+        self.default_timeout = SINGLE_FLIGHT_TIMEOUT if default_timeout is None else default_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'executions': 0,
+            'coalesced': 0,
+            'timeouts': 0,
+            'errors': 0,
+        }
+
+    def do(self, key, fn, *args, timeout: float = None, **kwargs):
+        """
+        Run fn(*args, **kwargs) for `key`, or wait for the call already running for it
+
+        Args:
+            key: hashable key identifying the call
+            fn: callable doing the real work
+            timeout: how long a follower waits for this key (defaults to the group timeout)
+
+        Raises:
+            SingleFlightTimeout: if a follower waited longer than `timeout`
+            DeadlineExceeded: if the request deadline arrived first
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+                self._stats['executions'] += 1
+            else:
+                call.followers += 1
+                leader = False
+                self._stats['coalesced'] += 1
+
+        if leader:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self._stats['errors'] += 1
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.event.set()
+            return call.result
+
+        wait = self.default_timeout if timeout is None else timeout
+        left = deadline.remaining()
+        limited_by_deadline = left is not None and left < wait
+        if limited_by_deadline:
+            wait = max(left, 0.0)
+        if not call.event.wait(wait):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            if limited_by_deadline:
+                raise deadline.DeadlineExceeded(f'{self.name}: request deadline reached waiting for {key!r}')
+            raise SingleFlightTimeout(f'{self.name}: timed out after {wait}s waiting for {key!r}')
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        # Every coalesced call is an outbound request that was not made
+        stats['saved_calls'] = stats['coalesced']
+        return stats
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name: str, default_timeout: float = None) -> SingleFlight:
+    """
+    Return the named process-wide single-flight group, creating it on first use
+    """
+    group = _groups.get(name)
+    if group is None:
+        with _groups_lock:
+            group = _groups.get(name)
+            if group is None:
+                group = SingleFlight(name, default_timeout)
+                _groups[name] = group
+    return group
+
+
+def get_stats() -> dict:
+    return {name: group.get_stats() for name, group in list(_groups.items())}
@@ -0,0 +1,313 @@
+"""
+Shared Sumsub HTTP client
+One keep-alive connection pool per process, used by every module that talks to Sumsub
+"""
+
+import os
+import hmac
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.services import rate_limiter
+from app.services import circuit_breaker
+from app.services import hedging
+from app.utils import deadline
+
+# Connection pool configuration
+SUMSUB_POOL_SIZE = int(os.getenv('SUMSUB_POOL_SIZE', '10'))
+SUMSUB_POOL_WARMUP = os.getenv('SUMSUB_POOL_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+SUMSUB_POOL_WARMUP_CONNECTIONS = int(os.getenv('SUMSUB_POOL_WARMUP_CONNECTIONS', '2'))
+# 429 responses are retried here (through the shared rate limiter), not by urllib3
+SUMSUB_THROTTLE_RETRIES = int(os.getenv('SUMSUB_THROTTLE_RETRIES', '2'))
+# Connection errors and 5xx are retried with exponential backoff, budget permitting
+SUMSUB_MAX_RETRIES = int(os.getenv('SUMSUB_MAX_RETRIES', '3'))
+SUMSUB_RETRY_BACKOFF = float(os.getenv('SUMSUB_RETRY_BACKOFF', '1'))
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class SumsubClient:
+    """
+    Process-wide Sumsub API client
+
+    Holds a single requests.Session whose HTTPAdapter keeps up to `pool_size`
+    keep-alive connections to the Sumsub host, and signs every request in one place.
+    """
+
+    def __init__(self, app_token=None, secret_key=None, api_url=None, pool_size=None, limiter=None):
+        self.app_token = app_token if app_token is not None else os.getenv('SUMSUB_APP_TOKEN')
+        self.secret_key = secret_key if secret_key is not None else os.getenv('SUMSUB_SECRET_KEY')
+        self.api_url = (api_url or os.getenv('SUMSUB_API_URL', 'https://api.sumsub.com')).rstrip('/')
+        self.pool_size = pool_size or SUMSUB_POOL_SIZE
+        self._limiter = limiter
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'in_flight': 0,
+            'max_in_flight': 0,
+            'warmed_connections': 0,
+        }
+
+        # Retries live in request() so they can respect the caller's deadline
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=0,
+            pool_block=False
+        )
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def sign(self, method: str, path: str, body: str = ''):
+        """
+        Generate HMAC-SHA256 signature for a Sumsub API request
+        Format per official docs: {timestamp}{method}{path}{body}
+        Timestamp is in seconds (Unix Epoch); path includes the query string
+        """
+        if not self.secret_key:
+            raise Exception('SUMSUB_SECRET_KEY is not configured')
+
+        ts = str(int(time.time()))
+        signature_raw = f"{ts}{method.upper()}{path}{body or ''}"
+
+        signature = hmac.new(
+            self.secret_key.encode(),
+            signature_raw.encode(),
+            hashlib.sha256
+        ).hexdigest()
+
+        return ts, signature
+
+    def build_headers(self, ts: str, signature: str, accept: str = 'application/json') -> dict:
+        """
+        Build request headers for Sumsub API (X-App-Token auth)
+        """
+        return {
+            'X-App-Token': self.app_token,
+            'X-App-Access-Sig': signature,
+            'X-App-Access-Ts': ts,
+            'Content-Type': 'application/json',
+            'Accept': accept,
+        }
+
+    def request(self, method: str, path: str, params: dict = None, body: str = None,
+                accept: str = 'application/json', timeout: float = 15, family: str = None, **kwargs):
+        """
+        Send a signed request to Sumsub over the pooled session
+
+        Args:
+            method: HTTP method
+            path: API path, e.g. '/resources/accessTokens/sdk'
+            params: optional query parameters (signed as part of the path)
+            body: optional pre-serialized JSON body
+            accept: Accept header value
+            timeout: request timeout in seconds
+            family: endpoint family whose circuit breaker guards this call
+
+        Returns:
+            requests.Response
+
+        Raises:
+            RateLimitExceeded: if no rate limiter slot frees up in time
+            CircuitOpenError: if the family's breaker is open
+            DeadlineExceeded: if the request's time budget runs out
+            HedgeCancelled: if this is a hedged attempt and the other one already answered
+        """
+        method = method.upper()
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        kwargs.setdefault('allow_redirects', False)
+
+        if family is None:
+            return self._request_with_limiter(method, path, body, accept, timeout, kwargs)
+
+        breaker = circuit_breaker.get_breaker(family)
+        breaker.before_call()
+        try:
+            response = self._request_with_limiter(method, path, body, accept, timeout, kwargs)
+        except (rate_limiter.RateLimitExceeded, deadline.DeadlineExceeded, hedging.HedgeCancelled):
+            breaker.record_neutral()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def _request_with_limiter(self, method, path, body, accept, timeout, kwargs):
+        extra_headers = kwargs.pop('headers', None) or {}
+        limiter = self.limiter
+        throttle_retries = 0
+        retries = 0
+
+        while True:
+            # A hedged attempt that lost the race stops before sending another request
+            hedging.check_cancelled()
+            # Wait for a slot in the shared token bucket, never past the request deadline
+            left = deadline.remaining()
+            if left is None:
+                limiter.acquire()
+            else:
+                if left < deadline.DEADLINE_MIN_ATTEMPT:
+                    raise deadline.DeadlineExceeded(f'No time left to call Sumsub {path}')
+                limiter.acquire(max_wait=min(limiter.max_wait, left - deadline.DEADLINE_MIN_ATTEMPT))
+            attempt_timeout = deadline.timeout(timeout, what=f'Sumsub {path}')
+
+            ts, signature = self.sign(method, path, body or '')
+            headers = self.build_headers(ts, signature, accept=accept)
+            headers.update(extra_headers)
+
+            try:
+                response = self._send(method, path, body, headers, attempt_timeout, kwargs)
+            except requests.Timeout as e:
+                if attempt_timeout < timeout:
+                    # Cut short by the request deadline, not a Sumsub fault
+                    raise deadline.DeadlineExceeded(f'Sumsub {path} did not answer within the remaining budget') from e
+                backoff = SUMSUB_RETRY_BACKOFF * (2 ** retries)
+                if retries >= SUMSUB_MAX_RETRIES or not deadline.allows(backoff):
+                    raise
+                retries += 1
+                hedging.pause(backoff)
+                continue
+            except requests.ConnectionError:
+                backoff = SUMSUB_RETRY_BACKOFF * (2 ** retries)
+                if retries >= SUMSUB_MAX_RETRIES or not deadline.allows(backoff):
+                    raise
+                retries += 1
+                hedging.pause(backoff)
+                continue
+
+            if response.status_code == 429:
+                retry_after = rate_limiter.parse_retry_after(response.headers.get('Retry-After'))
+                limiter.on_throttle(retry_after)
+                if throttle_retries >= SUMSUB_THROTTLE_RETRIES or not deadline.allows(retry_after):
+                    return response
+                throttle_retries += 1
+                response.close()
+                continue
+
+            if response.status_code in RETRY_STATUSES:
+                backoff = SUMSUB_RETRY_BACKOFF * (2 ** retries)
+                if retries >= SUMSUB_MAX_RETRIES or not deadline.allows(backoff):
+                    return response
+                retries += 1
+                response.close()
+                hedging.pause(backoff)
+                continue
+
+            return response
+
+    @property
+    def limiter(self):
+        return self._limiter if self._limiter is not None else rate_limiter.get_limiter()
+
+    def _send(self, method, path, body, headers, timeout, kwargs):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['in_flight'] += 1
+            self._stats['max_in_flight'] = max(self._stats['max_in_flight'], self._stats['in_flight'])
+
+        try:
+            return self.session.request(
+                method,
+                f'{self.api_url}{path}',
+                data=body.encode() if body else None,
+                headers=headers,
+                timeout=timeout,
+                **kwargs
+            )
+        except Exception:
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+
+    def warm_up(self, connections: int = None):
+        """
+        Open keep-alive connections to the Sumsub host ahead of the first real request
+        Any HTTP response counts: we only care that TCP+TLS is established and pooled
+        """
+        connections = min(connections or SUMSUB_POOL_WARMUP_CONNECTIONS, self.pool_size)
+
+        def _open():
+            try:
+                response = self.session.head(self.api_url, timeout=5, allow_redirects=False)
+                response.close()
+                with self._lock:
+                    self._stats['warmed_connections'] += 1
+            except Exception as e:
+                print(f"⚠️  Sumsub 连接预热失败: {e}")
+
+        threads = [threading.Thread(target=_open, daemon=True) for _ in range(connections)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def get_stats(self) -> dict:
+        """
+        Report request counters and connection pool usage
+        """
+        with self._lock:
+            stats = dict(self._stats)
+
+        pools = []
+        poolmanager = self.adapter.poolmanager
+        for key in list(poolmanager.pools.keys()):
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': pool.host,
+                'port': pool.port,
+                'connections_opened': pool.num_connections,
+                'requests_sent': pool.num_requests,
+                'idle_connections': pool.pool.qsize() if pool.pool is not None else 0,
+                'max_size': self.pool_size,
+            })
+
+        stats['pool_size'] = self.pool_size
+        stats['pools'] = pools
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> SumsubClient:
+    """
+    Return the process-wide Sumsub client, creating it on first use
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SumsubClient()
+    return _client
+
+
+def init_app(app):
+    """
+    Create the shared client when a worker boots and warm its pool in the background
+    """
+    client = get_client()
+    if SUMSUB_POOL_WARMUP and client.app_token and not app.testing:
+        threading.Thread(target=client.warm_up, daemon=True, name='sumsub-warmup').start()
+    return client
@@ -4,24 +4,42 @@ Sumsub 报告下载和集成服务
 """
 
 import os
-import requests
-import hmac
-import hashlib
-import time
+import re
 import json
-from datetime import datetime
+import base64
+import hashlib
+from datetime import datetime, timezone
+from sqlalchemy.exc import IntegrityError
 from app import db
-from app.models import Verification
+from app.models import Verification, ReportFile
+from app.services.sumsub_client import get_client
+from app.services.circuit_breaker import FAMILY_REPORT_DOWNLOAD
+from app.services import report_storage
+from app.utils import storage_layout
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock on partial downloads
+    fcntl = None
+
+class ReportDownloadInProgress(Exception):
+    """同一报告文件正由其他进程下载（持有 .part 文件锁），稍后再查"""
+
 
 class SumsubReportDownloader:
     """Sumsub 报告下载器"""
     
-    SUMSUB_APP_TOKEN = os.getenv('SUMSUB_APP_TOKEN')
-    SUMSUB_SECRET_KEY = os.getenv('SUMSUB_SECRET_KEY')
-    SUMSUB_API_URL = os.getenv('SUMSUB_API_URL', 'https://api.sumsub.com')
+    # 报告存储目录（web 与 worker 进程共用，docker-compose 中挂载同一个卷）
+    REPORT_STORAGE_DIR = os.getenv('SUMSUB_REPORT_STORAGE_DIR', '/opt/kyc-app/reports/sumsub')
+    
+    # 流式下载每次读取的字节数（内存占用与报告大小无关）
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
     
-    # 报告存储目录
-    REPORT_STORAGE_DIR = '/opt/kyc-app/reports/sumsub'
+    # 断点续传：每写入这么多字节 fsync 一次并更新 sidecar，中断后从这里继续
+    RESUME_CHECKPOINT_BYTES = 1024 * 1024
+    
+    # 报告文件名：kyc_report_{verification_id}_{applicant_id}_{lang}.{format}（verification_id 是 UUID，不含 '_'）
+    REPORT_FILENAME_PATTERN = re.compile(r'^kyc_report_([^_]+)_(.+)_([^_.]+)\.(\w+)$')
     
     @staticmethod
     def _ensure_storage_dir():
@@ -29,31 +47,10 @@ class SumsubReportDownloader:
         if not os.path.exists(SumsubReportDownloader.REPORT_STORAGE_DIR):
             os.makedirs(SumsubReportDownloader.REPORT_STORAGE_DIR, exist_ok=True)
     
-    @staticmethod
-    def _get_signature(method: str, path: str, body: str = ''):
-        """
-        生成 Sumsub API 签名
-        格式：{timestamp}{method}{path}{body}，timestamp 为秒级 Unix Epoch
-        """
-        if not SumsubReportDownloader.SUMSUB_SECRET_KEY:
-            raise Exception('SUMSUB_SECRET_KEY is not configured')
-        
-        ts = str(int(time.time()))  # 秒级时间戳
-        request_body = body if body else ''
-        signature_raw = f"{ts}{method}{path}{request_body}"
-        
-        signature = hmac.new(
-            SumsubReportDownloader.SUMSUB_SECRET_KEY.encode(),
-            signature_raw.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        return ts, signature
-    
     @staticmethod
     def download_report(applicant_id, report_type='applicantReport', lang='en', output_format='pdf'):
         """
-        从 Sumsub 下载报告
+        从 Sumsub 下载报告（整个报告读入内存；保存到磁盘请用 download_report_to_file）
         隐藏 API: GET /resources/applicants/{applicantId}/summary/report?report=applicantReport&lang={lang}
         
         参数：
@@ -74,26 +71,18 @@ class SumsubReportDownloader:
             'lang': lang
         }
         
-        # 生成签名
-        ts, signature = SumsubReportDownloader._get_signature('GET', path)
-        
-        # 请求头
-        headers = {
-            'X-App-Token': SumsubReportDownloader.SUMSUB_APP_TOKEN,
-            'X-App-Access-Sig': signature,
-            'X-App-Access-Ts': ts,
-            'Accept': 'application/pdf' if output_format == 'pdf' else 'application/json'
-        }
-        
         print(f"📥 下载 Sumsub 报告: {applicant_id}")
         print(f"   Language: {lang}, Format: {output_format}")
         
         try:
-            response = requests.get(
-                f"{SumsubReportDownloader.SUMSUB_API_URL}{path}",
+            # 通过共享连接池发送签名请求（签名包含查询参数）
+            response = get_client().request(
+                'GET',
+                path,
                 params=params,
-                headers=headers,
-                timeout=30
+                accept='application/pdf' if output_format == 'pdf' else 'application/json',
+                timeout=30,
+                family=FAMILY_REPORT_DOWNLOAD
             )
             
             print(f"   HTTP Status: {response.status_code}")
@@ -113,10 +102,283 @@ class SumsubReportDownloader:
             traceback.print_exc()
             return None
     
+    @staticmethod
+    def download_report_to_file(verification_id, applicant_id, report_type='applicantReport', lang='en', output_format='pdf'):
+        """
+        从 Sumsub 流式下载报告并原子写入存储目录，支持断点续传
+        数据边下载边追加到隐藏的 .part 文件，每 RESUME_CHECKPOINT_BYTES 字节 fsync 一次并把
+        已落盘的字节数、这些字节的 sha256 和报告的 ETag / Last-Modified 记录到 sidecar（.part.json）；
+        中断后再次调用时先校验已有部分，再用 HTTP Range（有校验值时带 If-Range）只请求缺失的部分。
+        服务器没有提供 ETag / Last-Modified 时，续传要求 206 的 Content-Range 起点和总长度与记录一致
+        （假设同一份报告长度不变即内容不变；服务器提供 Digest 时完成后还会校验整个文件）。
+        服务器返回 200 或校验值与记录不符时从头下载。完成后校验长度（Content-Range / Content-Length）、
+        sha256（服务器提供 Digest 时）并重读磁盘文件核对 sha256，fsync 后用 os.replace 发布
+        
+        返回：
+            dict: {'path': ..., 'size': ..., 'sha256': ..., 'resumed_from': ...}，或 None 如果失败
+            （失败时已下载的部分保留，下次调用继续）
+        
+        异常：
+            ReportDownloadInProgress: 其他进程正在下载同一文件（不算失败）
+        """
+        
+        path = f"/resources/applicants/{applicant_id}/summary/report"
+        params = {
+            'report': report_type,
+            'lang': lang
+        }
+        filepath = SumsubReportDownloader.report_filepath(verification_id, applicant_id, lang, output_format)
+        part_path, sidecar_path = SumsubReportDownloader._partial_paths(filepath)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        
+        try:
+            with open(part_path, 'ab+') as part:
+                if not SumsubReportDownloader._try_lock(part):
+                    print(f"⏳ 报告正在由其他进程下载: {os.path.basename(filepath)}")
+                    raise ReportDownloadInProgress(os.path.basename(filepath))
+                
+                # 只信任 sidecar 记录的（已 fsync 的）字节数，且已有部分的 sha256 必须与记录一致
+                state = SumsubReportDownloader._load_sidecar(sidecar_path) or {}
+                offset = state.get('bytes', 0)
+                part.truncate(offset)
+                digest = hashlib.sha256()
+                if offset:
+                    part.seek(0)
+                    for block in iter(lambda: part.read(SumsubReportDownloader.DOWNLOAD_CHUNK_SIZE), b''):
+                        digest.update(block)
+                    validator = state.get('etag') or state.get('last_modified')
+                    if not (validator or state.get('total')) or digest.hexdigest() != state.get('sha256'):
+                        # 既没有校验值也不知道总长度，无法确认服务器上的报告未变化，或本地部分已损坏：从头下载
+                        print(f"⚠️  已下载部分无法校验，丢弃 {offset} 字节从头下载")
+                        offset = 0
+                        part.truncate(0)
+                        digest = hashlib.sha256()
+                
+                headers = {}
+                if offset:
+                    headers['Range'] = f'bytes={offset}-'
+                    if validator:
+                        headers['If-Range'] = validator
+                    print(f"📥 续传 Sumsub 报告: {applicant_id} ({lang}.{output_format}) 从 {offset} 字节")
+                else:
+                    print(f"📥 下载 Sumsub 报告: {applicant_id} ({lang}.{output_format})")
+                
+                response = get_client().request(
+                    'GET',
+                    path,
+                    params=params,
+                    accept='application/pdf' if output_format == 'pdf' else 'application/json',
+                    timeout=30,
+                    family=FAMILY_REPORT_DOWNLOAD,
+                    stream=True,
+                    headers=headers
+                )
+                
+                try:
+                    if response.status_code == 206 and offset:
+                        start, total = SumsubReportDownloader._parse_content_range(response.headers.get('Content-Range'))
+                        if start != offset:
+                            raise IOError(f'Unexpected Content-Range {response.headers.get("Content-Range")}')
+                        if not SumsubReportDownloader._same_report(state, response.headers, total):
+                            # 续传的部分属于另一个版本的报告，不能拼接：下次从头下载
+                            SumsubReportDownloader._discard_partial(part_path, sidecar_path)
+                            raise IOError('Report changed while resuming, restarting from 0')
+                        # 长度、校验值和 Digest 以首次（200）响应记录的为准
+                        total = state.get('total') if total is None else total
+                    elif response.status_code == 200:
+                        if offset:
+                            # Range 被忽略或报告已变化（If-Range 不匹配）：从头下载
+                            print(f"⚠️  服务器返回完整报告，丢弃已下载的 {offset} 字节")
+                            offset = 0
+                            part.truncate(0)
+                            digest = hashlib.sha256()
+                        content_length = response.headers.get('Content-Length')
+                        total = int(content_length) if content_length else None
+                        state = {
+                            'total': total,
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified'),
+                            'digest': response.headers.get('Digest'),
+                        }
+                    elif response.status_code == 416:
+                        # 本地部分与服务器上的报告不一致，下次从头下载
+                        SumsubReportDownloader._discard_partial(part_path, sidecar_path)
+                        print(f"⚠️  续传范围无效，已丢弃部分下载")
+                        return None
+                    else:
+                        error_msg = response.text[:500] if response.text else "Unknown error"
+                        print(f"❌ 报告下载失败 (HTTP {response.status_code}): {error_msg}")
+                        if not offset:
+                            SumsubReportDownloader._discard_partial(part_path, sidecar_path)
+                        return None
+                    
+                    # sidecar 记录已落盘的字节数和这些字节的 sha256，续传前据此校验
+                    part.seek(offset)
+                    state['bytes'] = offset
+                    state['sha256'] = digest.hexdigest()
+                    SumsubReportDownloader._save_sidecar(sidecar_path, state)
+                    
+                    unsynced = 0
+                    try:
+                        for chunk in response.iter_content(chunk_size=SumsubReportDownloader.DOWNLOAD_CHUNK_SIZE):
+                            if not chunk:
+                                continue
+                            part.write(chunk)
+                            digest.update(chunk)
+                            state['bytes'] += len(chunk)
+                            unsynced += len(chunk)
+                            if unsynced >= SumsubReportDownloader.RESUME_CHECKPOINT_BYTES:
+                                part.flush()
+                                os.fsync(part.fileno())
+                                state['sha256'] = digest.hexdigest()
+                                SumsubReportDownloader._save_sidecar(sidecar_path, state)
+                                unsynced = 0
+                    finally:
+                        # 连接中断时也记录已落盘的进度
+                        part.flush()
+                        os.fsync(part.fileno())
+                        state['sha256'] = digest.hexdigest()
+                        SumsubReportDownloader._save_sidecar(sidecar_path, state)
+                finally:
+                    response.close()
+                
+                size = state['bytes']
+                if total is not None and size != total:
+                    raise IOError(f'Incomplete report: got {size} of {total} bytes')
+                
+                sha256 = digest.hexdigest()
+                expected_sha256 = SumsubReportDownloader._parse_digest(state.get('digest'))
+                if expected_sha256 and expected_sha256 != sha256:
+                    SumsubReportDownloader._discard_partial(part_path, sidecar_path)
+                    raise IOError(f'Report sha256 mismatch: got {sha256}, expected {expected_sha256}')
+                # 发布前再读一遍磁盘上的文件，确认与下载时累计的 sha256 一致
+                on_disk = SumsubReportDownloader._file_sha256(part_path)
+                if on_disk != sha256:
+                    SumsubReportDownloader._discard_partial(part_path, sidecar_path)
+                    raise IOError(f'Report sha256 mismatch on disk: got {on_disk}, expected {sha256}')
+                
+                os.replace(part_path, filepath)
+                report_storage.fsync_dir(os.path.dirname(filepath))
+                os.remove(sidecar_path)
+            
+            # 远程存储：本地文件只是续传用的暂存，分片上传后删除
+            ref = filepath
+            backend = report_storage.get_backend()
+            if backend.name != 'local':
+                ref = backend.save_file(
+                    'sumsub', SumsubReportDownloader.REPORT_STORAGE_DIR, verification_id,
+                    os.path.basename(filepath), filepath, content_type=SumsubReportDownloader._mimetype(output_format)
+                )['ref']
+                os.remove(filepath)
+            
+            SumsubReportDownloader.record_report_file(verification_id, lang, output_format, ref, size, sha256)
+            print(f"✅ 报告已保存: {os.path.basename(filepath)} ({size} bytes)")
+            return {'path': ref, 'size': size, 'sha256': sha256, 'resumed_from': offset}
+        
+        except ReportDownloadInProgress:
+            raise
+        except Exception as e:
+            print(f"❌ 下载异常: {e}")
+            return None
+    
+    @staticmethod
+    def _partial_paths(filepath):
+        """未完成下载的数据文件和 sidecar（以 '.' 开头，不会被列出）"""
+        directory, filename = os.path.split(filepath)
+        part_path = os.path.join(directory, f".{filename}.part")
+        return part_path, f"{part_path}.json"
+    
+    @staticmethod
+    def _try_lock(fileobj):
+        """同一文件同时只允许一个下载（跨进程）"""
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(fileobj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+    
+    @staticmethod
+    def _load_sidecar(sidecar_path):
+        try:
+            with open(sidecar_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _save_sidecar(sidecar_path, state):
+        tmp_path = f"{sidecar_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, sidecar_path)
+    
+    @staticmethod
+    def _discard_partial(part_path, sidecar_path):
+        for stale in (part_path, sidecar_path):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    
+    @staticmethod
+    def _same_report(state, headers, total):
+        """
+        206 响应的 ETag / Last-Modified / 总长度与 sidecar 记录的一致（服务器未提供的不比较）；
+        没有记录 ETag / Last-Modified 时，总长度必须已知且一致
+        """
+        if not (state.get('etag') or state.get('last_modified')):
+            return total is not None and total == state.get('total')
+        for field, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            if state.get(field) and headers.get(header) and headers.get(header) != state[field]:
+                return False
+        return total is None or state.get('total') is None or total == state['total']
+    
+    @staticmethod
+    def _parse_content_range(value):
+        """'bytes 100-999/1000' -> (100, 1000)；总长度未知时为 None"""
+        try:
+            unit, _, spec = value.partition(' ')
+            byte_range, _, total = spec.partition('/')
+            if unit != 'bytes':
+                raise ValueError(value)
+            return int(byte_range.split('-')[0]), (None if total == '*' else int(total))
+        except (AttributeError, ValueError):
+            raise IOError(f'Invalid Content-Range: {value!r}')
+    
+    @staticmethod
+    def _parse_digest(value):
+        """Digest 头（RFC 3230，如 'sha-256=<base64>'）中的 sha256，转为十六进制"""
+        for item in (value or '').split(','):
+            algorithm, _, encoded = item.strip().partition('=')
+            if algorithm.lower() == 'sha-256' and encoded:
+                try:
+                    return base64.b64decode(encoded).hex()
+                except ValueError:
+                    return None
+        return None
+    
+    @staticmethod
+    def report_filepath(verification_id, applicant_id, lang, format):
+        """
+        新报告的写入路径：{分片目录}/kyc_report_{verification_id}_{applicant_id}_{lang}.{format}
+        分片目录由 verification_id 哈希决定（见 app.utils.storage_layout）
+        """
+        filename = f"kyc_report_{verification_id}_{applicant_id}_{lang}.{format}"
+        return storage_layout.write_path(SumsubReportDownloader.REPORT_STORAGE_DIR, verification_id, filename)
+    
+    @staticmethod
+    def resolve_report_path(verification_id, filename):
+        """已有报告文件的路径（分片或旧的平铺布局），不存在时返回 None"""
+        return storage_layout.resolve(SumsubReportDownloader.REPORT_STORAGE_DIR, verification_id, filename)
+    
     @staticmethod
     def save_report(verification_id, applicant_id, report_content, format='pdf', lang='en'):
         """
-        保存报告到本地文件系统
+        保存报告到报告存储（本地磁盘原子写入，或 S3 兼容存储，见 report_storage）
         
         参数：
             verification_id: 验证 ID（我们数据库中的）
@@ -126,36 +388,43 @@ class SumsubReportDownloader:
             lang: 语言
         
         返回：
-            str: 报告文件路径，或 None 如果失败
+            str: 报告的存储引用（本地路径或 s3://bucket/key），或 None 如果失败
         """
         
-        SumsubReportDownloader._ensure_storage_dir()
-        
-        # 构建文件名：kyc_report_{verification_id}_{applicant_id}_{lang}.{format}
         filename = f"kyc_report_{verification_id}_{applicant_id}_{lang}.{format}"
-        filepath = os.path.join(SumsubReportDownloader.REPORT_STORAGE_DIR, filename)
         
         try:
-            with open(filepath, 'wb') as f:
-                f.write(report_content)
+            saved = report_storage.get_backend().save(
+                'sumsub', SumsubReportDownloader.REPORT_STORAGE_DIR, verification_id, filename,
+                [report_content], content_type=SumsubReportDownloader._mimetype(format)
+            )
+            SumsubReportDownloader.record_report_file(
+                verification_id, lang, format, saved['ref'], saved['size'], saved['sha256']
+            )
             
-            print(f"✅ 报告已保存: {os.path.basename(filepath)}")
-            print(f"   Path: {filepath}")
-            return filepath
+            print(f"✅ 报告已保存: {filename}")
+            print(f"   Path: {saved['ref']}")
+            return saved['ref']
         
         except Exception as e:
             print(f"❌ 保存失败: {e}")
             return None
     
     @staticmethod
-    def auto_download_on_approval(verification_id, applicant_id, languages=['en']):
+    def _mimetype(format):
+        return {'pdf': 'application/pdf', 'json': 'application/json'}.get(format, 'application/octet-stream')
+    
+    @staticmethod
+    def auto_download_on_approval(verification_id, applicant_id, languages=None):
         """
         验证批准后自动下载多语言报告
+        所有语言和格式并发下载（共享的有界线程池），每个文件单独重试，状态记录在 report_fetches 表
+        批准事件会通过任务队列在后台调用（report_prefetcher），此处为同步调用入口
         
         参数：
             verification_id: 验证 ID
             applicant_id: 申请人 ID
-            languages: 要下载的语言列表
+            languages: 要下载的语言列表（默认 SUMSUB_REPORT_LANGUAGES）
         
         返回：
             dict: {
@@ -164,62 +433,50 @@ class SumsubReportDownloader:
                 'json': '/path/to/report.json'
             }
         """
+        from app.services import report_prefetcher
         
-        report_files = {}
-        
-        print(f"\n" + "="*60)
-        print(f"📋 自动下载验证报告")
-        print(f"   Verification ID: {verification_id}")
-        print(f"   Applicant ID: {applicant_id}")
-        print(f"   Languages: {', '.join(languages)}")
-        print(f"="*60)
-        
-        # 下载每种语言的 PDF
-        for lang in languages:
-            pdf_content = SumsubReportDownloader.download_report(
-                applicant_id,
-                report_type='applicantReport',
-                lang=lang,
-                output_format='pdf'
-            )
-            
-            if pdf_content:
-                pdf_path = SumsubReportDownloader.save_report(
-                    verification_id,
-                    applicant_id,
-                    pdf_content,
-                    format='pdf',
-                    lang=lang
-                )
-                if pdf_path:
-                    report_files[f'{lang}_pdf'] = pdf_path
-        
-        # 下载 JSON（仅一份，使用第一种语言）
-        if languages:
-            json_content = SumsubReportDownloader.download_report(
-                applicant_id,
-                report_type='applicantReport',
-                lang=languages[0],
-                output_format='json'
-            )
-            
-            if json_content:
-                json_path = SumsubReportDownloader.save_report(
-                    verification_id,
-                    applicant_id,
-                    json_content,
-                    format='json',
-                    lang=languages[0]
-                )
-                if json_path:
-                    report_files['json'] = json_path
-        
-        print(f"\n✅ 报告下载完成: {len(report_files)} 个文件")
-        print(f"   Files: {list(report_files.keys())}")
-        print(f"="*60 + "\n")
+        print(f"\n📋 自动下载验证报告: {verification_id} (applicant {applicant_id})")
+        report_files = report_prefetcher.get_prefetcher().prefetch(verification_id, applicant_id, languages)
+        print(f"✅ 报告下载完成: {len(report_files)} 个文件 {list(report_files.keys())}\n")
         
         return report_files
     
+    @staticmethod
+    def record_report_file(verification_id, lang, format, path, size, sha256=None):
+        """
+        写入报告清单 report_files（同一验证、语言、格式只保留最新一条）并提交
+        报告文件发布后调用；列表、预览、下载接口都只查询这张表，不再扫描目录
+        """
+        for attempt in range(2):
+            row = ReportFile.query.filter_by(verification_id=verification_id, lang=lang, format=format).first()
+            if row is None:
+                row = ReportFile(verification_id=verification_id, lang=lang, format=format)
+                db.session.add(row)
+            row.path = path
+            row.size = size
+            row.sha256 = sha256
+            row.created_at = datetime.utcnow()
+            try:
+                db.session.commit()
+                return row
+            except IntegrityError:
+                # 并发保存同一文件：另一方已插入，改为更新
+                db.session.rollback()
+                if attempt:
+                    raise
+    
+    @staticmethod
+    def _report_info(row):
+        return {
+            'filename': os.path.basename(row.path),
+            'lang': row.lang,
+            'format': row.format,
+            'path': row.path,
+            'size': row.size,
+            'sha256': row.sha256,
+            'created_at': row.created_at.isoformat() if row.created_at else None
+        }
+    
     @staticmethod
     def get_report_url(verification_id, lang='en', format='pdf'):
         """
@@ -229,47 +486,163 @@ class SumsubReportDownloader:
             str: 相对路径 '/reports/sumsub/...'，用于 Flask 提供文件下载
         """
         
-        filename = f"kyc_report_{verification_id}_*_{lang}.{format}"
+        row = ReportFile.query.filter_by(verification_id=verification_id, lang=lang, format=format).first()
         
-        import glob
-        files = glob.glob(os.path.join(SumsubReportDownloader.REPORT_STORAGE_DIR, filename))
-        
-        if files:
-            basename = os.path.basename(files[0])
-            return f"/reports/sumsub/{basename}"
+        if row:
+            return f"/reports/sumsub/{os.path.basename(row.path)}"
         
         return None
     
     @staticmethod
     def list_reports_for_verification(verification_id):
         """
-        列出某个验证的所有报告文件
+        列出某个验证的所有报告文件（查询 report_files 清单）
         
         返回：
-            list: [{'lang': 'en', 'format': 'pdf', 'path': '...', 'size': 123}, ...]
+            list: [{'filename': ..., 'lang': 'en', 'format': 'pdf', 'path': '...', 'size': 123,
+                    'sha256': ..., 'created_at': ...}, ...]
         """
         
-        import glob
-        pattern = os.path.join(SumsubReportDownloader.REPORT_STORAGE_DIR, f"kyc_report_{verification_id}_*")
-        files = glob.glob(pattern)
+        rows = ReportFile.query.filter_by(verification_id=verification_id).order_by(
+            ReportFile.lang, ReportFile.format
+        ).all()
+        return [SumsubReportDownloader._report_info(row) for row in rows]
+    
+    @staticmethod
+    def stored_report_ref(verification_id, lang, format):
+        """
+        清单 report_files 中该文件的存储引用（本地路径或 s3://...），存储中确实存在时返回，否则 None
+        """
+        row = ReportFile.query.filter_by(verification_id=verification_id, lang=lang, format=format).first()
+        if row is None:
+            return None
+        try:
+            if report_storage.backend_for(row.path).exists(row.path):
+                return row.path
+        except report_storage.StorageError:
+            return None
+        if report_storage.is_local(row.path):
+            # 清单中的路径已迁移（flask kyc migrate-report-layout）
+            return SumsubReportDownloader.resolve_report_path(verification_id, os.path.basename(row.path))
+        return None
+    
+    @staticmethod
+    def find_report(verification_id, filename):
+        """
+        按文件名查找验证的报告（下载接口用），不属于该验证时返回 None
+        """
+        for row in ReportFile.query.filter_by(verification_id=verification_id).all():
+            if os.path.basename(row.path) == filename:
+                report = SumsubReportDownloader._report_info(row)
+                if report_storage.is_local(report['path']) and not os.path.isfile(report['path']):
+                    # 清单中的路径已迁移（flask kyc migrate-report-layout）
+                    report['path'] = SumsubReportDownloader.resolve_report_path(verification_id, filename) or report['path']
+                return report
+        return None
+    
+    @staticmethod
+    def backfill_report_files(batch_size=500, compute_sha256=True, progress=None):
+        """
+        扫描报告目录（分片和平铺布局），把清单中缺少（或路径、大小不符）的报告文件写入 report_files
+        一次性迁移命令（flask kyc backfill-report-files）使用，可重复运行
         
-        report_list = []
-        for filepath in files:
-            basename = os.path.basename(filepath)
-            # 格式: kyc_report_{verification_id}_{applicant_id}_{lang}.{format}
-            parts = basename.replace('kyc_report_', '').replace(f'{verification_id}_', '').split('.')
-            
-            if len(parts) >= 2:
-                lang_part = parts[0].split('_')[-1]  # 获取最后一部分作为 lang
-                format_type = parts[-1]
-                
-                report_list.append({
-                    'filename': basename,
-                    'lang': lang_part,
-                    'format': format_type,
-                    'path': filepath,
-                    'size': os.path.getsize(filepath),
-                    'created_at': datetime.fromtimestamp(os.path.getctime(filepath)).isoformat()
-                })
-        
-        return report_list
+        返回：
+            dict: scanned, recorded, unchanged, skipped（文件名无法解析或验证不存在）
+        """
+        stats = {'scanned': 0, 'recorded': 0, 'unchanged': 0, 'skipped': 0}
+        if not os.path.isdir(SumsubReportDownloader.REPORT_STORAGE_DIR):
+            return stats
+        
+        def flush(batch):
+            verification_ids = {entry['verification_id'] for entry in batch}
+            known = {
+                vid for (vid,) in db.session.query(Verification.id).filter(Verification.id.in_(verification_ids))
+            }
+            existing = {
+                (row.verification_id, row.lang, row.format): row
+                for row in ReportFile.query.filter(ReportFile.verification_id.in_(verification_ids))
+            }
+            for entry in batch:
+                if entry['verification_id'] not in known:
+                    stats['skipped'] += 1
+                    continue
+                key = (entry['verification_id'], entry['lang'], entry['format'])
+                row = existing.get(key)
+                if row is not None and row.path == entry['path'] and row.size == entry['size']:
+                    stats['unchanged'] += 1
+                    continue
+                if row is None:
+                    row = existing[key] = ReportFile(
+                        verification_id=entry['verification_id'], lang=entry['lang'], format=entry['format']
+                    )
+                    db.session.add(row)
+                row.path = entry['path']
+                row.size = entry['size']
+                row.sha256 = entry['sha256']() if compute_sha256 else None
+                row.created_at = entry['created_at']
+                stats['recorded'] += 1
+            db.session.commit()
+            if progress is not None:
+                progress(dict(stats))
+        
+        batch = []
+        # '.' 开头的未完成下载不会列出
+        for entry in storage_layout.iter_files(SumsubReportDownloader.REPORT_STORAGE_DIR):
+            stats['scanned'] += 1
+            match = SumsubReportDownloader.REPORT_FILENAME_PATTERN.match(entry.name)
+            if not match:
+                stats['skipped'] += 1
+                continue
+            stat = entry.stat()
+            batch.append({
+                'verification_id': match.group(1),
+                'lang': match.group(3),
+                'format': match.group(4),
+                'path': entry.path,
+                'size': stat.st_size,
+                'sha256': lambda path=entry.path: SumsubReportDownloader._file_sha256(path),
+                'created_at': datetime.fromtimestamp(stat.st_mtime, timezone.utc).replace(tzinfo=None)
+            })
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        
+        return stats
+    
+    @staticmethod
+    def migrate_storage_layout(batch_size=500, dry_run=False, progress=None):
+        """
+        把平铺布局的报告文件移动到分片目录（flask kyc migrate-report-layout）
+        每批先硬链接到分片目录、更新 report_files 中的路径并提交，再删除旧文件名，
+        迁移期间两种布局都可读；可中断后重复运行
+        
+        返回：
+            dict: scanned, moved, skipped, conflicts（见 storage_layout.migrate_flat_files）
+        """
+        def owner_of(filename):
+            match = SumsubReportDownloader.REPORT_FILENAME_PATTERN.match(filename)
+            return match.group(1) if match else None
+        
+        def on_moved(moves):
+            for row in ReportFile.query.filter(ReportFile.path.in_(list(moves))):
+                row.path = moves[row.path]
+            db.session.commit()
+        
+        return storage_layout.migrate_flat_files(
+            SumsubReportDownloader.REPORT_STORAGE_DIR,
+            owner_of,
+            on_moved=on_moved,
+            batch_size=batch_size,
+            dry_run=dry_run,
+            progress=progress
+        )
+    
+    @staticmethod
+    def _file_sha256(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(SumsubReportDownloader.DOWNLOAD_CHUNK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
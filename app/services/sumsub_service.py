@@ -1,73 +1,64 @@
-import requests
 import os
-import uuid
-import hmac
-import hashlib
-import time
+import json
 from datetime import datetime
+from flask import current_app
 from app import db
 from app.models import Order, Verification
 from app.utils import token_generator
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from app.services.sumsub_client import get_client
+from app.services import token_cache
+from app.services import single_flight
+from app.services import hedging
+from app.services import job_queue
+from app.services.circuit_breaker import CircuitOpenError, FAMILY_TOKENS, FAMILY_APPLICANT_REVIEW
+from app.services.rate_limiter import RateLimitExceeded
+from app.utils import deadline
+from app.utils.deadline import DeadlineExceeded
 
 # Sumsub SDK Configuration
-SUMSUB_APP_TOKEN = os.getenv('SUMSUB_APP_TOKEN')
-SUMSUB_SECRET_KEY = os.getenv('SUMSUB_SECRET_KEY')
-SUMSUB_API_URL = os.getenv('SUMSUB_API_URL', 'https://api.sumsub.com')
+SUMSUB_VERIFICATION_LEVEL = os.getenv('SUMSUB_VERIFICATION_LEVEL', 'id-and-liveness')
+SUMSUB_TOKEN_TTL = 1800
 
-def _get_session():
-    """
-    Create a requests session with retry strategy and proper headers
-    """
-    session = requests.Session()
-    
-    # Configure retry strategy
-    retry_strategy = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS", "POST", "PUT"]
-    )
-    
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    
-    return session
+# Errors meaning "Sumsub is unavailable right now (or the request ran out of time),
+# try again shortly"; they are re-raised as-is so callers can degrade instead of failing hard
+SUMSUB_UNAVAILABLE_ERRORS = (
+    CircuitOpenError,
+    RateLimitExceeded,
+    DeadlineExceeded,
+    single_flight.SingleFlightTimeout,
+)
+
+# Minimum budget (seconds) needed to start rendering a PDF inside a request
+REPORT_RENDER_MIN_SECONDS = float(os.getenv('REPORT_RENDER_MIN_SECONDS', '2'))
+
+JOB_SUMSUB_VERIFICATION = 'sumsub_verification'
+JOB_GENERATE_REPORT = 'generate_report'
+
+# Review fields the PDF report shows; a review missing any of them is fetched from Sumsub
+REPORT_REVIEW_FIELDS = ('id', 'reviewStatus')
+# Webhook payload keys kept as the report's verification details
+WEBHOOK_REVIEW_KEYS = (
+    'applicantId', 'inspectionId', 'correlationId', 'externalUserId', 'levelName',
+    'type', 'reviewStatus', 'reviewResult', 'createdAt', 'createdAtMs',
+)
 
-def _get_signature(method: str, path: str, body: str = ''):
+def verification_fields(order_id: str) -> dict:
     """
-    Generate HMAC-SHA256 signature for Sumsub API requests
-    Format per official docs: {timestamp}{method}{path}{body}
-    Timestamp should be in seconds (Unix Epoch), not milliseconds
+    Column values for a new verification of an order
     """
-    if not SUMSUB_SECRET_KEY:
-        raise Exception('SUMSUB_SECRET_KEY is not configured')
+    # Generate unique user ID
+    user_id = f"order_{order_id}"
     
-    ts = str(int(time.time()))  # Seconds (Unix Epoch), not milliseconds
-    request_body = body if body else ''
-    signature_raw = f"{ts}{method}{path}{request_body}"
+    # Create verification token (will be used in URL)
+    verification_token = token_generator.generate_verification_token()
     
-    signature = hmac.new(
-        SUMSUB_SECRET_KEY.encode(),
-        signature_raw.encode(),
-        hashlib.sha256
-    ).hexdigest()
-    
-    return ts, signature
-
-def _get_request_headers(ts: str, signature: str) -> dict:
-    """
-    Build request headers for Sumsub API per official documentation
-    Uses X-App-Token instead of Bearer token
-    """
+    # Note: verification_link is backend URL, actual link is generated dynamically
     return {
-        'X-App-Token': SUMSUB_APP_TOKEN,
-        'X-App-Access-Sig': signature,
-        'X-App-Access-Ts': ts,
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
+        'order_id': order_id,
+        'sumsub_applicant_id': user_id,  # Use user_id as applicant identifier
+        'verification_link': f"/verify/{verification_token}",  # Backend URL
+        'verification_token': verification_token,
+        'status': 'pending',
     }
 
 def create_verification(order: Order) -> Verification:
@@ -78,21 +69,8 @@ def create_verification(order: Order) -> Verification:
     Applicants are created automatically when generating access tokens.
     """
     try:
-        # Generate unique user ID
-        user_id = f"order_{order.id}"
-        
-        # Create verification token (will be used in URL)
-        verification_token = token_generator.generate_verification_token()
-        
         # Create verification record
-        # Note: verification_link is backend URL, actual link is generated dynamically
-        verification = Verification(
-            order_id=order.id,
-            sumsub_applicant_id=user_id,  # Use user_id as applicant identifier
-            verification_link=f"/verify/{verification_token}",  # Backend URL
-            verification_token=verification_token,
-            status='pending'
-        )
+        verification = Verification(**verification_fields(order.id))
         
         db.session.add(verification)
         db.session.flush()
@@ -113,8 +91,8 @@ def _generate_access_token(applicant_id: str, user_id: str, email: str = None) -
         
         payload = {
             'userId': user_id,
-            'levelName': os.getenv('SUMSUB_VERIFICATION_LEVEL', 'id-and-liveness'),
-            'ttlInSecs': 1800,
+            'levelName': SUMSUB_VERIFICATION_LEVEL,
+            'ttlInSecs': SUMSUB_TOKEN_TTL,
         }
         
         # Add email if provided
@@ -123,20 +101,8 @@ def _generate_access_token(applicant_id: str, user_id: str, email: str = None) -
                 'email': email
             }
         
-        import json
         body = json.dumps(payload)
-        ts, signature = _get_signature('POST', path, body)
-        headers = _get_request_headers(ts, signature)
-        
-        session = _get_session()
-        response = session.post(
-            f'{SUMSUB_API_URL}{path}',
-            json=payload,
-            headers=headers,
-            timeout=15,
-            allow_redirects=False
-        )
-        session.close()
+        response = get_client().request('POST', path, body=body, timeout=15, family=FAMILY_TOKENS)
         
         if response.status_code not in [200, 201]:
             error_msg = f'Token generation failed (Status: {response.status_code})'
@@ -150,9 +116,45 @@ def _generate_access_token(applicant_id: str, user_id: str, email: str = None) -
         token_data = response.json()
         return token_data.get('token')
         
+    except SUMSUB_UNAVAILABLE_ERRORS:
+        raise
+    except hedging.HedgeCancelled:
+        # The other hedged attempt already answered
+        raise
     except Exception as e:
         raise Exception(f'Failed to generate access token: {str(e)}')
 
+def get_access_token(applicant_id: str, user_id: str, email: str = None):
+    """
+    Get a WebSDK access token, served from the token cache while still comfortably valid
+    
+    Returns:
+        (token, expires_in) tuple
+    """
+    cache = token_cache.get_cache()
+    cached = cache.get(user_id, SUMSUB_VERIFICATION_LEVEL)
+    if cached:
+        return cached
+    
+    def _fetch():
+        # Another flight may have filled the cache while we were waiting for the lock
+        cached = cache.get(user_id, SUMSUB_VERIFICATION_LEVEL)
+        if cached:
+            return cached
+        # A slow token call is hedged with a second one; either token is valid
+        token = hedging.get_hedger(FAMILY_TOKENS).call(_generate_access_token, applicant_id, user_id, email)
+        expires_in = cache.set(user_id, SUMSUB_VERIFICATION_LEVEL, token, SUMSUB_TOKEN_TTL)
+        return token, expires_in
+    
+    # Concurrent requests for the same applicant share one outbound call
+    return single_flight.get_group('access_token').do((user_id, SUMSUB_VERIFICATION_LEVEL), _fetch)
+
+def peek_access_token(user_id: str):
+    """
+    Return a cached (token, expires_in) without calling Sumsub, or None
+    """
+    return token_cache.get_cache().get(user_id, SUMSUB_VERIFICATION_LEVEL)
+
 def update_verification_status(sumsub_applicant_id: str, review_status: str) -> Verification:
     """
     Update verification status based on Sumsub webhook
@@ -173,8 +175,14 @@ def update_verification_status(sumsub_applicant_id: str, review_status: str) ->
             'review': 'pending'
         }
         
-        verification.status = status_map.get(review_status, 'pending')
-        verification.completed_at = datetime.utcnow() if review_status != 'pending' else None
+        status = status_map.get(review_status, 'pending')
+        completed = review_status != 'pending'
+        if verification.status == status and (verification.completed_at is not None) == completed:
+            # Redelivered or repeated event: nothing to write
+            return verification
+        
+        verification.status = status
+        verification.completed_at = datetime.utcnow() if completed else None
         db.session.commit()
         
         return verification
@@ -182,37 +190,127 @@ def update_verification_status(sumsub_applicant_id: str, review_status: str) ->
     except Exception as e:
         raise Exception(f'Failed to update verification: {str(e)}')
 
+def review_from_webhook(payload: dict) -> dict:
+    """
+    The review carried by a Sumsub webhook, shaped like the /review response
+    """
+    if not payload:
+        return None
+    review = {key: payload[key] for key in WEBHOOK_REVIEW_KEYS if key in payload}
+    if payload.get('applicantId'):
+        review['id'] = payload['applicantId']
+    return review
+
+def has_report_fields(review: dict) -> bool:
+    return bool(review) and all(review.get(name) for name in REPORT_REVIEW_FIELDS)
+
+def handle_verification_event(sumsub_applicant_id: str, review_status: str, payload: dict = None) -> Verification:
+    """
+    Apply a Sumsub status update and queue the PDF report once the review is final
+    A report already generating or ready for the same result is not requested again
+
+    Args:
+        payload: the webhook body; its review becomes the report details
+    """
+    from app.models import Report
+    
+    verification = update_verification_status(sumsub_applicant_id, review_status)
+    
+    if verification and review_status in ['approved', 'rejected']:
+        report = Report.query.filter_by(order_id=verification.order_id).first()
+        if (report is None or report.status == 'failed'
+                or report.verification_result != verification.status):
+            request_report(verification.order_id, verification.status, review_from_webhook(payload))
+    
+    return verification
+
+def _handle_verification_job(payload: dict):
+    """
+    Job handler for a Sumsub webhook accepted asynchronously
+    """
+    handle_verification_event(payload.get('applicantId'), payload.get('reviewStatus'), payload)
+
+job_queue.register(JOB_SUMSUB_VERIFICATION, _handle_verification_job)
+
 def get_verification_result(sumsub_applicant_id: str) -> dict:
     """
     Get verification result from Sumsub API
+    Concurrent lookups for the same applicant share one outbound call, hedged if slow
+    """
+    return single_flight.get_group('applicant_review').do(
+        sumsub_applicant_id,
+        hedging.get_hedger(FAMILY_APPLICANT_REVIEW).call,
+        _fetch_verification_result,
+        sumsub_applicant_id
+    )
+
+def _fetch_verification_result(sumsub_applicant_id: str) -> dict:
+    """
+    Fetch the applicant review from Sumsub API
     """
     try:
         path = f'/resources/applicants/{sumsub_applicant_id}/review'
-        ts, signature = _get_signature('GET', path)
-        headers = _get_request_headers(ts, signature)
-        
-        session = _get_session()
-        response = session.get(
-            f'{SUMSUB_API_URL}{path}',
-            headers=headers,
-            timeout=15,
-            allow_redirects=False
-        )
-        session.close()
+        response = get_client().request('GET', path, timeout=15, family=FAMILY_APPLICANT_REVIEW)
         
         if response.status_code != 200:
             raise Exception(f'Failed to get review: {response.text}')
         
         return response.json()
         
+    except SUMSUB_UNAVAILABLE_ERRORS:
+        raise
+    except hedging.HedgeCancelled:
+        # The other hedged attempt already answered
+        raise
     except Exception as e:
         raise Exception(f'Failed to get verification result: {str(e)}')
 
+def request_report(order_id: str, verification_result: str = None, review: dict = None, commit: bool = True):
+    """
+    Record that a report is due (status 'generating') and queue its generation
+    Without a worker process (job_queue.JOB_WORKER_ENABLED off) the job is handed to
+    job_queue.run_in_background after the commit; the caller never waits for the render
+
+    Args:
+        review: review details already known (from the webhook); replaces any earlier ones
+        commit: False to leave the commit to the caller's transaction (and running the
+            job, when there is no worker, to the caller too)
+    """
+    from app.models import Report
+    
+    report = Report.query.filter_by(order_id=order_id).first()
+    if report is None:
+        report = Report(order_id=order_id)
+        db.session.add(report)
+    report.status = 'generating'
+    report.verification_details = review
+    if verification_result:
+        report.verification_result = verification_result
+    
+    # Same transaction: the report is never marked due without a job to produce it
+    jobs = [job_queue.enqueue(JOB_GENERATE_REPORT, {'order_id': order_id}, commit=False)]
+    
+    if report.verification_result == 'approved':
+        # Sumsub's own multi-language reports are downloaded in the background as well
+        from app.services import report_prefetcher
+        verification = Verification.query.filter_by(order_id=order_id).first()
+        if verification is not None:
+            jobs.append(report_prefetcher.schedule(verification.id, commit=False))
+    if commit:
+        db.session.commit()
+        if not job_queue.JOB_WORKER_ENABLED:
+            # No worker process (sync/dev setup): produce the report off the request thread
+            job_queue.run_in_background(current_app._get_current_object(),
+                                        [job.id for job in jobs if job is not None])
+    
+    return report
+
 def generate_pdf_report(order_id: str):
     """
     Generate PDF report for completed verification
+    The review is fetched here; rendering runs in the report renderer's process pool
     """
-    from app.services import report_service
+    from app.services import report_service, report_renderer
     from app.models import Report
     
     try:
@@ -226,25 +324,50 @@ def generate_pdf_report(order_id: str):
         if not verification:
             raise Exception('Verification not found')
         
-        # Get verification result from Sumsub
-        verification_result = get_verification_result(verification.sumsub_applicant_id)
+        # Use the review recorded from the webhook; fetch it from Sumsub only if incomplete
+        report = order.report
+        verification_result = report.verification_details if report is not None else None
+        if not has_report_fields(verification_result):
+            verification_result = get_verification_result(verification.sumsub_applicant_id)
         
-        # Generate PDF
-        pdf_path = report_service.generate_report_pdf(order, verification_result)
-        
-        # Create report record
-        report = Report(
-            order_id=order_id,
-            verification_result=verification.status,
-            verification_details=verification_result,
-            pdf_path=pdf_path
+        # Generate PDF (rendering can't be interrupted, so only start with enough budget left)
+        deadline.check(REPORT_RENDER_MIN_SECONDS, what='PDF rendering')
+        pdf_path = report_renderer.get_renderer().render(
+            report_service.snapshot_order(order),
+            verification_result
         )
         
-        db.session.add(report)
+        # Create or complete the report record
+        if report is None:
+            report = Report(order_id=order_id)
+            db.session.add(report)
+        report.verification_result = verification.status
+        report.verification_details = verification_result
+        report.pdf_path = pdf_path
+        report.status = 'ready'
         db.session.commit()
         
         return report
         
+    except SUMSUB_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         raise Exception(f'Failed to generate PDF report: {str(e)}')
 
+def _handle_report_job(payload: dict):
+    """
+    Job handler: generate a report recorded as due by request_report
+    """
+    generate_pdf_report(payload['order_id'])
+
+def _report_job_dead(payload: dict):
+    """
+    Out of retries: show the report as failed instead of generating forever
+    """
+    from app.models import Report
+    
+    report = Report.query.filter_by(order_id=payload.get('order_id')).first()
+    if report is not None and report.status == 'generating':
+        report.status = 'failed'
+
+job_queue.register(JOB_GENERATE_REPORT, _handle_report_job, on_dead=_report_job_dead)
@@ -0,0 +1,158 @@
+"""
+WebSDK access token cache
+Caches Sumsub SDK tokens per (userId, levelName) so page reloads and SDK refreshes
+are served without an outbound call while the cached token is still comfortably valid
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache configuration
+SUMSUB_TOKEN_CACHE_BACKEND = os.getenv('SUMSUB_TOKEN_CACHE_BACKEND', 'memory')
+SUMSUB_TOKEN_CACHE_SIZE = int(os.getenv('SUMSUB_TOKEN_CACHE_SIZE', '10000'))
+# Entries expire this many seconds before Sumsub's own TTL (clock skew, request latency)
+SUMSUB_TOKEN_EXPIRY_MARGIN = int(os.getenv('SUMSUB_TOKEN_EXPIRY_MARGIN', '60'))
+# A cached token is only handed out if at least this many seconds remain
+SUMSUB_TOKEN_MIN_REMAINING = int(os.getenv('SUMSUB_TOKEN_MIN_REMAINING', '600'))
+
+
+class MemoryBackend:
+    """
+    In-process LRU backend
+    Bounded OrderedDict; least recently used entries are evicted first
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size or SUMSUB_TOKEN_CACHE_SIZE
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at: float):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class NullBackend:
+    """Backend that never caches (SUMSUB_TOKEN_CACHE_BACKEND=none)"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, expires_at: float):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+_BACKENDS = {
+    'memory': MemoryBackend,
+    'none': NullBackend,
+}
+
+
+def register_backend(name: str, factory):
+    """
+    Register a custom backend factory
+    A backend implements get(key), set(key, value, expires_at), delete(key) and __len__
+    """
+    _BACKENDS[name] = factory
+
+
+class TokenCache:
+    """
+    Access token cache keyed by (userId, levelName)
+    """
+
+    def __init__(self, backend=None, expiry_margin: int = None, min_remaining: int = None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.expiry_margin = SUMSUB_TOKEN_EXPIRY_MARGIN if expiry_margin is None else expiry_margin
+        self.min_remaining = SUMSUB_TOKEN_MIN_REMAINING if min_remaining is None else min_remaining
+
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+    def get(self, user_id: str, level_name: str):
+        """
+        Return (token, seconds_remaining) if a comfortably valid token is cached, else None
+        """
+        key = (user_id, level_name)
+        entry = self.backend.get(key)
+        now = time.time()
+
+        if entry is not None:
+            token, expires_at = entry
+            remaining = int(expires_at - now)
+            if remaining >= self.min_remaining:
+                self._count('hits')
+                return token, remaining
+            if remaining <= 0:
+                self.backend.delete(key)
+
+        self._count('misses')
+        return None
+
+    def set(self, user_id: str, level_name: str, token: str, ttl: int) -> int:
+        """
+        Store a freshly issued token; returns the number of seconds it will be served for
+        """
+        lifetime = max(ttl - self.expiry_margin, 0)
+        self.backend.set((user_id, level_name), token, time.time() + lifetime)
+        self._count('stores')
+        return lifetime
+
+    def invalidate(self, user_id: str, level_name: str):
+        self.backend.delete((user_id, level_name))
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['backend'] = type(self.backend).__name__
+        stats['size'] = len(self.backend)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TokenCache:
+    """
+    Return the process-wide token cache, built from SUMSUB_TOKEN_CACHE_BACKEND
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                factory = _BACKENDS.get(SUMSUB_TOKEN_CACHE_BACKEND)
+                if factory is None:
+                    print(f"⚠️  未知的令牌缓存后端: {SUMSUB_TOKEN_CACHE_BACKEND}，使用 memory")
+                    factory = MemoryBackend
+                _cache = TokenCache(backend=factory())
+    return _cache
@@ -0,0 +1,114 @@
+"""
+Speculative WebSDK token prewarming
+After an order is created, a background worker generates the SDK token and stores it
+in the token cache so the buyer's first page view is served from memory
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Prewarm configuration (off by default)
+SUMSUB_TOKEN_PREWARM = os.getenv('SUMSUB_TOKEN_PREWARM', 'false').lower() in ('1', 'true', 'yes')
+SUMSUB_PREWARM_WORKERS = int(os.getenv('SUMSUB_PREWARM_WORKERS', '2'))
+# Cap on queued + running prewarm jobs; extra orders are simply not prewarmed
+SUMSUB_PREWARM_MAX_PENDING = int(os.getenv('SUMSUB_PREWARM_MAX_PENDING', '50'))
+
+
+class TokenPrewarmer:
+    """
+    Bounded background pool that fills the token cache ahead of the buyer's visit
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None):
+        self.workers = workers or SUMSUB_PREWARM_WORKERS
+        self.max_pending = max_pending or SUMSUB_PREWARM_MAX_PENDING
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='token-prewarm')
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._stats = {
+            'scheduled': 0,
+            'rejected': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'pending': 0,
+        }
+
+    def schedule(self, applicant_id: str, user_id: str, email: str = None) -> bool:
+        """
+        Queue a token prewarm; returns False if the pending cap is reached
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            return False
+
+        self._count('scheduled')
+        self._count('pending')
+        try:
+            self._executor.submit(self._run, applicant_id, user_id, email)
+        except Exception:
+            self._done()
+            raise
+        return True
+
+    def _run(self, applicant_id: str, user_id: str, email: str = None):
+        from app.services import sumsub_service
+
+        try:
+            sumsub_service.get_access_token(applicant_id, user_id, email)
+            self._count('succeeded')
+        except Exception as e:
+            self._count('failed')
+            print(f"⚠️  令牌预热失败 ({user_id}): {e}")
+        finally:
+            self._done()
+
+    def _done(self):
+        with self._lock:
+            self._stats['pending'] -= 1
+        self._slots.release()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_pending'] = self.max_pending
+        stats['workers'] = self.workers
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+_prewarmer = None
+_prewarmer_lock = threading.Lock()
+
+
+def get_prewarmer() -> TokenPrewarmer:
+    global _prewarmer
+    if _prewarmer is None:
+        with _prewarmer_lock:
+            if _prewarmer is None:
+                _prewarmer = TokenPrewarmer()
+    return _prewarmer
+
+
+def schedule(applicant_id: str, user_id: str, email: str = None) -> bool:
+    """
+    Prewarm a token for a new order when SUMSUB_TOKEN_PREWARM is enabled
+    """
+    if not SUMSUB_TOKEN_PREWARM:
+        return False
+    return get_prewarmer().schedule(applicant_id, user_id, email)
+
+
+def get_stats() -> dict:
+    if _prewarmer is None:
+        return {'enabled': SUMSUB_TOKEN_PREWARM}
+    stats = _prewarmer.get_stats()
+    stats['enabled'] = SUMSUB_TOKEN_PREWARM
+    return stats
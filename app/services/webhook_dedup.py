@@ -0,0 +1,346 @@
+"""
+Webhook redelivery deduplication and per-subject coalescing
+A delivery is identified by the digest of its canonical payload: recent digests are
+kept in a bounded in-memory LRU, and every accepted digest is recorded in the
+webhook_events table so redeliveries are recognised across processes and restarts.
+Events for one subject arriving while it is being processed are merged into a single
+follow-up run that applies only the newest of them (by the event's own timestamp, so
+a delivery that arrives late doesn't overwrite a newer one).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import WebhookEvent
+from app.services.single_flight import SingleFlightTimeout
+from app.utils import deadline
+
+# Digests remembered in memory (the table is authoritative)
+WEBHOOK_DEDUP_CACHE_SIZE = int(os.getenv('WEBHOOK_DEDUP_CACHE_SIZE', '10000'))
+# How long recorded digests are kept (flask kyc prune-webhook-events)
+WEBHOOK_DEDUP_RETENTION_DAYS = int(os.getenv('WEBHOOK_DEDUP_RETENTION_DAYS', '30'))
+# How long a merged event waits for the run that applies it
+WEBHOOK_COALESCE_TIMEOUT = float(os.getenv('WEBHOOK_COALESCE_TIMEOUT', '10'))
+
+
+def event_order(payload):
+    """
+    Sort key of a Sumsub event: its createdAtMs ('2024-01-01 10:00:00.123'), else createdAt; None if absent
+    """
+    if not isinstance(payload, dict):
+        return None
+    value = payload.get('createdAtMs') or payload.get('createdAt')
+    return str(value) if value else None
+
+
+def event_digest(source: str, payload) -> str:
+    """
+    sha256 of the payload serialised canonically, so key order and whitespace don't matter
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(f'{source}:{canonical}'.encode()).hexdigest()
+
+
+class EventDeduplicator:
+    """
+    LRU of recently seen digests in front of the webhook_events table
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size or WEBHOOK_DEDUP_CACHE_SIZE
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'received': 0,
+            'accepted': 0,
+            'duplicates_memory': 0,
+            'duplicates_db': 0,
+            'released': 0,
+        }
+
+    def _remember(self, digest: str):
+        with self._lock:
+            self._seen[digest] = True
+            self._seen.move_to_end(digest)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+
+    def _seen_in_memory(self, digest: str) -> bool:
+        with self._lock:
+            self._stats['received'] += 1
+            if digest in self._seen:
+                self._seen.move_to_end(digest)
+                self._stats['duplicates_memory'] += 1
+                return True
+        return False
+
+    def _insert(self, digest: str, source: str, subject: str = None) -> bool:
+        """
+        Flush one claim inside a savepoint; False if another delivery already recorded it
+        """
+        try:
+            with db.session.begin_nested():
+                db.session.add(WebhookEvent(digest=digest, source=source, subject=subject))
+        except IntegrityError:
+            self._remember(digest)
+            with self._lock:
+                self._stats['duplicates_db'] += 1
+            return False
+        self._remember(digest)
+        with self._lock:
+            self._stats['accepted'] += 1
+        return True
+
+    def claim(self, digest: str, source: str, subject: str = None, commit: bool = True) -> bool:
+        """
+        Record the delivery; False if this digest was already accepted
+
+        The row is committed before the event is processed; call release() if
+        processing fails so the sender's retry is not mistaken for a duplicate.
+        With commit=False the claim is only flushed and goes out with the caller's next commit.
+        """
+        if self._seen_in_memory(digest):
+            return False
+        accepted = self._insert(digest, source, subject)
+        if accepted and commit:
+            db.session.commit()
+        return accepted
+
+    def claim_many(self, events: list, commit: bool = True) -> list:
+        """
+        Claim a batch of deliveries with one lookup and one commit
+
+        Args:
+            events: [(digest, source, subject), ...]
+
+        Returns:
+            [accepted, ...] in the order of events; a digest repeated within the batch is a duplicate
+        """
+        fresh = {digest for digest, _, _ in events if digest not in self._seen}
+        recorded = {
+            row.digest for row in WebhookEvent.query.filter(WebhookEvent.digest.in_(fresh)).all()
+        } if fresh else set()
+
+        accepted = []
+        for digest, source, subject in events:
+            if self._seen_in_memory(digest):
+                accepted.append(False)
+            elif digest in recorded:
+                self._remember(digest)
+                with self._lock:
+                    self._stats['duplicates_db'] += 1
+                accepted.append(False)
+            else:
+                accepted.append(self._insert(digest, source, subject))
+        if commit:
+            db.session.commit()
+        return accepted
+
+    def release(self, digest: str):
+        """
+        Forget a claimed digest whose processing failed
+        """
+        with self._lock:
+            self._seen.pop(digest, None)
+            self._stats['released'] += 1
+        db.session.rollback()
+        WebhookEvent.query.filter_by(digest=digest).delete()
+        db.session.commit()
+
+    def prune(self, older_than_days: int = None) -> int:
+        """
+        Delete recorded digests older than the retention period
+        """
+        days = WEBHOOK_DEDUP_RETENTION_DAYS if older_than_days is None else older_than_days
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        count = WebhookEvent.query.filter(WebhookEvent.received_at < cutoff).delete()
+        db.session.commit()
+        return count
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._seen)
+        stats['duplicates'] = stats['duplicates_memory'] + stats['duplicates_db']
+        return stats
+
+
+class _Batch:
+    __slots__ = ('value', 'order', 'waiters', 'done', 'error')
+
+    def __init__(self):
+        self.value = None
+        self.order = None
+        self.waiters = 0
+        self.done = False
+        self.error = None
+
+
+class _Subject:
+    __slots__ = ('running', 'running_order', 'next')
+
+    def __init__(self):
+        self.running = False
+        self.running_order = None
+        self.next = None
+
+
+class Coalescer:
+    """
+    At most one run per key; submissions arriving during a run share the next one
+
+    The next run applies the newest submitted value, and every submission merged
+    into it returns (or raises) with that run. Submissions carrying an order (the
+    event's timestamp) are ranked by it rather than by arrival: an older one never
+    replaces a newer value, and one older than the run in progress is dropped.
+    """
+
+    def __init__(self, name: str, default_timeout: float = None):
+        self.name = name
+        self.default_timeout = WEBHOOK_COALESCE_TIMEOUT if default_timeout is None else default_timeout
+        self._cond = threading.Condition()
+        self._subjects = {}
+        self._stats = {
+            'submitted': 0,
+            'runs': 0,
+            'merged': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'stale': 0,
+        }
+
+    @staticmethod
+    def _older(order, than) -> bool:
+        return order is not None and than is not None and order < than
+
+    def submit(self, key, fn, value, timeout: float = None, order=None):
+        """
+        Apply fn(value) for `key`, merging with submissions for the same key that are waiting
+
+        `order` ranks values for the same key (newest wins); without it the last arrival wins
+
+        Raises:
+            SingleFlightTimeout: if the merged run did not start within `timeout`
+            DeadlineExceeded: if the request deadline arrived first
+        """
+        wait = self.default_timeout if timeout is None else timeout
+        left = deadline.remaining()
+        limited_by_deadline = left is not None and left < wait
+        if limited_by_deadline:
+            wait = max(left, 0.0)
+        wait_until = time.monotonic() + wait
+
+        with self._cond:
+            self._stats['submitted'] += 1
+            subject = self._subjects.get(key)
+            if subject is None:
+                subject = self._subjects[key] = _Subject()
+            if subject.running and self._older(order, subject.running_order):
+                # A newer event is being applied right now; this one is out of date
+                self._stats['stale'] += 1
+                return
+            batch = subject.next
+            if batch is None:
+                batch = subject.next = _Batch()
+            else:
+                self._stats['merged'] += 1
+            if self._older(order, batch.order):
+                self._stats['stale'] += 1
+            else:
+                batch.value = value
+                batch.order = order
+            batch.waiters += 1
+
+            while not batch.done:
+                if not subject.running and subject.next is batch:
+                    # This submission runs the batch on behalf of everyone merged into it
+                    subject.running = True
+                    subject.running_order = batch.order
+                    subject.next = None
+                    break
+                left = wait_until - time.monotonic()
+                if left <= 0:
+                    batch.waiters -= 1
+                    if batch.waiters == 0 and subject.next is batch:
+                        # Nobody is left to run it; each sender gets an error and will retry
+                        subject.next = None
+                        if not subject.running:
+                            self._subjects.pop(key, None)
+                    self._stats['timeouts'] += 1
+                    if limited_by_deadline:
+                        raise deadline.DeadlineExceeded(f'{self.name}: request deadline reached waiting for {key!r}')
+                    raise SingleFlightTimeout(f'{self.name}: timed out after {wait}s waiting for {key!r}')
+                self._cond.wait(left)
+            else:
+                if batch.error is not None:
+                    raise batch.error
+                return
+
+        try:
+            fn(batch.value)
+        except BaseException as e:
+            batch.error = e
+        finally:
+            with self._cond:
+                batch.done = True
+                subject.running = False
+                subject.running_order = None
+                if subject.next is None:
+                    self._subjects.pop(key, None)
+                self._stats['runs'] += 1
+                if batch.error is not None:
+                    self._stats['errors'] += 1
+                self._cond.notify_all()
+
+        if batch.error is not None:
+            raise batch.error
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['active'] = len(self._subjects)
+        # Every merged submission is a status update and report request that was not made
+        stats['saved_runs'] = stats['merged']
+        return stats
+
+
+_deduplicator = None
+_coalescers = {}
+_lock = threading.Lock()
+
+
+def get_deduplicator() -> EventDeduplicator:
+    global _deduplicator
+    if _deduplicator is None:
+        with _lock:
+            if _deduplicator is None:
+                _deduplicator = EventDeduplicator()
+    return _deduplicator
+
+
+def get_coalescer(name: str) -> Coalescer:
+    """
+    Return the named process-wide coalescer, creating it on first use
+    """
+    coalescer = _coalescers.get(name)
+    if coalescer is None:
+        with _lock:
+            coalescer = _coalescers.get(name)
+            if coalescer is None:
+                coalescer = Coalescer(name)
+                _coalescers[name] = coalescer
+    return coalescer
+
+
+def get_stats() -> dict:
+    stats = get_deduplicator().get_stats() if _deduplicator is not None else {'received': 0}
+    stats['coalescers'] = {name: coalescer.get_stats() for name, coalescer in list(_coalescers.items())}
+    return stats
@@ -1,3 +1,4 @@
 from . import token_generator
+from . import deadline
 
-__all__ = ['token_generator']
+__all__ = ['token_generator', 'deadline']
@@ -0,0 +1,185 @@
+"""
+Bounded-memory readers for batch request bodies
+The body is spooled (memory first, then a temp file) while its HMAC is computed,
+then items are decoded one at a time from a JSON array or NDJSON; a malformed
+item is reported on its own and the rest of the batch still goes through
+"""
+
+import codecs
+import hashlib
+import hmac
+import json
+import re
+import tempfile
+
+READ_CHUNK = 64 * 1024
+# Bodies up to this size stay in memory; larger ones spill to a temp file
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+_WHITESPACE = ' \t\r\n'
+# Array elements longer than this are reported invalid instead of being kept in memory
+MAX_ITEM_CHARS = 1024 * 1024
+# Characters that matter when splitting an array into elements, outside and inside strings
+_STRUCTURAL = re.compile(r'[\[\]{}",]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds the configured limit"""
+
+
+def spool_body(stream, max_bytes: int, secret: str = None):
+    """
+    Copy a request stream into a spooled file, computing HMAC-SHA256 on the way
+
+    Returns:
+        (spooled file positioned at 0, hex digest or None)
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    mac = hmac.new(secret.encode(), digestmod=hashlib.sha256) if secret else None
+    total = 0
+    try:
+        while True:
+            chunk = stream.read(READ_CHUNK)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                raise BodyTooLarge(f'Request body exceeds {max_bytes} bytes')
+            if mac is not None:
+                mac.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, (mac.hexdigest() if mac is not None else None)
+
+
+def iter_ndjson(fileobj):
+    """
+    Yield (item, error) per non-blank line; a malformed line yields (None, message)
+    """
+    for line_number, line in enumerate(fileobj, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, f'line {line_number}: invalid JSON ({e})'
+
+
+def iter_json_array(fileobj, max_item_chars: int = None):
+    """
+    Yield (item, error) for each element of a top-level JSON array without loading it whole
+    Elements are split on the array's own commas and decoded one at a time, so a malformed
+    element yields (None, message) like a malformed NDJSON line; only the current element
+    is held in memory, and one longer than max_item_chars is skipped as invalid
+
+    Raises:
+        ValueError: if the body is not a JSON array at all (no opening '[', no closing ']',
+            or data after it); nothing is accepted from such a body
+    """
+    limit = MAX_ITEM_CHARS if max_item_chars is None else max_item_chars
+    reader = codecs.getreader('utf-8')(fileobj)
+    started = finished = False
+    depth = 0
+    in_string = escaped = False
+    parts, size, oversized = [], 0, False
+    index = 0
+
+    def add(text):
+        nonlocal parts, size, oversized
+        if oversized or not text:
+            return
+        size += len(text)
+        if size > limit:
+            # Keep scanning to the element's end, but stop keeping it
+            parts, oversized = [], True
+        else:
+            parts.append(text)
+
+    def element():
+        nonlocal parts, size, oversized, index
+        text, too_large, number = ''.join(parts).strip(_WHITESPACE), oversized, index
+        parts, size, oversized = [], 0, False
+        index += 1
+        if too_large:
+            return None, f'element {number}: larger than {limit} characters'
+        if not text:
+            return None, f'element {number}: empty'
+        try:
+            return json.loads(text), None
+        except ValueError as e:
+            return None, f'element {number}: invalid JSON ({e})'
+
+    while True:
+        chunk = reader.read(READ_CHUNK)
+        if not chunk:
+            break
+        pos = 0
+        if not started:
+            pos = len(chunk) - len(chunk.lstrip(_WHITESPACE))
+            if pos == len(chunk):
+                continue
+            if chunk[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+
+        while pos < len(chunk) and not finished:
+            if in_string:
+                if escaped:
+                    add(chunk[pos])
+                    pos += 1
+                    escaped = False
+                    continue
+                match = _STRING_SPECIAL.search(chunk, pos)
+                if match is None:
+                    add(chunk[pos:])
+                    break
+                if match.group() == '\\':
+                    escaped = True
+                else:
+                    in_string = False
+                add(chunk[pos:match.end()])
+                pos = match.end()
+                continue
+
+            match = _STRUCTURAL.search(chunk, pos)
+            if match is None:
+                add(chunk[pos:])
+                break
+            char = match.group()
+            if char in ',]' and depth == 0:
+                add(chunk[pos:match.start()])
+                pos = match.end()
+                if char == ']':
+                    finished = True
+                    # '[]' and '[ ]' have no elements
+                    if index == 0 and not oversized and not ''.join(parts).strip(_WHITESPACE):
+                        break
+                yield element()
+                continue
+            if char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            elif char in ']}':
+                # A stray closing bracket just makes this element invalid
+                depth = max(depth - 1, 0)
+            add(chunk[pos:match.end()])
+            pos = match.end()
+
+        if finished and chunk[pos:].strip(_WHITESPACE):
+            raise ValueError('Invalid JSON array: trailing data')
+
+    if not started:
+        raise ValueError('Expected a JSON array')
+    if not finished:
+        raise ValueError('Invalid JSON array: missing closing "]"')
+
+
+def iter_items(fileobj, ndjson: bool):
+    return iter_ndjson(fileobj) if ndjson else iter_json_array(fileobj)
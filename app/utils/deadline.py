@@ -0,0 +1,184 @@
+"""
+Request deadlines
+Every inbound request gets a time budget (configurable per blueprint); outbound Sumsub
+calls, DB statements and PDF rendering only get the time left before it
+"""
+
+import contextvars
+import os
+import time
+
+# Default budget (seconds) per blueprint; override with REQUEST_DEADLINE_<BLUEPRINT>
+DEFAULT_BLUEPRINT_DEADLINES = {
+    'verification': 10.0,
+    'webhook': 20.0,
+    'report': 30.0,
+    'admin_manual': 30.0,
+}
+REQUEST_DEADLINE_DEFAULT = float(os.getenv('REQUEST_DEADLINE_DEFAULT', '30'))
+# Smallest budget worth starting another outbound attempt with
+DEADLINE_MIN_ATTEMPT = float(os.getenv('DEADLINE_MIN_ATTEMPT', '0.5'))
+# SQLSTATE of a PostgreSQL statement cancelled by statement_timeout
+STATEMENT_CANCELED = '57014'
+
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's time budget cannot cover the next step"""
+
+    def __init__(self, message: str = 'Request deadline exceeded', retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def budget_for(blueprint: str) -> float:
+    """
+    Time budget for requests handled by a blueprint (0 disables the deadline)
+    """
+    env_name = f"REQUEST_DEADLINE_{(blueprint or 'DEFAULT').upper()}"
+    value = os.getenv(env_name)
+    if value is not None:
+        return float(value)
+    return DEFAULT_BLUEPRINT_DEADLINES.get(blueprint, REQUEST_DEADLINE_DEFAULT)
+
+
+def start(seconds: float):
+    """
+    Start a deadline `seconds` from now in the current context; returns a reset token
+    """
+    if not seconds or seconds <= 0:
+        return _deadline.set(None)
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def start_within(seconds: float):
+    """
+    Like start(), but keep a deadline already active in this context if it comes sooner
+    """
+    current = _deadline.get()
+    if not seconds or seconds <= 0:
+        return _deadline.set(current)
+    target = time.monotonic() + seconds
+    if current is not None:
+        target = min(target, current)
+    return _deadline.set(target)
+
+
+def clear(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """
+    Seconds left in the current budget, or None when no deadline is active
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check(min_seconds: float = 0.0, what: str = 'request'):
+    """
+    Raise DeadlineExceeded unless at least `min_seconds` of budget remain
+    """
+    left = remaining()
+    if left is not None and left <= min_seconds:
+        raise DeadlineExceeded(f'Not enough time left for {what} ({max(left, 0):.2f}s remaining)')
+
+
+def timeout(default: float, what: str = 'outbound call') -> float:
+    """
+    Timeout for the next blocking call: the default, capped by the remaining budget
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left < DEADLINE_MIN_ATTEMPT:
+        raise DeadlineExceeded(f'Not enough time left for {what} ({max(left, 0):.2f}s remaining)')
+    return min(default, left)
+
+
+def allows(seconds: float) -> bool:
+    """
+    Whether the budget can cover `seconds` more work plus one minimal attempt
+    """
+    left = remaining()
+    return left is None or left >= seconds + DEADLINE_MIN_ATTEMPT
+
+
+def _apply_statement_timeout(conn):
+    """
+    Engine 'begin' hook: cap every statement in the transaction by the remaining budget
+    """
+    left = remaining()
+    if left is None:
+        return
+    ms = max(int(left * 1000), 1)
+    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {ms}")
+
+
+def is_statement_timeout(error: Exception) -> bool:
+    """
+    Whether a database error is PostgreSQL cancelling a statement (QueryCanceled, SQLSTATE 57014)
+    """
+    orig = getattr(error, 'orig', error)
+    return (getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)) == STATEMENT_CANCELED
+
+
+def raise_if_exceeded(error: Exception):
+    """
+    Re-raise a deadline error caught by a route's generic `except Exception`, so it is
+    answered with a 503 and Retry-After instead of a 500
+    """
+    if isinstance(error, DeadlineExceeded):
+        raise error
+    if is_statement_timeout(error):
+        raise DeadlineExceeded(f'Database statement cancelled at the deadline: {error}') from error
+
+
+def init_app(app, db):
+    """
+    Attach a deadline to every request and enforce it on PostgreSQL statements
+    """
+    from flask import g, request, jsonify, render_template
+    from sqlalchemy import event
+    from sqlalchemy.exc import DBAPIError
+
+    @app.before_request
+    def _start_request_deadline():
+        g._deadline_token = start(budget_for(request.blueprint))
+
+    @app.teardown_request
+    def _clear_request_deadline(exc=None):
+        token = g.pop('_deadline_token', None)
+        if token is not None:
+            clear(token)
+
+    @app.errorhandler(DeadlineExceeded)
+    def _handle_deadline_exceeded(error):
+        retry_after = str(max(int(error.retry_after + 0.999), 1))
+        if request.accept_mimetypes.accept_html and not request.accept_mimetypes.accept_json:
+            return render_template('error.html', message='请求处理超时，请稍后重试'), 503, {'Retry-After': retry_after}
+        return jsonify({
+            'error': str(error),
+            'type': 'DeadlineExceeded',
+            'status': 'error'
+        }), 503, {'Retry-After': retry_after}
+
+    @app.errorhandler(DBAPIError)
+    def _handle_statement_timeout(error):
+        # Statements cut short by the statement_timeout above are the deadline running out
+        if not is_statement_timeout(error):
+            raise error
+        db.session.rollback()
+        return _handle_deadline_exceeded(DeadlineExceeded(f'Database statement cancelled at the deadline: {error.orig}'))
+
+    with app.app_context():
+        try:
+            engine = db.engine
+            if engine.dialect.name == 'postgresql':
+                event.listen(engine, 'begin', _apply_statement_timeout)
+        except Exception as e:
+            print(f"⚠️  无法注册数据库语句超时: {e}")
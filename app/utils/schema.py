@@ -0,0 +1,50 @@
+"""
+In-place upgrades for databases created by an earlier version
+db.create_all() only creates missing tables; columns and indexes added to existing
+tables are added here at startup, idempotently, so every worker can run it on boot
+"""
+
+from sqlalchemy import inspect, text
+
+# (table, column, column DDL) added after the table was first deployed
+ADDED_COLUMNS = [
+    ('reports', 'status', "VARCHAR(20) NOT NULL DEFAULT 'ready'"),
+]
+
+# (table, index name, columns) added after the table was first deployed
+ADDED_INDEXES = [
+    ('verifications', 'ix_verifications_status_created', ('status', 'created_at', 'id')),
+]
+
+
+def upgrade(db) -> list:
+    """
+    Add missing columns and indexes to existing tables
+
+    Returns:
+        ['table.column', 'table.index', ...] added by this call
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    # PostgreSQL checks again under the table lock, so workers booting together don't collide
+    if_not_exists = 'IF NOT EXISTS ' if engine.dialect.name == 'postgresql' else ''
+    added = []
+
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            if column in {c['name'] for c in inspector.get_columns(table)}:
+                continue
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {ddl}'))
+            added.append(f'{table}.{column}')
+
+        for table, name, columns in ADDED_INDEXES:
+            if not inspector.has_table(table):
+                continue
+            if name in {index['name'] for index in inspector.get_indexes(table)}:
+                continue
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'))
+            added.append(f'{table}.{name}')
+
+    return added
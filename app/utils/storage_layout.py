@@ -0,0 +1,145 @@
+"""
+Hash-sharded on-disk layout for report files
+A report owned by id X is stored under <base>/<h[0:2]>/<h[2:4]>/<filename>, where h is
+the sha256 hex of X, so no directory holds more than a few thousand files. Files from
+the old flat layout (<base>/<filename>) stay readable: resolve() looks in both places,
+and migrate_flat_files() moves them into their shards in batches while the app runs.
+"""
+
+import hashlib
+import os
+
+# 'sharded' (default) or 'flat'; where new report files are written
+REPORT_STORAGE_LAYOUT = os.getenv('REPORT_STORAGE_LAYOUT', 'sharded').lower()
+
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+
+def shard_dir(base_dir: str, owner_id) -> str:
+    """
+    Directory of the owner's files in the sharded layout
+    """
+    digest = hashlib.sha256(str(owner_id).encode()).hexdigest()
+    parts = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return os.path.join(base_dir, *parts)
+
+
+def sharded_path(base_dir: str, owner_id, filename: str) -> str:
+    return os.path.join(shard_dir(base_dir, owner_id), filename)
+
+
+def flat_path(base_dir: str, filename: str) -> str:
+    return os.path.join(base_dir, filename)
+
+
+def write_path(base_dir: str, owner_id, filename: str) -> str:
+    """
+    Where a new file is written (REPORT_STORAGE_LAYOUT); the caller creates the directory
+    """
+    if REPORT_STORAGE_LAYOUT == 'flat':
+        return flat_path(base_dir, filename)
+    return sharded_path(base_dir, owner_id, filename)
+
+
+def resolve(base_dir: str, owner_id, filename: str):
+    """
+    Path of an existing file in either layout, or None
+
+    A file being migrated is linked into its shard before it is removed from the flat
+    directory, so it is always visible in one of them; the second pass covers a lookup
+    that raced a whole move.
+    """
+    for _ in range(2):
+        for path in (sharded_path(base_dir, owner_id, filename), flat_path(base_dir, filename)):
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def iter_files(base_dir: str):
+    """
+    os.DirEntry of every visible file in both layouts (names starting with '.' are in-progress writes)
+    """
+    if not os.path.isdir(base_dir):
+        return
+
+    def walk(directory, depth):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_file():
+                    yield entry
+                elif depth < SHARD_LEVELS and entry.is_dir() and len(entry.name) == SHARD_WIDTH:
+                    yield from walk(entry.path, depth + 1)
+
+    yield from walk(base_dir, 0)
+
+
+def migrate_flat_files(base_dir: str, owner_of, on_moved=None, batch_size: int = 500,
+                       dry_run: bool = False, progress=None) -> dict:
+    """
+    Move files from the flat layout into their shards, batch by batch
+
+    Each file is hard-linked into its shard first; on_moved({old_path: new_path}) then
+    repoints stored paths for the batch (and commits), and only after that are the flat
+    names removed. Readers see every file at all times and the run can be interrupted
+    and repeated.
+
+    Args:
+        owner_of: filename -> owner id, or None for files that aren't reports
+        on_moved: called once per batch before the flat names are removed
+
+    Returns:
+        stats: scanned, moved, skipped (not a report), conflicts (a different file is
+        already in the shard)
+    """
+    stats = {'scanned': 0, 'moved': 0, 'skipped': 0, 'conflicts': 0}
+    if not os.path.isdir(base_dir):
+        return stats
+
+    def flush(batch):
+        if not batch:
+            return
+        if on_moved is not None:
+            on_moved(dict(batch))
+        for old_path, _ in batch:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+        stats['moved'] += len(batch)
+        if progress is not None:
+            progress(dict(stats))
+
+    batch = []
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stats['scanned'] += 1
+            owner_id = owner_of(entry.name)
+            if owner_id is None:
+                stats['skipped'] += 1
+                continue
+
+            new_path = sharded_path(base_dir, owner_id, entry.name)
+            if dry_run:
+                stats['moved'] += 1
+                continue
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            try:
+                os.link(entry.path, new_path)
+            except FileExistsError:
+                # Linked by an interrupted run, or a different file: only the former is safe to finish
+                if not os.path.samefile(entry.path, new_path):
+                    stats['conflicts'] += 1
+                    continue
+            batch.append((entry.path, new_path))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+    flush(batch)
+
+    return stats
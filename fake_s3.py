@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Local S3-compatible stand-in (MinIO-style) for the report storage backend
+
+Implements the subset of the S3 API the app uses, path-style, with Signature V4
+checks on both signed requests and pre-signed URLs:
+    PUT    /{bucket}/{key}                              put object
+    POST   /{bucket}/{key}?uploads                      start multipart upload
+    PUT    /{bucket}/{key}?partNumber=N&uploadId=ID     upload part
+    POST   /{bucket}/{key}?uploadId=ID                  complete multipart upload
+    DELETE /{bucket}/{key}?uploadId=ID                  abort multipart upload
+    GET    /{bucket}/{key}                              get object (Range supported)
+    HEAD   /{bucket}/{key}                              object metadata
+    DELETE /{bucket}/{key}                              delete object
+
+Objects live in memory. Every part but the last must be at least min_part_size
+bytes, like S3.
+
+Usage:
+    python fake_s3.py --port 9099
+    REPORT_STORAGE_BACKEND=s3 REPORT_STORAGE_S3_ENDPOINT=http://127.0.0.1:9099 \
+        REPORT_STORAGE_S3_ACCESS_KEY=minio REPORT_STORAGE_S3_SECRET_KEY=minio123 python run.py
+"""
+
+import argparse
+import hashlib
+import hmac
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit, parse_qsl
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class FakeS3Config:
+    FIELDS = ('access_key', 'secret_key', 'region', 'min_part_size', 'check_signature')
+
+    def __init__(self, **values):
+        self.access_key = 'minio'
+        self.secret_key = 'minio123'
+        self.region = 'us-east-1'
+        self.min_part_size = MIN_PART_SIZE
+        self.check_signature = True
+        self.update(values)
+
+    def update(self, values: dict):
+        for name, value in values.items():
+            if name not in self.FIELDS:
+                raise ValueError(f'Unknown config field: {name}')
+            setattr(self, name, value)
+
+
+def _signing_key(secret, date, region):
+    key = f'AWS4{secret}'.encode()
+    for part in (date, region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return key
+
+
+def _encode(value, safe='-_.~'):
+    return quote(value, safe=safe)
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeS3/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # -- plumbing --------------------------------------------------------
+
+    def _send(self, status, body=b'', content_type='application/xml', headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        self.server.count('status', str(status))
+
+    def _error(self, status, code, message=''):
+        self._send(status, f'<?xml version="1.0" encoding="UTF-8"?>'
+                           f'<Error><Code>{code}</Code><Message>{message}</Message></Error>')
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server.note_body(len(body))
+        return body
+
+    # -- auth ------------------------------------------------------------
+
+    def _canonical_request(self, path, query, header_names, payload_hash):
+        canonical_query = '&'.join(
+            f'{_encode(k)}={_encode(v)}' for k, v in sorted(query) if k != 'X-Amz-Signature'
+        )
+        canonical_headers = ''.join(
+            f'{name}:{(self.headers.get(name) or "").strip()}\n' for name in header_names
+        )
+        return '\n'.join([self.command, _encode(path, safe='/-_.~'), canonical_query,
+                          canonical_headers, ';'.join(header_names), payload_hash])
+
+    def _check_auth(self, path, query, body):
+        """Returns an error code, or None if the request is properly signed"""
+        config = self.server.config
+        if not config.check_signature:
+            return None
+
+        params = dict(query)
+        if 'X-Amz-Signature' in params:
+            credential = params.get('X-Amz-Credential', '')
+            amz_date = params.get('X-Amz-Date', '')
+            header_names = params.get('X-Amz-SignedHeaders', '').split(';')
+            signature = params['X-Amz-Signature']
+            payload_hash = 'UNSIGNED-PAYLOAD'
+            try:
+                issued = datetime.strptime(amz_date, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+                expires = int(params.get('X-Amz-Expires', '0'))
+            except ValueError:
+                return 'AuthorizationQueryParametersError'
+            if datetime.now(timezone.utc) > issued + timedelta(seconds=expires):
+                return 'AccessDenied'
+        else:
+            match = re.match(r'AWS4-HMAC-SHA256 Credential=([^,]+), SignedHeaders=([^,]+), Signature=(\w+)',
+                             self.headers.get('Authorization') or '')
+            if not match:
+                return 'AccessDenied'
+            credential, signed_headers, signature = match.groups()
+            header_names = signed_headers.split(';')
+            amz_date = self.headers.get('x-amz-date', '')
+            payload_hash = self.headers.get('x-amz-content-sha256', '')
+            if payload_hash != 'UNSIGNED-PAYLOAD' and payload_hash != hashlib.sha256(body).hexdigest():
+                return 'XAmzContentSHA256Mismatch'
+
+        access_key, _, scope = credential.partition('/')
+        if access_key != config.access_key:
+            return 'InvalidAccessKeyId'
+        date = scope.split('/')[0]
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            hashlib.sha256(self._canonical_request(path, query, header_names, payload_hash).encode()).hexdigest()
+        ])
+        expected = hmac.new(_signing_key(config.secret_key, date, config.region),
+                            string_to_sign.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, signature):
+            return 'SignatureDoesNotMatch'
+        return None
+
+    # -- dispatch --------------------------------------------------------
+
+    def _handle(self):
+        split = urlsplit(self.path)
+        path = unquote(split.path)
+        query = parse_qsl(split.query, keep_blank_values=True)
+        params = dict(query)
+        body = self._read_body() if self.command in ('PUT', 'POST') else b''
+
+        bucket, _, key = path.lstrip('/').partition('/')
+        if not bucket or not key:
+            return self._error(400, 'InvalidRequest', 'path-style /bucket/key expected')
+
+        error = self._check_auth(path, query, body)
+        if error:
+            self.server.count('auth_failures', error)
+            return self._error(403, error)
+
+        if self.command == 'PUT' and 'uploadId' in params:
+            operation = 'upload_part'
+        elif self.command == 'POST' and 'uploads' in params:
+            operation = 'create_multipart'
+        elif self.command == 'POST' and 'uploadId' in params:
+            operation = 'complete_multipart'
+        elif self.command == 'DELETE' and 'uploadId' in params:
+            operation = 'abort_multipart'
+        else:
+            operation = {'PUT': 'put', 'GET': 'get', 'HEAD': 'head', 'DELETE': 'delete'}.get(self.command)
+        if operation is None:
+            return self._error(405, 'MethodNotAllowed')
+        self.server.count('requests', operation)
+        return getattr(self, f'_op_{operation}')(bucket, key, params, body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _handle
+
+    # -- operations ------------------------------------------------------
+
+    def _op_put(self, bucket, key, params, body):
+        etag = self.server.put_object(bucket, key, body, self.headers.get('Content-Type'))
+        self._send(200, headers={'ETag': etag})
+
+    def _op_create_multipart(self, bucket, key, params, body):
+        upload_id = self.server.create_upload(bucket, key, self.headers.get('Content-Type'))
+        self._send(200, f'<?xml version="1.0" encoding="UTF-8"?>'
+                        f'<InitiateMultipartUploadResult xmlns="{S3_NAMESPACE}">'
+                        f'<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>'
+                        f'</InitiateMultipartUploadResult>')
+
+    def _op_upload_part(self, bucket, key, params, body):
+        etag = self.server.upload_part(params['uploadId'], int(params.get('partNumber', '0')), body)
+        if etag is None:
+            return self._error(404, 'NoSuchUpload')
+        self._send(200, headers={'ETag': etag})
+
+    def _op_complete_multipart(self, bucket, key, params, body):
+        numbers = [int(n) for n in re.findall(r'<PartNumber>(\d+)</PartNumber>', body.decode())]
+        error, etag = self.server.complete_upload(params['uploadId'], numbers)
+        if error:
+            return self._error(400 if error != 'NoSuchUpload' else 404, error)
+        self._send(200, f'<?xml version="1.0" encoding="UTF-8"?>'
+                        f'<CompleteMultipartUploadResult xmlns="{S3_NAMESPACE}">'
+                        f'<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>{etag}</ETag>'
+                        f'</CompleteMultipartUploadResult>')
+
+    def _op_abort_multipart(self, bucket, key, params, body):
+        self.server.abort_upload(params['uploadId'])
+        self._send(204)
+
+    def _op_get(self, bucket, key, params, body):
+        obj = self.server.get_object(bucket, key)
+        if obj is None:
+            return self._error(404, 'NoSuchKey')
+        data = obj['body']
+        headers = {
+            'ETag': obj['etag'],
+            'Accept-Ranges': 'bytes',
+            'Last-Modified': formatdate(obj['modified'], usegmt=True),
+        }
+        if params.get('response-content-disposition'):
+            headers['Content-Disposition'] = params['response-content-disposition']
+        content_type = params.get('response-content-type') or obj['content_type'] or 'application/octet-stream'
+
+        status = 200
+        match = re.match(r'^bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(data) - 1) if match.group(2) else len(data) - 1
+            if start >= len(data) or start > end:
+                return self._send(416, b'', headers={'Content-Range': f'bytes */{len(data)}'})
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+            data, status = data[start:end + 1], 206
+        self._send(status, data, content_type=content_type, headers=headers)
+
+    def _op_head(self, bucket, key, params, body):
+        self._op_get(bucket, key, params, body)
+
+    def _op_delete(self, bucket, key, params, body):
+        self.server.delete_object(bucket, key)
+        self._send(204)
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    """
+    In-memory S3 stand-in; start() runs it on a background thread (for tests)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, config=None, verbose=False):
+        super().__init__((host, port), FakeS3Handler)
+        self.config = config or FakeS3Config()
+        self.verbose = verbose
+        self.objects = {}
+        self.uploads = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # -- storage ---------------------------------------------------------
+
+    def put_object(self, bucket, key, body, content_type):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self._lock:
+            self.objects[(bucket, key)] = {'body': body, 'etag': etag, 'content_type': content_type,
+                                           'modified': time.time()}
+        return etag
+
+    def get_object(self, bucket, key):
+        with self._lock:
+            return self.objects.get((bucket, key))
+
+    def delete_object(self, bucket, key):
+        with self._lock:
+            self.objects.pop((bucket, key), None)
+
+    def create_upload(self, bucket, key, content_type):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {'bucket': bucket, 'key': key, 'content_type': content_type, 'parts': {}}
+        return upload_id
+
+    def upload_part(self, upload_id, number, body):
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return None
+            upload['parts'][number] = body
+            self._stats['parts'] += 1
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def complete_upload(self, upload_id, numbers):
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return 'NoSuchUpload', None
+            if numbers != sorted(numbers) or any(n not in upload['parts'] for n in numbers):
+                return 'InvalidPart', None
+            if any(len(upload['parts'][n]) < self.config.min_part_size for n in numbers[:-1]):
+                return 'EntityTooSmall', None
+            del self.uploads[upload_id]
+        body = b''.join(upload['parts'][n] for n in numbers)
+        return None, self.put_object(upload['bucket'], upload['key'], body, upload['content_type'])
+
+    def abort_upload(self, upload_id):
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+
+    # -- stats -----------------------------------------------------------
+
+    def count(self, group, name):
+        with self._lock:
+            bucket = self._stats[group]
+            bucket[name] = bucket.get(name, 0) + 1
+
+    def note_body(self, size):
+        with self._lock:
+            self._stats['max_request_body'] = max(self._stats['max_request_body'], size)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'requests': {}, 'status': {}, 'auth_failures': {}, 'parts': 0, 'max_request_body': 0}
+
+    def get_stats(self):
+        with self._lock:
+            stats = {name: dict(value) if isinstance(value, dict) else value for name, value in self._stats.items()}
+            stats['objects'] = len(self.objects)
+            stats['open_uploads'] = len(self.uploads)
+        return stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-s3', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local S3-compatible stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9099)
+    parser.add_argument('--access-key', default='minio')
+    parser.add_argument('--secret-key', default='minio123')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--min-part-size', type=int, default=MIN_PART_SIZE)
+    parser.add_argument('--no-signature-check', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    config = FakeS3Config(
+        access_key=args.access_key,
+        secret_key=args.secret_key,
+        region=args.region,
+        min_part_size=args.min_part_size,
+        check_signature=not args.no_signature_check,
+    )
+    server = FakeS3Server(args.host, args.port, config, verbose=args.verbose)
+    print(f"🧪 Fake S3 已启动: {server.url}")
+    print(f"   设置 REPORT_STORAGE_BACKEND=s3 REPORT_STORAGE_S3_ENDPOINT={server.url} 即可让应用使用它")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
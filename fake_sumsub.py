@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Local Sumsub stand-in for benchmarks and load tests
+
+Implements the endpoints this app uses, with the same request signing:
+    POST /resources/accessTokens/sdk
+    GET  /resources/applicants/{id}/review
+    GET  /resources/applicants/{id}/summary/report   (supports Range / If-Range)
+
+Latency distributions and 429/5xx error rates can be injected per endpoint, and real
+responses can be recorded once (proxying to api.sumsub.com) and replayed afterwards.
+
+Usage:
+    python fake_sumsub.py --port 8099 --latency lognormal:0.08,0.5 --rate-429 0.02
+    SUMSUB_API_URL=http://127.0.0.1:8099 python run.py
+
+Runtime control (for load tests that change conditions mid-run):
+    GET  /_fake/stats     counters per endpoint and status
+    POST /_fake/config    JSON body with any of the FakeSumsubConfig fields
+    POST /_fake/reset     clear counters
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+KIND_TOKENS = 'tokens'
+KIND_REVIEW = 'review'
+KIND_REPORT = 'report'
+
+ROUTES = [
+    ('POST', re.compile(r'^/resources/accessTokens/sdk$'), KIND_TOKENS),
+    ('GET', re.compile(r'^/resources/applicants/(?P<applicant_id>[^/]+)/review$'), KIND_REVIEW),
+    ('GET', re.compile(r'^/resources/applicants/(?P<applicant_id>[^/]+)/summary/report$'), KIND_REPORT),
+]
+
+MODE_SYNTHETIC = 'synthetic'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+
+def parse_latency(spec):
+    """
+    Build a sampler from a latency spec (seconds):
+        0.1                      constant
+        uniform:0.05,0.3         uniform between bounds
+        normal:0.1,0.02          mean, stddev (clipped at 0)
+        lognormal:0.08,0.5       median, sigma - a realistic long tail
+        exponential:0.1          mean
+    """
+    if spec is None or spec == '':
+        return lambda: 0.0
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+
+    name, _, args = str(spec).partition(':')
+    if not args:
+        value = float(name)
+        return lambda: value
+
+    values = [float(v) for v in args.split(',')]
+    if name == 'uniform':
+        low, high = values
+        return lambda: random.uniform(low, high)
+    if name == 'normal':
+        mean, stddev = values
+        return lambda: max(random.gauss(mean, stddev), 0.0)
+    if name == 'lognormal':
+        median, sigma = values
+        mu = math.log(median)
+        return lambda: random.lognormvariate(mu, sigma)
+    if name == 'exponential':
+        mean, = values
+        return lambda: random.expovariate(1.0 / mean)
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+def synthetic_pdf(applicant_id, size=0):
+    """
+    A small valid PDF, deterministic per applicant, padded to about `size` bytes
+    """
+    text = f'Fake Sumsub applicant report {applicant_id}'.replace('(', '').replace(')', '')
+    stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'.encode()
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+        b'/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref_at = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        out += f'{offset:010d} 00000 n \n'.encode()
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n'.encode()
+
+    # Padding goes in comment lines between the trailer and startxref, so offsets stay valid
+    seed = hashlib.sha256(applicant_id.encode()).hexdigest().encode()
+    while len(out) < size - 32:
+        out += b'%' + seed + b'\n'
+
+    out += f'startxref\n{xref_at}\n%%EOF\n'.encode()
+    return bytes(out)
+
+
+class FakeSumsubConfig:
+    """
+    Behaviour of the fake server; every field can be changed at runtime via /_fake/config
+    """
+
+    FIELDS = ('app_token', 'secret_key', 'check_signature', 'max_clock_skew', 'latency',
+              'rate_429', 'rate_5xx', 'retry_after', 'review_answer', 'report_size',
+              'report_drop_after', 'mode', 'upstream', 'cassette')
+
+    def __init__(self, **overrides):
+        self.app_token = os.getenv('SUMSUB_APP_TOKEN', 'fake-app-token')
+        self.secret_key = os.getenv('SUMSUB_SECRET_KEY', 'fake-secret-key')
+        self.check_signature = True
+        self.max_clock_skew = 60.0
+        # Latency spec per endpoint kind; 'default' applies to kinds without their own
+        self.latency = {'default': 0.0}
+        self.rate_429 = 0.0
+        self.rate_5xx = 0.0
+        self.retry_after = 1
+        self.review_answer = 'GREEN'
+        self.report_size = 0
+        # Close the connection after this many report body bytes (0 = never), to test resumed downloads
+        self.report_drop_after = 0
+        self.mode = MODE_SYNTHETIC
+        self.upstream = 'https://api.sumsub.com'
+        self.cassette = None
+        self.update(overrides)
+
+    def update(self, values: dict):
+        for key, value in values.items():
+            if key not in self.FIELDS:
+                raise ValueError(f'Unknown fake Sumsub setting: {key}')
+            if key == 'latency' and not isinstance(value, dict):
+                value = {'default': value}
+            setattr(self, key, value)
+        self._samplers = {kind: parse_latency(spec) for kind, spec in self.latency.items()}
+
+    def sample_latency(self, kind):
+        sampler = self._samplers.get(kind) or self._samplers.get('default')
+        return sampler() if sampler else 0.0
+
+    def as_dict(self):
+        values = {key: getattr(self, key) for key in self.FIELDS}
+        values['secret_key'] = '***' if self.secret_key else None
+        return values
+
+
+class Cassette:
+    """
+    Recorded Sumsub responses, stored as JSON
+    Replay prefers an exact method+path match, then any recording of the same endpoint kind
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cursor = {}
+        self.entries = []
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f).get('entries', [])
+
+    def add(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+            if self.path:
+                tmp_path = f'{self.path}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'entries': self.entries}, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+
+    def find(self, method, path, kind):
+        with self._lock:
+            for entry in self.entries:
+                if entry['method'] == method and entry['path'] == path:
+                    return entry
+            candidates = [e for e in self.entries if e['kind'] == kind]
+            if not candidates:
+                return None
+            index = self._cursor.get(kind, 0)
+            self._cursor[kind] = index + 1
+            return candidates[index % len(candidates)]
+
+
+class FakeSumsubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeSumsub/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # -- plumbing --------------------------------------------------------
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        self.server.count('status', str(status))
+
+    def _error(self, status, description, headers=None):
+        self._send(status, {
+            'description': description,
+            'code': status,
+            'correlationId': uuid.uuid4().hex,
+        }, headers=headers)
+
+    def _verify_signature(self, body):
+        config = self.server.config
+        if self.headers.get('X-App-Token') != config.app_token:
+            return 'App token is invalid'
+        ts = self.headers.get('X-App-Access-Ts', '')
+        try:
+            skew = abs(time.time() - int(ts))
+        except ValueError:
+            return 'Request timestamp is invalid'
+        if skew > config.max_clock_skew:
+            return 'Request timestamp is out of range'
+        expected = hmac.new(
+            config.secret_key.encode(),
+            ts.encode() + self.command.encode() + self.path.encode() + body,
+            hashlib.sha256
+        ).hexdigest()
+        if not hmac.compare_digest(expected, self.headers.get('X-App-Access-Sig', '')):
+            return 'Request signature mismatch'
+        return None
+
+    # -- dispatch --------------------------------------------------------
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_HEAD(self):
+        # The client's pool warm-up only needs a response on an open connection
+        self._send(404)
+
+    def _dispatch(self):
+        body = self._read_body()
+        route_path = urlsplit(self.path).path
+
+        if route_path.startswith('/_fake/'):
+            return self._control(route_path, body)
+
+        for method, pattern, kind in ROUTES:
+            match = pattern.match(route_path)
+            if match and method == self.command:
+                return self._handle(kind, match.groupdict(), body)
+        self._error(404, f'Unknown endpoint {self.command} {route_path}')
+
+    def _handle(self, kind, path_args, body):
+        server = self.server
+        config = server.config
+        server.count('requests', kind)
+        server.enter()
+        try:
+            time.sleep(config.sample_latency(kind))
+
+            if config.mode == MODE_RECORD:
+                return self._record(kind, path_args, body)
+
+            if config.check_signature:
+                problem = self._verify_signature(body)
+                if problem:
+                    server.count('injected', 'signature_failures')
+                    return self._error(401, problem)
+
+            roll = random.random()
+            if roll < config.rate_429:
+                server.count('injected', '429')
+                return self._error(429, 'Too many requests', headers={'Retry-After': config.retry_after})
+            if roll < config.rate_429 + config.rate_5xx:
+                server.count('injected', '5xx')
+                return self._error(random.choice((500, 502, 503)), 'Injected server error')
+
+            if config.mode == MODE_REPLAY:
+                return self._replay(kind, path_args)
+            return getattr(self, f'_synthetic_{kind}')(path_args, body)
+        finally:
+            server.leave()
+
+    # -- synthetic responses --------------------------------------------
+
+    def _synthetic_tokens(self, path_args, body):
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return self._error(400, 'Request body is not valid JSON')
+        if not payload.get('userId') or not payload.get('levelName'):
+            return self._error(400, 'userId and levelName are required')
+        self._send(200, {
+            'token': f'_act-sbx-fake-{uuid.uuid4().hex}',
+            'userId': payload['userId'],
+        })
+
+    def _synthetic_review(self, path_args, body):
+        applicant_id = path_args['applicant_id']
+        now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self._send(200, {
+            'id': applicant_id,
+            'applicantId': applicant_id,
+            'reviewId': uuid.uuid4().hex[:8],
+            'attemptId': uuid.uuid4().hex[:5],
+            'attemptCnt': 1,
+            'levelName': 'basic-kyc-level',
+            'createDate': now,
+            'reviewDate': now,
+            'reviewStatus': 'completed',
+            'reviewResult': {'reviewAnswer': self.server.config.review_answer},
+            'priority': 0,
+        })
+
+    def _synthetic_report(self, path_args, body):
+        query = parse_qs(urlsplit(self.path).query)
+        if query.get('report', ['applicantReport'])[0] != 'applicantReport':
+            return self._error(400, 'Unsupported report type')
+        pdf = synthetic_pdf(path_args['applicant_id'], self.server.config.report_size)
+        self._send_ranged(pdf, 'application/pdf')
+
+    def _send_ranged(self, body, content_type):
+        """
+        Serve `body` honouring Range (single 'bytes=start-[end]') and If-Range,
+        with ETag and Digest headers; optionally drop the connection mid-body
+        """
+        total = len(body)
+        sha256 = hashlib.sha256(body)
+        etag = f'"{sha256.hexdigest()[:32]}"'
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'ETag': etag,
+            'Digest': 'sha-256=' + base64.b64encode(sha256.digest()).decode(),
+        }
+
+        status, start, end = 200, 0, total - 1
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        match = re.match(r'^bytes=(\d+)-(\d*)$', range_header or '')
+        if match and (if_range is None or if_range == etag):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+            if start >= total or start > end:
+                self.server.count('ranges', 'unsatisfiable')
+                return self._send(416, b'', headers={'Content-Range': f'bytes */{total}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{total}'
+            self.server.count('ranges', 'partial')
+
+        chunk = body[start:end + 1]
+        drop_after = self.server.config.report_drop_after
+        if not drop_after or drop_after >= len(chunk):
+            self._send(status, chunk, content_type=content_type, headers=headers)
+            self.server.add_bytes(len(chunk))
+            return
+
+        # Promise the whole range, deliver part of it, hang up
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(chunk)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(chunk[:drop_after])
+        self.wfile.flush()
+        self.close_connection = True
+        self.server.add_bytes(drop_after)
+        self.server.count('status', str(status))
+        self.server.count('injected', 'dropped')
+
+    # -- record / replay --------------------------------------------------
+
+    def _record(self, kind, path_args, body):
+        import requests
+
+        config = self.server.config
+        forward = {name: self.headers[name] for name in
+                   ('X-App-Token', 'X-App-Access-Sig', 'X-App-Access-Ts', 'Content-Type', 'Accept')
+                   if self.headers.get(name)}
+        try:
+            upstream = requests.request(self.command, config.upstream.rstrip('/') + self.path,
+                                        headers=forward, data=body, timeout=60)
+        except requests.RequestException as e:
+            return self._error(502, f'Upstream request failed: {e}')
+
+        content_type = upstream.headers.get('Content-Type', 'application/json')
+        headers = {'Retry-After': upstream.headers['Retry-After']} if 'Retry-After' in upstream.headers else {}
+        self.server.cassette.add({
+            'kind': kind,
+            'method': self.command,
+            'path': self.path,
+            'applicant_id': path_args.get('applicant_id'),
+            'status': upstream.status_code,
+            'content_type': content_type,
+            'headers': headers,
+            'body_b64': base64.b64encode(upstream.content).decode(),
+        })
+        self._send(upstream.status_code, upstream.content, content_type=content_type, headers=headers)
+
+    def _replay(self, kind, path_args):
+        entry = self.server.cassette.find(self.command, self.path, kind)
+        if entry is None:
+            return self._error(404, f'No recorded response for {kind}')
+
+        body = base64.b64decode(entry['body_b64'])
+        recorded_id = entry.get('applicant_id')
+        wanted_id = path_args.get('applicant_id')
+        # Re-target JSON responses recorded for another applicant
+        if recorded_id and wanted_id and recorded_id != wanted_id and 'json' in entry['content_type']:
+            body = body.replace(recorded_id.encode(), wanted_id.encode())
+        self._send(entry['status'], body, content_type=entry['content_type'], headers=entry.get('headers'))
+
+    # -- control ---------------------------------------------------------
+
+    def _control(self, route_path, body):
+        server = self.server
+        if route_path == '/_fake/stats' and self.command == 'GET':
+            return self._send(200, server.get_stats())
+        if route_path == '/_fake/config' and self.command == 'POST':
+            try:
+                server.configure(json.loads(body or b'{}'))
+            except ValueError as e:
+                return self._error(400, str(e))
+            return self._send(200, server.config.as_dict())
+        if route_path == '/_fake/reset' and self.command == 'POST':
+            server.reset_stats()
+            return self._send(200, {'status': 'ok'})
+        self._error(404, f'Unknown control endpoint {route_path}')
+
+
+class FakeSumsubServer(ThreadingHTTPServer):
+    """
+    Threaded fake Sumsub server; start() runs it in the background for tests and benches
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, config=None, verbose=False):
+        super().__init__((host, port), FakeSumsubHandler)
+        self.config = config or FakeSumsubConfig()
+        self.cassette = Cassette(self.config.cassette)
+        self.verbose = verbose
+        self._thread = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def configure(self, values: dict):
+        with self._lock:
+            self.config.update(values)
+            if 'cassette' in values:
+                self.cassette = Cassette(self.config.cassette)
+
+    def count(self, group, name):
+        with self._lock:
+            bucket = self._stats[group]
+            bucket[name] = bucket.get(name, 0) + 1
+
+    def enter(self):
+        with self._lock:
+            self._stats['in_flight'] += 1
+            self._stats['max_in_flight'] = max(self._stats['max_in_flight'], self._stats['in_flight'])
+
+    def leave(self):
+        with self._lock:
+            self._stats['in_flight'] -= 1
+
+    def add_bytes(self, count):
+        with self._lock:
+            self._stats['report_bytes_sent'] += count
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'requests': {}, 'status': {}, 'injected': {}, 'ranges': {},
+                           'report_bytes_sent': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    def get_stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-sumsub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Sumsub stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', default='0', help='latency spec for all endpoints')
+    parser.add_argument('--latency-tokens', help='latency spec for /accessTokens/sdk')
+    parser.add_argument('--latency-review', help='latency spec for /review')
+    parser.add_argument('--latency-report', help='latency spec for /summary/report')
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-5xx', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--report-size', type=int, default=0, help='pad synthetic PDFs to this many bytes')
+    parser.add_argument('--report-drop-after', type=int, default=0,
+                        help='close report responses after this many body bytes (resume testing)')
+    parser.add_argument('--review-answer', default='GREEN', choices=('GREEN', 'RED'))
+    parser.add_argument('--no-signature-check', action='store_true')
+    parser.add_argument('--mode', default=MODE_SYNTHETIC, choices=(MODE_SYNTHETIC, MODE_RECORD, MODE_REPLAY))
+    parser.add_argument('--upstream', default='https://api.sumsub.com')
+    parser.add_argument('--cassette', help='JSON file to record to / replay from')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    latency = {'default': args.latency}
+    for kind in (KIND_TOKENS, KIND_REVIEW, KIND_REPORT):
+        spec = getattr(args, f'latency_{kind}')
+        if spec:
+            latency[kind] = spec
+
+    config = FakeSumsubConfig(
+        latency=latency,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        retry_after=args.retry_after,
+        report_size=args.report_size,
+        report_drop_after=args.report_drop_after,
+        review_answer=args.review_answer,
+        check_signature=not args.no_signature_check,
+        mode=args.mode,
+        upstream=args.upstream,
+        cassette=args.cassette,
+    )
+    if config.mode != MODE_SYNTHETIC and not config.cassette:
+        parser.error('--cassette is required in record/replay mode')
+
+    server = FakeSumsubServer(args.host, args.port, config, verbose=args.verbose)
+    print(f"🧪 Fake Sumsub 已启动: {server.url} (模式: {config.mode})")
+    print(f"   设置 SUMSUB_API_URL={server.url} 即可让应用使用它")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
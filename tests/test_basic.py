@@ -102,6 +102,25 @@ def test_flask_client():
     print("✅ Flask 客户端测试通过")
 
 
+def test_metrics_requires_admin_auth():
+    """测试运行时指标端点需要管理员认证（METRICS_PUBLIC 开启时除外）"""
+    from app import create_app
+    from app.routes.admin_manual import ADMIN_SECRET_KEY
+    
+    app = create_app()
+    client = app.test_client()
+    
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'X-Admin-Key': 'wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'X-Admin-Key': ADMIN_SECRET_KEY})
+    assert response.status_code == 200
+    assert 'job_queue' in response.get_json()
+    
+    app.config['METRICS_PUBLIC'] = True
+    assert app.test_client().get('/metrics').status_code == 200
+    print("✅ 指标端点认证测试通过")
+
+
 class TestWebhookEndpoints:
     """Webhook 端点测试"""
     
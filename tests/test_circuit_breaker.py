@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Sumsub 熔断器测试
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+def test_breaker_opens_and_fails_fast():
+    """测试连续失败后熔断并快速失败"""
+    from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError, OPEN
+
+    breaker = CircuitBreaker('tokens', failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.before_call()
+    assert 0 < exc.value.retry_after <= 30
+    assert breaker.get_stats()['rejected'] == 1
+    print("✅ 熔断测试通过")
+
+
+def test_half_open_probe_closes_or_reopens():
+    """测试半开探测：成功则关闭，失败则重新打开"""
+    from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN
+
+    breaker = CircuitBreaker('applicant_review', failure_threshold=1, reset_timeout=0.05, half_open_probes=1)
+    breaker.before_call()
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    # 只放行一个探测请求
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    print("✅ 半开探测测试通过")
+
+
+def test_success_resets_failure_count():
+    """测试成功调用会清零连续失败计数"""
+    from app.services.circuit_breaker import CircuitBreaker, CLOSED
+
+    breaker = CircuitBreaker('report_download', failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    print("✅ 失败计数重置测试通过")
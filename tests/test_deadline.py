@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+请求时间预算（deadline）测试
+"""
+
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+class _UnavailableHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    hits = 0
+
+    def do_GET(self):
+        _UnavailableHandler.hits += 1
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_budget_per_blueprint():
+    """测试按蓝图配置时间预算"""
+    from app.utils import deadline
+
+    assert deadline.budget_for('verification') == 10.0
+    with patch.dict(os.environ, {'REQUEST_DEADLINE_WEBHOOK': '3'}):
+        assert deadline.budget_for('webhook') == 3.0
+    assert deadline.budget_for(None) == deadline.REQUEST_DEADLINE_DEFAULT
+    print("✅ 蓝图时间预算测试通过")
+
+
+def test_timeout_capped_by_remaining_budget():
+    """测试出站超时被剩余预算截断"""
+    from app.utils import deadline
+
+    assert deadline.remaining() is None
+    assert deadline.timeout(15) == 15
+
+    token = deadline.start(2)
+    try:
+        assert deadline.timeout(15) <= 2
+        assert deadline.allows(1)
+        assert not deadline.allows(5)
+    finally:
+        deadline.clear(token)
+
+    token = deadline.start(0.1)
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.timeout(15)
+    finally:
+        deadline.clear(token)
+    print("✅ 超时截断测试通过")
+
+
+def test_client_skips_retries_beyond_budget():
+    """测试预算不足时跳过重试"""
+    from app.services.rate_limiter import AdaptiveRateLimiter
+    from app.services.sumsub_client import SumsubClient
+    from app.utils import deadline
+
+    _UnavailableHandler.hits = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UnavailableHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = SumsubClient(
+        app_token='tok', secret_key='secret',
+        api_url=f'http://127.0.0.1:{server.server_address[1]}',
+        limiter=AdaptiveRateLimiter()
+    )
+
+    token = deadline.start(1.2)
+    started = time.monotonic()
+    try:
+        response = client.request('GET', '/resources/applicants/a/review')
+    finally:
+        deadline.clear(token)
+        server.shutdown()
+        server.server_close()
+
+    # 第一次重试需要 1s 退避 + 0.5s 最小尝试时间，超出 1.2s 预算，因此不再重试
+    assert response.status_code == 503
+    assert _UnavailableHandler.hits == 1
+    assert time.monotonic() - started < 1.0
+    print("✅ 预算内重试测试通过")
+
+
+def test_request_gets_503_when_budget_exhausted():
+    """测试预算耗尽时返回干净的 503"""
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        app = create_app()
+
+    from app.utils import deadline
+
+    @app.route('/verify-slow-test')
+    def _slow():
+        time.sleep(0.3)
+        deadline.check(what='test step')
+        return 'unreachable'
+
+    with patch.dict(os.environ, {'REQUEST_DEADLINE_DEFAULT': '0.2'}):
+        response = app.test_client().get('/verify-slow-test', headers={'Accept': 'application/json'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json()['type'] == 'DeadlineExceeded'
+    print("✅ 预算耗尽 503 测试通过")
+
+
+class _QueryCanceled(Exception):
+    """模拟 psycopg2 的 QueryCanceled（SQLSTATE 57014）"""
+    pgcode = '57014'
+
+
+def test_order_webhook_gets_503_when_budget_exhausted():
+    """测试订单 Webhook 预算耗尽（或数据库语句被 statement_timeout 取消）时返回 503 和 Retry-After，而不是 500"""
+    from sqlalchemy.exc import OperationalError
+
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        app = create_app()
+
+    from app.services import order_service
+    from app.utils import deadline
+
+    @app.route('/statement-timeout-test')
+    def _canceled():
+        raise OperationalError('SELECT 1', {}, _QueryCanceled('canceling statement due to statement timeout'))
+
+    def _slow_create(order_data):
+        time.sleep(0.3)
+        deadline.check(what='order insert')
+
+    def _canceled_create(order_data):
+        raise OperationalError('INSERT INTO orders ...', {}, _QueryCanceled('canceling statement due to statement timeout'))
+
+    order = {'order_id': 'DEADLINE_001', 'buyer_name': '张三', 'buyer_email': 'buyer@example.com'}
+    for create in (_slow_create, _canceled_create):
+        with patch.dict(os.environ, {'REQUEST_DEADLINE_WEBHOOK': '0.2'}), \
+             patch.object(order_service, 'create_order', side_effect=create):
+            response = app.test_client().post('/webhook/taobao/order', json=order)
+        assert response.status_code == 503, create.__name__
+        assert response.headers['Retry-After'] == '1'
+        assert response.get_json()['type'] == 'DeadlineExceeded'
+
+    # 没有被路由捕获的语句超时也由错误处理器转换
+    response = app.test_client().get('/statement-timeout-test', headers={'Accept': 'application/json'})
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    print("✅ 订单 Webhook 预算耗尽 503 测试通过")
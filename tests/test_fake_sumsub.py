@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+本地 Fake Sumsub 服务测试
+验证签名校验、各端点响应、错误注入和录制回放
+"""
+
+import base64
+import json
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+from fake_sumsub import FakeSumsubConfig, FakeSumsubServer, parse_latency
+
+
+@pytest.fixture
+def fake_server():
+    config = FakeSumsubConfig(app_token='tok', secret_key='secret')
+    server = FakeSumsubServer(config=config).start()
+    yield server
+    server.stop()
+
+
+def _client(server, secret='secret'):
+    from app.services.rate_limiter import AdaptiveRateLimiter
+    from app.services.sumsub_client import SumsubClient
+
+    return SumsubClient(app_token='tok', secret_key=secret, api_url=server.url,
+                        pool_size=2, limiter=AdaptiveRateLimiter())
+
+
+def test_endpoints_with_valid_signature(fake_server):
+    """测试签名正确时三个端点均返回 Sumsub 格式的响应"""
+    client = _client(fake_server)
+
+    body = json.dumps({'userId': 'user_1', 'levelName': 'basic-kyc-level'})
+    response = client.request('POST', '/resources/accessTokens/sdk', body=body)
+    assert response.status_code == 200
+    assert response.json()['userId'] == 'user_1'
+    assert response.json()['token'].startswith('_act-')
+
+    response = client.request('GET', '/resources/applicants/app_1/review')
+    assert response.status_code == 200
+    assert response.json()['reviewResult']['reviewAnswer'] == 'GREEN'
+
+    response = client.request('GET', '/resources/applicants/app_1/summary/report',
+                              params={'report': 'applicantReport', 'lang': 'en'},
+                              accept='application/pdf')
+    assert response.status_code == 200
+    assert response.content.startswith(b'%PDF-')
+
+    stats = fake_server.get_stats()
+    assert stats['requests'] == {'tokens': 1, 'review': 1, 'report': 1}
+    print("✅ Fake Sumsub 端点测试通过")
+
+
+def test_bad_signature_is_rejected(fake_server):
+    """测试签名错误返回 401"""
+    client = _client(fake_server, secret='wrong')
+    response = client.request('GET', '/resources/applicants/app_1/review')
+    assert response.status_code == 401
+    assert fake_server.get_stats()['injected']['signature_failures'] == 1
+    print("✅ 签名校验测试通过")
+
+
+def test_injected_throttling(fake_server):
+    """测试注入的 429 带 Retry-After"""
+    from app.services import sumsub_client
+
+    fake_server.configure({'rate_429': 1.0, 'retry_after': 0})
+    client = _client(fake_server)
+    with patch.object(sumsub_client, 'SUMSUB_THROTTLE_RETRIES', 0):
+        response = client.request('GET', '/resources/applicants/app_1/review')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '0'
+    assert fake_server.get_stats()['injected']['429'] == 1
+    print("✅ 错误注入测试通过")
+
+
+def test_replay_retargets_recorded_response(tmp_path):
+    """测试回放录制的响应，并替换为请求的申请人 ID"""
+    cassette = tmp_path / 'cassette.json'
+    recorded = {'id': 'recorded_app', 'reviewStatus': 'completed'}
+    cassette.write_text(json.dumps({'entries': [{
+        'kind': 'review',
+        'method': 'GET',
+        'path': '/resources/applicants/recorded_app/review',
+        'applicant_id': 'recorded_app',
+        'status': 200,
+        'content_type': 'application/json',
+        'headers': {},
+        'body_b64': base64.b64encode(json.dumps(recorded).encode()).decode(),
+    }]}))
+
+    config = FakeSumsubConfig(app_token='tok', secret_key='secret', mode='replay', cassette=str(cassette))
+    server = FakeSumsubServer(config=config).start()
+    try:
+        response = _client(server).request('GET', '/resources/applicants/other_app/review')
+    finally:
+        server.stop()
+
+    assert response.status_code == 200
+    assert response.json() == {'id': 'other_app', 'reviewStatus': 'completed'}
+    print("✅ 录制回放测试通过")
+
+
+def test_latency_specs():
+    """测试延迟分布配置解析"""
+    assert parse_latency('0.25')() == 0.25
+    assert 0.1 <= parse_latency('uniform:0.1,0.2')() <= 0.2
+    assert parse_latency('lognormal:0.1,0.5')() > 0
+    with pytest.raises(ValueError):
+        parse_latency('bogus:1')
+    print("✅ 延迟分布测试通过")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+对冲请求测试
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+def test_slow_primary_is_hedged():
+    """测试主请求过慢时发出对冲请求，先返回者为准"""
+    from app.services import hedging
+    from app.services.hedging import Hedger
+
+    hedger = Hedger('test', budget=1.0, enabled=True)
+    attempts = []
+    lock = threading.Lock()
+
+    def fetch():
+        with lock:
+            attempts.append(1)
+            first = len(attempts) == 1
+        if first:
+            time.sleep(1.0)
+            return 'slow'
+        return 'fast'
+
+    with patch.object(hedging, 'SUMSUB_HEDGE_DEFAULT_DELAY', 0.05):
+        started = time.monotonic()
+        result = hedger.call(fetch)
+        elapsed = time.monotonic() - started
+
+    assert result == 'fast'
+    assert elapsed < 0.5
+    stats = hedger.get_stats()
+    assert stats['hedges_sent'] == 1
+    assert stats['hedge_wins'] == 1
+    print("✅ 对冲请求测试通过")
+
+
+def test_hedge_budget_denies_extra_requests():
+    """测试对冲预算耗尽后不再发出额外请求"""
+    from app.services import hedging
+    from app.services.hedging import Hedger
+
+    hedger = Hedger('test_budget', budget=0.0, enabled=True)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'ok'
+
+    with patch.object(hedging, 'SUMSUB_HEDGE_DEFAULT_DELAY', 0.01):
+        # 初始预算只够一次对冲
+        assert hedger.call(fetch) == 'ok'
+        assert hedger.call(fetch) == 'ok'
+
+    stats = hedger.get_stats()
+    assert stats['hedges_sent'] == 1
+    assert stats['budget_denied'] == 1
+    assert len(calls) == 3
+    print("✅ 对冲预算测试通过")
+
+
+def test_disabled_hedger_calls_directly():
+    """测试关闭对冲时直接调用"""
+    from app.services.hedging import Hedger
+
+    hedger = Hedger('test_disabled', enabled=False)
+    assert hedger.call(lambda x: x * 2, 21) == 42
+    assert hedger.get_stats()['calls'] == 0
+    print("✅ 关闭对冲测试通过")
+
+
+def test_hedge_skipped_when_pool_is_full():
+    """测试线程池已满时跳过对冲（主请求在调用方线程中执行）而不是排队"""
+    from app.services import hedging
+    from app.services.hedging import Hedger
+
+    hedger = Hedger('test_pool_full', budget=1.0, enabled=True)
+    calls = []
+
+    def fetch():
+        calls.append(threading.current_thread().name)
+        time.sleep(0.2)
+        return 'ok'
+
+    primary_pool = hedging._BoundedPool(2, 'test-primary')
+    hedge_pool = hedging._BoundedPool(1, 'test-hedge')
+    assert hedge_pool.acquire()
+    with patch.object(hedging, 'SUMSUB_HEDGE_DEFAULT_DELAY', 0.05), \
+         patch.object(hedging, '_primary_pool', primary_pool), \
+         patch.object(hedging, '_hedge_pool', hedge_pool):
+        # 并发调用多于线程池大小，也不会互相排队
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(hedger.call(fetch)), name=f'caller-{n}')
+                   for n in range(8)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+    assert results == ['ok'] * len(threads)
+    assert len(calls) == len(threads)
+    assert elapsed < 0.6
+    # 最多 2 个主请求进入线程池，其余在调用方线程中执行
+    assert len([name for name in calls if name.startswith('test-primary')]) <= 2
+    assert any(name.startswith('caller-') for name in calls)
+    stats = hedger.get_stats()
+    assert stats['hedges_sent'] == 0
+    assert stats['primary_pool_full'] >= 1
+    assert stats['hedge_pool_full'] + stats['primary_pool_full'] + stats['budget_denied'] == len(threads)
+    print("✅ 对冲线程池满时跳过测试通过")
+
+
+def test_losing_attempt_stops_retrying():
+    """测试对冲请求先返回后，落后的请求在下一次重试前停止，而不是继续重试"""
+    from app.services import hedging
+    from app.services.hedging import Hedger
+
+    hedger = Hedger('test_cancel_loser', budget=1.0, enabled=True)
+    attempts = []
+    lock = threading.Lock()
+
+    def fetch():
+        with lock:
+            attempts.append(1)
+            first = len(attempts) == 1
+        if not first:
+            return 'hedge'
+        # 主请求一直失败并退避重试（与 Sumsub 客户端相同的重试方式）
+        for _ in range(20):
+            hedging.check_cancelled()
+            hedging.pause(0.1)
+        return 'primary'
+
+    with patch.object(hedging, 'SUMSUB_HEDGE_DEFAULT_DELAY', 0.05):
+        assert hedger.call(fetch) == 'hedge'
+        for _ in range(50):
+            if hedger.get_stats()['losers_cancelled']:
+                break
+            time.sleep(0.02)
+
+    stats = hedger.get_stats()
+    assert (stats['hedge_wins'], stats['losers_cancelled'], stats['losers_completed']) == (1, 1, 0)
+    assert len(attempts) == 2
+    print("✅ 落后请求取消测试通过")
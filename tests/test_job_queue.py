@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+后台任务队列测试
+"""
+
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+@pytest.fixture
+def app():
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        app = create_app()
+    yield app
+
+
+def test_async_order_webhook_is_processed_by_worker(app):
+    """测试异步模式下订单 Webhook 返回 202，由 worker 创建订单"""
+    from app import db
+    from app.models import Order, Job
+    from app.routes import webhook
+    from app.services import job_queue
+
+    with patch.object(webhook, 'WEBHOOK_ASYNC', True):
+        response = app.test_client().post('/webhook/taobao/order', json={
+            'order_id': 'ASYNC_001',
+            'buyer_name': '张三',
+            'buyer_email': 'buyer@example.com',
+            'platform': 'taobao',
+        })
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    with app.app_context():
+        assert Order.query.count() == 0
+
+    assert job_queue.work(app, worker_id='test', once=True) == 1
+
+    with app.app_context():
+        order = Order.query.filter_by(taobao_order_id='ASYNC_001').one()
+        assert order.verification is not None
+        assert db.session.get(Job, job_id).status == job_queue.STATUS_DONE
+    print("✅ 异步订单 Webhook 测试通过")
+
+
+def test_failing_job_retries_then_dead_letters(app):
+    """测试失败任务按退避重试，超过次数后进入死信"""
+    from app import db
+    from app.models import Job
+    from app.services import job_queue
+
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload)
+        raise RuntimeError('boom')
+
+    job_queue.register('test_flaky', flaky)
+    with app.app_context():
+        job_id = job_queue.enqueue('test_flaky', {'n': 1}, max_attempts=2).id
+
+    from datetime import datetime
+
+    job_queue.work(app, worker_id='test', once=True)
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.status == job_queue.STATUS_QUEUED
+        assert job.attempts == 1
+        assert job.run_at > datetime.utcnow()
+        assert 'boom' in job.last_error
+        # 跳过退避等待
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+
+    job_queue.work(app, worker_id='test', once=True)
+
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.status == job_queue.STATUS_DEAD
+        assert job.attempts == 2
+        assert job_queue.retry_dead('test_flaky') == 1
+        assert db.session.get(Job, job_id).status == job_queue.STATUS_QUEUED
+    assert len(calls) == 2
+    print("✅ 任务重试和死信测试通过")
+
+
+def test_expired_lease_is_requeued(app):
+    """测试 worker 崩溃后，租约过期的任务重新入队"""
+    from datetime import datetime, timedelta
+    from app import db
+    from app.models import Job
+    from app.services import job_queue
+
+    with app.app_context():
+        job_id = job_queue.enqueue('test_noop', {}).id
+        assert job_queue.claim('crashed-worker') == [job_id]
+        job = db.session.get(Job, job_id)
+        job.locked_at = datetime.utcnow() - timedelta(seconds=job_queue.JOB_LEASE_SECONDS + 1)
+        db.session.commit()
+
+        assert job_queue.release_expired_leases() == 1
+        job = db.session.get(Job, job_id)
+        assert job.status == job_queue.STATUS_QUEUED
+        assert job.locked_by is None
+    print("✅ 任务租约过期测试通过")
+
+
+def test_job_requeued_while_waiting_in_batch_runs_once(app):
+    """测试批量领取后排队等待的任务租约过期被其他 worker 领走时，原 worker 不再执行也不覆盖结果"""
+    from datetime import datetime, timedelta
+    from app import db
+    from app.models import Job
+    from app.services import job_queue
+
+    calls = []
+    job_queue.register('test_lease', lambda payload: calls.append(payload['n']))
+
+    with app.app_context():
+        first, second = (job_queue.enqueue('test_lease', {'n': n}).id for n in (1, 2))
+        assert set(job_queue.claim('worker-a', limit=2)) == {first, second}
+
+        # worker-a 执行第一个任务期间，第二个任务的租约过期，被 worker-b 领走
+        assert job_queue.run_job(first, 'worker-a') == job_queue.STATUS_DONE
+        job = db.session.get(Job, second)
+        job.locked_at = datetime.utcnow() - timedelta(seconds=job_queue.JOB_LEASE_SECONDS + 1)
+        db.session.commit()
+        assert job_queue.release_expired_leases() == 1
+        assert job_queue.claim('worker-b') == [second]
+
+        assert job_queue.run_job(second, 'worker-a') == job_queue.STATUS_RUNNING
+        assert db.session.get(Job, second).locked_by == 'worker-b'
+        assert job_queue.run_job(second, 'worker-b') == job_queue.STATUS_DONE
+    assert calls == [1, 2]
+    print("✅ 批量任务租约测试通过")
+
+
+def test_lease_renewed_when_job_starts(app):
+    """测试任务开始执行时续租，批内靠后的任务不会因等待而过期"""
+    from datetime import datetime, timedelta
+    from app import db
+    from app.models import Job
+    from app.services import job_queue
+
+    seen = []
+
+    def check_lease(payload):
+        job = db.session.get(Job, payload['id'])
+        seen.append(datetime.utcnow() - job.locked_at)
+        # 执行中的任务不会被当作租约过期
+        assert job_queue.release_expired_leases() == 0
+
+    job_queue.register('test_renew', check_lease)
+    with app.app_context():
+        job = job_queue.enqueue('test_renew', {})
+        job.payload = {'id': job.id}
+        db.session.commit()
+        job_id = job.id
+        assert job_queue.claim('worker-a') == [job_id]
+        # 领取后在批内等待了接近一个租约期
+        db.session.get(Job, job_id).locked_at = datetime.utcnow() - timedelta(seconds=job_queue.JOB_LEASE_SECONDS - 1)
+        db.session.commit()
+
+        assert job_queue.run_job(job_id, 'worker-a') == job_queue.STATUS_DONE
+    assert seen and seen[0] < timedelta(seconds=5)
+    print("✅ 任务续租测试通过")
+
+
+def test_outcome_not_recorded_after_lease_lost_mid_run(app):
+    """测试执行中租约被收回并交给其他 worker 时，原 worker 不覆盖任务状态"""
+    from datetime import datetime, timedelta
+    from app import db
+    from app.models import Job
+    from app.services import job_queue
+
+    def stalled(payload):
+        job = db.session.get(Job, payload['id'])
+        job.locked_at = datetime.utcnow() - timedelta(seconds=job_queue.JOB_LEASE_SECONDS + 1)
+        db.session.commit()
+        assert job_queue.release_expired_leases() == 1
+        assert job_queue.claim('worker-b') == [payload['id']]
+
+    job_queue.register('test_stalled', stalled)
+    with app.app_context():
+        job = job_queue.enqueue('test_stalled', {})
+        job.payload = {'id': job.id}
+        db.session.commit()
+        job_id = job.id
+        assert job_queue.claim('worker-a') == [job_id]
+
+        assert job_queue.run_job(job_id, 'worker-a') is None
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.locked_by) == (job_queue.STATUS_RUNNING, 'worker-b')
+    print("✅ 租约丢失不记录结果测试通过")
+
+
+def test_prune_finished_jobs(app):
+    """测试只删除超过保留期的已完成任务，积压计数只统计排队中的任务"""
+    from datetime import datetime, timedelta
+    from app import db
+    from app.models import Job
+    from app.services import job_queue
+
+    job_queue.register('test_prune', lambda payload: None)
+    with app.app_context():
+        ids = [job_queue.enqueue('test_prune', {'n': n}).id for n in range(3)]
+        job_queue.run_now(ids, worker_id='test')
+        old = datetime.utcnow() - timedelta(days=job_queue.JOB_RETENTION_DAYS + 1)
+        Job.query.filter(Job.id.in_(ids[:2])).update({'updated_at': old}, synchronize_session=False)
+        dead = job_queue.enqueue('test_prune', {})
+        dead.status, dead.updated_at = job_queue.STATUS_DEAD, old
+        job_queue.enqueue('test_prune', {'queued': True})
+        db.session.commit()
+
+        assert job_queue.queued_count() == 1
+        assert job_queue.prune(batch_size=1) == 2
+        assert job_queue.counts() == {job_queue.STATUS_DONE: 1, job_queue.STATUS_DEAD: 1, job_queue.STATUS_QUEUED: 1}
+    print("✅ 已完成任务清理测试通过")
+
+
+def test_job_keeps_caller_deadline(app):
+    """测试调用方已有更短的截止时间时，任务不会把它延长到 JOB_DEADLINE"""
+    from app.services import job_queue
+    from app.utils import deadline
+
+    budgets = []
+    job_queue.register('test_deadline', lambda payload: budgets.append(deadline.remaining()))
+    with app.app_context():
+        ids = [job_queue.enqueue('test_deadline', {}).id for _ in range(2)]
+        token = deadline.start(2)
+        try:
+            job_queue.run_now(ids[:1], worker_id='test')
+        finally:
+            deadline.clear(token)
+        # 没有调用方截止时间时使用 JOB_DEADLINE
+        job_queue.run_now(ids[1:], worker_id='test')
+        assert deadline.remaining() is None
+
+    assert 0 < budgets[0] <= 2
+    assert 2 < budgets[1] <= job_queue.JOB_DEADLINE
+    print("✅ 任务沿用调用方截止时间测试通过")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+批量订单 Webhook 测试
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+@pytest.fixture
+def app():
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        app = create_app()
+        app.config['TESTING'] = True
+    yield app
+
+
+def _order(order_id, **extra):
+    return dict({
+        'order_id': order_id,
+        'buyer_name': '张三',
+        'buyer_email': 'buyer@example.com',
+        'platform': 'taobao',
+        'order_amount': 99.0,
+    }, **extra)
+
+
+def test_json_array_batch(app):
+    """测试 JSON 数组批量写入：新建、批内重复、已存在、无效"""
+    client = app.test_client()
+    client.post('/webhook/taobao/order', json=_order('TB_EXISTING'))
+
+    response = client.post('/webhook/taobao/orders', json=[
+        _order('TB_BATCH_1'),
+        _order('TB_BATCH_1'),
+        _order('TB_EXISTING'),
+        _order('TB_BATCH_2', buyer_email=None),
+        'not an order',
+        _order(12345),
+    ])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    statuses = [item['status'] for item in body['results']]
+    assert statuses == ['created', 'already_exists', 'already_exists', 'invalid', 'invalid', 'created']
+    assert [item['index'] for item in body['results']] == list(range(6))
+    assert body['results'][0]['verification_link']
+    assert body['results'][1]['order_id'] == body['results'][0]['order_id']
+    assert body['results'][5]['taobao_order_id'] == '12345'
+    assert body['summary'] == {'created': 2, 'already_exists': 2, 'invalid': 2, 'error': 0}
+
+    with app.app_context():
+        from app.models import Order, Verification
+        assert Order.query.count() == 3
+        assert Verification.query.count() == 3
+    print("✅ JSON 数组批量写入测试通过")
+
+
+def test_ndjson_batch_in_chunks(app):
+    """测试 NDJSON 批量写入，分块插入且坏行单独标记为无效"""
+    from app.routes import webhook
+
+    lines = [json.dumps(_order(f'TB_ND_{i}')) for i in range(5)]
+    lines.insert(2, '{broken')
+    body = '\n'.join(lines) + '\n'
+
+    with patch.object(webhook, 'WEBHOOK_BATCH_CHUNK', 2):
+        response = app.test_client().post(
+            '/webhook/taobao/orders', data=body, content_type='application/x-ndjson'
+        )
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [item['status'] for item in results] == ['created', 'created', 'invalid', 'created', 'created', 'created']
+    assert 'line 3' in results[2]['error']
+    print("✅ NDJSON 批量写入测试通过")
+
+
+def test_json_array_malformed_element_is_invalid(app):
+    """测试 JSON 数组中格式错误或过大的元素与 NDJSON 坏行一样单独标记为无效，其余订单正常写入"""
+    from app.utils import batch_stream
+
+    good = [json.dumps(_order(f'TB_ARR_{i}', buyer_name='张三 [批量], "引号"')) for i in range(3)]
+    body = '[' + ', '.join([good[0], '{"order_id": "TB_BROKEN",}', good[1], json.dumps(_order('TB_HUGE', note='x' * 500)), good[2]]) + ']'
+
+    with patch.object(batch_stream, 'READ_CHUNK', 64), \
+         patch.object(batch_stream, 'MAX_ITEM_CHARS', 400):
+        response = app.test_client().post('/webhook/taobao/orders', data=body, content_type='application/json')
+        # 结果是流式返回的，在限制仍生效时读取
+        assert response.status_code == 200
+        results = response.get_json()['results']
+
+    assert [item['status'] for item in results] == ['created', 'invalid', 'created', 'invalid', 'created']
+    assert 'element 1' in results[1]['error']
+    assert 'larger than' in results[3]['error']
+
+    # 整体不是 JSON 数组（缺少结尾的 ]）时仍整体拒绝
+    response = app.test_client().post('/webhook/taobao/orders', data=body[:-1], content_type='application/json')
+    assert response.status_code == 400
+    print("✅ JSON 数组坏元素单独标记测试通过")
+
+
+def test_batch_signature_and_limits(app):
+    """测试签名校验、数量上限和格式错误"""
+    from app.routes import webhook
+
+    client = app.test_client()
+    payload = json.dumps([_order('TB_SIGNED')]).encode()
+
+    with patch.dict(os.environ, {'WEBHOOK_SECRET': 'secret'}):
+        bad = client.post('/webhook/taobao/orders', data=payload, content_type='application/json',
+                          headers={'X-Webhook-Signature': 'wrong'})
+        signature = hmac.new(b'secret', payload, hashlib.sha256).hexdigest()
+        good = client.post('/webhook/taobao/orders', data=payload, content_type='application/json',
+                           headers={'X-Webhook-Signature': signature})
+    assert bad.status_code == 401
+    assert good.status_code == 200
+    assert good.get_json()['results'][0]['status'] == 'created'
+
+    with patch.object(webhook, 'WEBHOOK_BATCH_MAX_ITEMS', 2):
+        response = client.post('/webhook/taobao/orders', json=[_order(f'TB_MANY_{i}') for i in range(3)])
+    assert response.status_code == 413
+
+    with patch.object(webhook, 'WEBHOOK_BATCH_MAX_BYTES', 16):
+        response = client.post('/webhook/taobao/orders', json=[_order('TB_BIG')])
+    assert response.status_code == 413
+
+    response = client.post('/webhook/taobao/orders', data='{"order_id": "x"}', content_type='application/json')
+    assert response.status_code == 400
+
+    with app.app_context():
+        from app.models import Order
+        assert Order.query.filter(Order.taobao_order_id.like('TB_MANY_%')).count() == 0
+    print("✅ 签名与上限测试通过")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Sumsub 出站限流器测试
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+def _math(max_rate=10.0, burst=2.0):
+    from app.services.rate_limiter import _BucketMath
+    return _BucketMath(max_rate=max_rate, min_rate=0.5, burst=burst, recovery=0.0, backoff=0.5)
+
+
+def test_bucket_queues_and_rejects():
+    """测试令牌桶排队等待与超时拒绝"""
+    from app.services.rate_limiter import AdaptiveRateLimiter, MemoryBucket, RateLimitExceeded
+
+    math = _math(max_rate=10.0, burst=2.0)
+    limiter = AdaptiveRateLimiter(bucket=MemoryBucket(math), max_wait=0.15)
+    limiter.math = math
+
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0
+    waited = limiter.acquire()
+    assert 0 < waited <= 0.11
+
+    limiter.bucket._state['tokens'] = -5
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire()
+    assert limiter.get_stats()['rejections'] == 1
+    print("✅ 令牌桶测试通过")
+
+
+def test_throttle_halves_rate_and_honors_retry_after():
+    """测试 429 时乘性降速并按 Retry-After 暂停"""
+    from app.services.rate_limiter import MemoryBucket
+
+    math = _math(max_rate=10.0)
+    bucket = MemoryBucket(math)
+    bucket.throttle(2.0)
+    bucket.throttle(2.0)  # 同一秒内的多个 429 只降速一次
+
+    assert bucket._state['rate'] == 5.0
+    assert bucket.reserve(max_wait=1.0) is None
+    wait = bucket.reserve(max_wait=5.0)
+    assert 1.5 < wait <= 2.0
+    print("✅ 429 降速测试通过")
+
+
+def test_parse_retry_after():
+    """测试 Retry-After 解析"""
+    from app.services.rate_limiter import parse_retry_after
+
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) == 1.0
+    assert parse_retry_after('garbage') == 1.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    print("✅ Retry-After 解析测试通过")
+
+
+def test_database_bucket_shares_state():
+    """测试数据库后端在多个限流器实例之间共享状态"""
+    from app.services.rate_limiter import DatabaseBucket
+
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        app = create_app()
+
+    math = _math(max_rate=10.0, burst=1.0)
+    first = DatabaseBucket(math, name='test', app=app)
+    second = DatabaseBucket(math, name='test', app=app)
+
+    assert first.reserve(max_wait=0) == 0
+    assert second.reserve(max_wait=0) is None
+    second.throttle(1.0)
+    assert first.current_rate() == 5.0
+    print("✅ 数据库限流后端测试通过")
+
+
+def test_database_bucket_insert_race_and_read_only_rate():
+    """测试数据库后端：并发创建同一行不冲突，读取当前速率不加锁也不写入"""
+    from app.services.rate_limiter import DatabaseBucket
+
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app, db
+        from app.models import RateLimitBucket
+        app = create_app()
+
+    bucket = DatabaseBucket(_math(max_rate=10.0, burst=1.0), name='race', app=app)
+    assert bucket.current_rate() == 10.0
+    with app.app_context():
+        assert RateLimitBucket.query.count() == 0
+
+    # 另一个进程在本进程 SELECT 之后、INSERT 之前创建了同一行
+    insert_missing = bucket._insert_missing
+
+    def racing(conn, table, now):
+        insert_missing(conn, table, now)
+        insert_missing(conn, table, now)
+
+    with patch.object(bucket, '_insert_missing', racing):
+        assert bucket.reserve(max_wait=0) == 0
+    assert bucket.reserve(max_wait=0) is None
+
+    with app.app_context():
+        before = db.session.get(RateLimitBucket, 'race').updated_at
+    assert bucket.current_rate() == 10.0
+    with app.app_context():
+        assert RateLimitBucket.query.count() == 1
+        assert db.session.get(RateLimitBucket, 'race').updated_at == before
+    print("✅ 数据库限流并发创建与只读速率测试通过")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+pending 验证对账测试
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+@pytest.fixture
+def app():
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        from app.services import job_queue
+        app = create_app()
+    # 报告生成任务留给 worker
+    with patch.object(job_queue, 'JOB_WORKER_ENABLED', True):
+        yield app
+
+
+REVIEWS = {
+    'green': {'id': 'green', 'reviewStatus': 'completed', 'reviewResult': {'reviewAnswer': 'GREEN'}},
+    'red': {'id': 'red', 'reviewStatus': 'completed',
+            'reviewResult': {'reviewAnswer': 'RED', 'reviewRejectType': 'FINAL'}},
+    'retry': {'id': 'retry', 'reviewStatus': 'completed',
+              'reviewResult': {'reviewAnswer': 'RED', 'reviewRejectType': 'RETRY'}},
+    'waiting': {'id': 'waiting', 'reviewStatus': 'pending'},
+}
+
+
+def _verifications(app, applicant_ids, age_minutes=120):
+    from app import db
+    from app.models import Order, Verification
+
+    created_at = datetime.utcnow() - timedelta(minutes=age_minutes)
+    with app.app_context():
+        for i, applicant_id in enumerate(applicant_ids):
+            order = Order(taobao_order_id=f'TB_RECON_{applicant_id}', buyer_id='b1', buyer_name='张三',
+                          buyer_email='buyer@example.com', platform='taobao')
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(Verification(
+                order_id=order.id,
+                sumsub_applicant_id=applicant_id,
+                verification_link=f'/verify/{applicant_id}',
+                verification_token=f'token_{applicant_id}',
+                created_at=created_at + timedelta(seconds=i)
+            ))
+        db.session.commit()
+
+
+def _fake_review(applicant_id):
+    if applicant_id not in REVIEWS:
+        raise Exception('Failed to get review: not found')
+    return REVIEWS[applicant_id]
+
+
+def _statuses(app):
+    from app.models import Verification
+
+    with app.app_context():
+        return {v.sumsub_applicant_id: v.status for v in Verification.query.all()}
+
+
+def test_reconcile_resolves_final_reviews(app):
+    """测试对账：最终结果批量更新并排队生成报告，其余保持 pending"""
+    from app import db
+    from app.models import Job, Report, Checkpoint
+    from app.services import reconciler, sumsub_service
+
+    _verifications(app, ['green', 'red', 'retry', 'waiting', 'missing'])
+    _verifications(app, ['recent'], age_minutes=1)
+
+    batches = []
+    with patch.object(sumsub_service, 'get_verification_result', side_effect=_fake_review) as fetch:
+        stats = reconciler.reconcile(app, min_age_minutes=60, batch_size=2, workers=2, progress=batches.append)
+
+    assert fetch.call_count == 5
+    assert stats['completed'] is True
+    assert stats['batches'] == 3
+    assert [s['scanned'] for s in batches] == [2, 4, 5]
+    assert (stats['approved'], stats['rejected'], stats['unchanged'], stats['errors']) == (1, 1, 2, 1)
+    assert stats['per_second'] > 0
+
+    assert _statuses(app) == {
+        'green': 'approved', 'red': 'rejected', 'retry': 'pending',
+        'waiting': 'pending', 'missing': 'pending', 'recent': 'pending',
+    }
+    with app.app_context():
+        assert Job.query.filter_by(kind=sumsub_service.JOB_GENERATE_REPORT).count() == 2
+        report = Report.query.filter_by(verification_result='approved').one()
+        assert report.status == 'generating'
+        assert report.verification_details == REVIEWS['green']
+        assert db.session.get(Checkpoint, reconciler.CHECKPOINT_NAME).cursor is None
+    print("✅ 对账更新测试通过")
+
+
+def test_reconcile_resumes_from_checkpoint(app):
+    """测试中断后从断点继续，Sumsub 不可用时不跳过未处理的验证"""
+    from app.services import reconciler, sumsub_service
+    from app.services.circuit_breaker import CircuitOpenError
+
+    _verifications(app, ['green', 'red', 'waiting'])
+
+    with patch.object(sumsub_service, 'get_verification_result', side_effect=_fake_review):
+        stats = reconciler.reconcile(app, min_age_minutes=60, batch_size=1, max_batches=1)
+    assert stats['completed'] is False
+    assert _statuses(app)['green'] == 'approved'
+
+    # Sumsub 熔断：本批不前进断点
+    with patch.object(sumsub_service, 'get_verification_result',
+                      side_effect=CircuitOpenError('applicant_review', 5.0)):
+        stats = reconciler.reconcile(app, min_age_minutes=60, batch_size=1)
+    assert stats['completed'] is False
+    assert 'stopped' in stats
+
+    with patch.object(sumsub_service, 'get_verification_result', side_effect=_fake_review) as fetch:
+        stats = reconciler.reconcile(app, min_age_minutes=60, batch_size=1)
+    assert [call.args[0] for call in fetch.call_args_list] == ['red', 'waiting']
+    assert stats['completed'] is True
+    assert _statuses(app) == {'green': 'approved', 'red': 'rejected', 'waiting': 'pending'}
+    print("✅ 断点续跑测试通过")
+
+
+def test_existing_verifications_table_gets_scan_index(tmp_path):
+    """测试已部署的 verifications 表启动时补建对账扫描用的索引"""
+    import sqlite3
+    from sqlalchemy import inspect
+
+    db_path = tmp_path / 'old.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        'CREATE TABLE verifications (id VARCHAR(36) PRIMARY KEY, order_id VARCHAR(36) NOT NULL UNIQUE, '
+        'sumsub_applicant_id VARCHAR(255), verification_link VARCHAR(512), verification_token VARCHAR(255), '
+        'status VARCHAR(50), created_at DATETIME, updated_at DATETIME, completed_at DATETIME)'
+    )
+    conn.commit()
+    conn.close()
+
+    with patch.dict(os.environ, {'DATABASE_URL': f'sqlite:///{db_path}'}):
+        from app import create_app, db
+        app = create_app()
+        with app.app_context():
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('verifications')}
+    assert 'ix_verifications_status_created' in indexes
+    print("✅ 对账索引升级测试通过")
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Sumsub 报告流式下载与断点续传测试
+"""
+
+import base64
+import hashlib
+import os
+import sys
+import uuid
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+from fake_sumsub import FakeSumsubConfig, FakeSumsubServer, synthetic_pdf
+
+REPORT_SIZE = 3 * 1024 * 1024
+
+
+def _report_files(storage, hidden=False):
+    """存储目录下（含分片子目录）的文件名"""
+    return sorted(p.name for p in storage.rglob('*') if p.is_file() and (hidden or not p.name.startswith('.')))
+
+
+@pytest.fixture
+def fake_server():
+    config = FakeSumsubConfig(app_token='tok', secret_key='secret', report_size=REPORT_SIZE)
+    server = FakeSumsubServer(config=config).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app():
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        app = create_app()
+        with app.app_context():
+            yield app
+
+
+@pytest.fixture
+def storage(tmp_path, fake_server, app):
+    from app.services import sumsub_report_downloader
+    from app.services.rate_limiter import AdaptiveRateLimiter
+    from app.services.sumsub_client import SumsubClient
+
+    client = SumsubClient(app_token='tok', secret_key='secret', api_url=fake_server.url,
+                          pool_size=2, limiter=AdaptiveRateLimiter())
+    with patch.object(sumsub_report_downloader.SumsubReportDownloader, 'REPORT_STORAGE_DIR', str(tmp_path)), \
+         patch.object(sumsub_report_downloader, 'get_client', return_value=client):
+        yield tmp_path
+
+
+def test_streams_report_to_disk(storage):
+    """测试分块下载写入磁盘，返回大小和 sha256，不留临时文件"""
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    result = SumsubReportDownloader.download_report_to_file('ver_1', 'app_1', lang='en', output_format='pdf')
+
+    expected = synthetic_pdf('app_1', REPORT_SIZE)
+    assert result['size'] == len(expected)
+    assert result['sha256'] == hashlib.sha256(expected).hexdigest()
+    assert Path(result['path']).read_bytes() == expected
+    assert _report_files(storage, hidden=True) == ['kyc_report_ver_1_app_1_en.pdf']
+
+    reports = SumsubReportDownloader.list_reports_for_verification('ver_1')
+    assert [(r['lang'], r['format'], r['size']) for r in reports] == [('en', 'pdf', len(expected))]
+    print("✅ 流式下载测试通过")
+
+
+def test_interrupted_download_publishes_nothing(storage):
+    """测试连接中断时不发布不完整的文件，已有文件保持不变"""
+    from app.services import sumsub_report_downloader
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    existing = SumsubReportDownloader.report_filepath('ver_2', 'app_2', 'en', 'pdf')
+    os.makedirs(os.path.dirname(existing))
+    Path(existing).write_bytes(b'%PDF- previous')
+
+    class _BrokenResponse:
+        status_code = 200
+        headers = {'Content-Length': str(REPORT_SIZE)}
+
+        def iter_content(self, chunk_size):
+            yield b'%PDF-' + b'x' * chunk_size
+            raise ConnectionError('connection reset')
+
+        def close(self):
+            pass
+
+    class _Client:
+        def request(self, *args, **kwargs):
+            assert kwargs['stream'] is True
+            return _BrokenResponse()
+
+    with patch.object(sumsub_report_downloader, 'get_client', return_value=_Client()):
+        assert SumsubReportDownloader.download_report_to_file('ver_2', 'app_2') is None
+
+    # 只保留隐藏的 .part 与进度文件，供下次续传
+    assert _report_files(storage) == ['kyc_report_ver_2_app_2_en.pdf']
+    assert Path(existing).read_bytes() == b'%PDF- previous'
+    print("✅ 中断不发布测试通过")
+
+
+def test_resumes_after_dropped_connection(storage, fake_server):
+    """测试连接中途断开后用 Range 续传，总传输量约等于报告大小"""
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    fake_server.config.report_drop_after = 1024 * 1024
+    results = []
+    for _ in range(5):
+        result = SumsubReportDownloader.download_report_to_file('ver_3', 'app_3', lang='en', output_format='pdf')
+        results.append(result)
+        if result:
+            break
+
+    expected = synthetic_pdf('app_3', REPORT_SIZE)
+    result = results[-1]
+    # 每次最多收到 1MB，之后从已写入的位置继续
+    drops = len(expected) // (1024 * 1024)
+    assert results[:-1] == [None] * drops
+    assert result['resumed_from'] == drops * 1024 * 1024
+    assert result['sha256'] == hashlib.sha256(expected).hexdigest()
+    assert Path(result['path']).read_bytes() == expected
+    assert _report_files(storage, hidden=True) == ['kyc_report_ver_3_app_3_en.pdf']
+
+    stats = fake_server.get_stats()
+    assert stats['ranges']['partial'] == drops
+    assert stats['report_bytes_sent'] == len(expected)
+    print("✅ 断点续传测试通过")
+
+
+def test_changed_report_restarts_download(storage, fake_server):
+    """测试服务端报告变化 (ETag 不匹配) 时从头下载，不拼接新旧内容"""
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    fake_server.config.report_drop_after = 1024 * 1024
+    assert SumsubReportDownloader.download_report_to_file('ver_4', 'app_4') is None
+
+    # 报告重新生成，大小变化 → 旧 ETag 失效，服务端返回完整的 200
+    fake_server.config.report_drop_after = 0
+    fake_server.config.report_size = REPORT_SIZE + 4096
+    result = SumsubReportDownloader.download_report_to_file('ver_4', 'app_4')
+
+    expected = synthetic_pdf('app_4', REPORT_SIZE + 4096)
+    assert result['resumed_from'] == 0
+    assert Path(result['path']).read_bytes() == expected
+    assert 'partial' not in fake_server.get_stats()['ranges']
+    print("✅ 报告变化重新下载测试通过")
+
+
+def test_digest_mismatch_discards_partial(storage):
+    """测试内容与 Digest 头不符时丢弃下载，不发布文件，下次从头开始"""
+    from app.services import sumsub_report_downloader
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    body = b'%PDF-' + b'y' * 4096
+
+    class _Response:
+        status_code = 200
+        headers = {
+            'Content-Length': str(len(body)),
+            'ETag': '"v1"',
+            'Digest': 'sha-256=' + base64.b64encode(hashlib.sha256(b'something else').digest()).decode(),
+        }
+
+        def iter_content(self, chunk_size):
+            yield body
+
+        def close(self):
+            pass
+
+    class _Client:
+        def request(self, *args, **kwargs):
+            assert 'Range' not in kwargs['headers']
+            return _Response()
+
+    with patch.object(sumsub_report_downloader, 'get_client', return_value=_Client()):
+        assert SumsubReportDownloader.download_report_to_file('ver_5', 'app_5') is None
+        assert _report_files(storage, hidden=True) == []
+        # 丢弃后再次下载不会带 Range
+        assert SumsubReportDownloader.download_report_to_file('ver_5', 'app_5') is None
+    print("✅ Digest 校验测试通过")
+
+
+def test_corrupted_partial_restarts_download(storage, fake_server):
+    """测试已下载部分与 sidecar 记录的 sha256 不符时不续传，从头下载"""
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    fake_server.config.report_drop_after = 1024 * 1024
+    assert SumsubReportDownloader.download_report_to_file('ver_6', 'app_6') is None
+
+    part_path, sidecar_path = SumsubReportDownloader._partial_paths(
+        SumsubReportDownloader.report_filepath('ver_6', 'app_6', 'en', 'pdf')
+    )
+    assert SumsubReportDownloader._load_sidecar(sidecar_path)['bytes'] == 1024 * 1024
+    with open(part_path, 'r+b') as f:
+        f.seek(100)
+        f.write(b'corrupt')
+
+    fake_server.config.report_drop_after = 0
+    result = SumsubReportDownloader.download_report_to_file('ver_6', 'app_6')
+
+    expected = synthetic_pdf('app_6', REPORT_SIZE)
+    assert result['resumed_from'] == 0
+    assert Path(result['path']).read_bytes() == expected
+    assert 'partial' not in fake_server.get_stats()['ranges']
+    print("✅ 损坏的部分下载重新下载测试通过")
+
+
+def test_resume_with_different_etag_restarts(storage):
+    """测试续传响应的 ETag 与记录不同（服务器忽略 If-Range）时不拼接，丢弃后从头下载"""
+    from app.services import sumsub_report_downloader
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    body = b'%PDF-' + b'z' * (256 * 1024)
+    half = len(body) // 2
+    requests_seen = []
+
+    class _Response:
+        def __init__(self, status_code, headers, data, broken=False):
+            self.status_code, self.headers, self.data, self.broken = status_code, headers, data, broken
+
+        def iter_content(self, chunk_size):
+            yield self.data
+            if self.broken:
+                raise ConnectionError('connection reset')
+
+        def close(self):
+            pass
+
+    responses = [
+        _Response(200, {'Content-Length': str(len(body)), 'ETag': '"v1"'}, body[:half], broken=True),
+        _Response(206, {'Content-Range': f'bytes {half}-{len(body) - 1}/{len(body)}', 'ETag': '"v2"'}, body[half:]),
+        _Response(200, {'Content-Length': str(len(body)), 'ETag': '"v2"'}, body),
+    ]
+
+    class _Client:
+        def request(self, *args, **kwargs):
+            requests_seen.append(dict(kwargs['headers']))
+            return responses.pop(0)
+
+    with patch.object(sumsub_report_downloader, 'get_client', return_value=_Client()):
+        assert SumsubReportDownloader.download_report_to_file('ver_7', 'app_7') is None
+        assert SumsubReportDownloader.download_report_to_file('ver_7', 'app_7') is None
+        assert _report_files(storage, hidden=True) == []
+        result = SumsubReportDownloader.download_report_to_file('ver_7', 'app_7')
+
+    assert requests_seen == [{}, {'Range': f'bytes={half}-', 'If-Range': '"v1"'}, {}]
+    assert result['resumed_from'] == 0
+    assert result['sha256'] == hashlib.sha256(body).hexdigest()
+    assert Path(result['path']).read_bytes() == body
+    print("✅ ETag 变化重新下载测试通过")
+
+
+def test_resume_without_validator(storage):
+    """测试服务器不提供 ETag / Last-Modified 时仍按 Content-Range 续传；总长度不一致时丢弃从头下载"""
+    from app.services import sumsub_report_downloader
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    body = b'%PDF-' + b'n' * (256 * 1024)
+    half = len(body) // 2
+    requests_seen = []
+
+    class _Response:
+        def __init__(self, status_code, headers, data, broken=False):
+            self.status_code, self.headers, self.data, self.broken = status_code, headers, data, broken
+
+        def iter_content(self, chunk_size):
+            yield self.data
+            if self.broken:
+                raise ConnectionError('connection reset')
+
+        def close(self):
+            pass
+
+    responses = [
+        _Response(200, {'Content-Length': str(len(body))}, body[:half], broken=True),
+        _Response(206, {'Content-Range': f'bytes {half}-{len(body) - 1}/{len(body)}'}, body[half:]),
+        # 第二份报告：续传时总长度变了
+        _Response(200, {'Content-Length': str(len(body))}, body[:half], broken=True),
+        _Response(206, {'Content-Range': f'bytes {half}-{len(body)}/{len(body) + 1}'}, body[half:] + b'!'),
+        _Response(200, {'Content-Length': str(len(body))}, body),
+    ]
+
+    class _Client:
+        def request(self, *args, **kwargs):
+            requests_seen.append(dict(kwargs['headers']))
+            return responses.pop(0)
+
+    with patch.object(sumsub_report_downloader, 'get_client', return_value=_Client()):
+        assert SumsubReportDownloader.download_report_to_file('ver_8', 'app_8') is None
+        resumed = SumsubReportDownloader.download_report_to_file('ver_8', 'app_8')
+
+        assert SumsubReportDownloader.download_report_to_file('ver_9', 'app_9') is None
+        assert SumsubReportDownloader.download_report_to_file('ver_9', 'app_9') is None
+        restarted = SumsubReportDownloader.download_report_to_file('ver_9', 'app_9')
+
+    # 没有校验值时不发送 If-Range
+    assert requests_seen == [{}, {'Range': f'bytes={half}-'}, {}, {'Range': f'bytes={half}-'}, {}]
+    assert resumed['resumed_from'] == half
+    assert resumed['sha256'] == hashlib.sha256(body).hexdigest()
+    assert Path(resumed['path']).read_bytes() == body
+    assert restarted['resumed_from'] == 0
+    assert Path(restarted['path']).read_bytes() == body
+    print("✅ 无校验值续传测试通过")
+
+
+def test_backfill_report_files(storage):
+    """测试回填命令把已有报告文件写入 report_files 清单，列表接口只查询清单"""
+    from app import db
+    from app.models import Order, ReportFile, Verification
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    order = Order(taobao_order_id='TB_BACKFILL_1', buyer_id='b1', buyer_name='张三',
+                  buyer_email='buyer@example.com', platform='taobao')
+    db.session.add(order)
+    db.session.flush()
+    verification = Verification(order_id=order.id, sumsub_applicant_id='app_6', verification_link='https://x',
+                                verification_token='tok_6', status='approved')
+    db.session.add(verification)
+    db.session.commit()
+
+    # 清单出现之前保存的（平铺布局）文件，以及无法识别的文件和未完成的下载
+    for lang, fmt in [('en', 'pdf'), ('zh', 'pdf'), ('en', 'json')]:
+        (storage / f'kyc_report_{verification.id}_app_6_{lang}.{fmt}').write_bytes(f'{lang}.{fmt}'.encode())
+    (storage / f'kyc_report_{uuid.uuid4()}_gone_en.pdf').write_bytes(b'orphan')
+    (storage / 'notes.txt').write_text('x')
+    (storage / '.kyc_report_partial.pdf.part').write_bytes(b'x')
+    assert SumsubReportDownloader.list_reports_for_verification(verification.id) == []
+
+    stats = SumsubReportDownloader.backfill_report_files(batch_size=2)
+    assert stats == {'scanned': 5, 'recorded': 3, 'unchanged': 0, 'skipped': 2}
+
+    reports = SumsubReportDownloader.list_reports_for_verification(verification.id)
+    assert [(r['lang'], r['format'], r['size']) for r in reports] == [('en', 'json', 7), ('en', 'pdf', 6), ('zh', 'pdf', 6)]
+    assert reports[1]['sha256'] == hashlib.sha256(b'en.pdf').hexdigest()
+    assert SumsubReportDownloader.get_report_url(verification.id, 'zh', 'pdf').endswith('_app_6_zh.pdf')
+
+    # 可重复运行；新保存的报告直接写入清单
+    assert SumsubReportDownloader.backfill_report_files()['unchanged'] == 3
+    SumsubReportDownloader.save_report(verification.id, 'app_6', b'new en pdf', format='pdf', lang='en')
+    assert ReportFile.query.filter_by(verification_id=verification.id, lang='en', format='pdf').one().size == 10
+    print("✅ 报告清单回填测试通过")
+
+
+def test_migrate_to_sharded_layout(storage, app):
+    """测试平铺布局的报告在线迁移到分片目录：清单路径随之更新，迁移前后都能下载"""
+    from app import db
+    from app.models import Order, Verification
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+    from app.utils import storage_layout
+
+    order = Order(taobao_order_id='TB_SHARD_1', buyer_id='b1', buyer_name='张三',
+                  buyer_email='buyer@example.com', platform='taobao')
+    db.session.add(order)
+    db.session.flush()
+    verification = Verification(order_id=order.id, sumsub_applicant_id='app_7', verification_link='https://x',
+                                verification_token='tok_7', status='approved')
+    db.session.add(verification)
+    db.session.commit()
+
+    filename = f'kyc_report_{verification.id}_app_7_en.pdf'
+    (storage / filename).write_bytes(b'%PDF- flat')
+    (storage / 'notes.txt').write_text('x')
+    SumsubReportDownloader.backfill_report_files()
+
+    client = app.test_client()
+    assert client.get(f'/report/sumsub/download/tok_7/{filename}').data == b'%PDF- flat'
+
+    stats = SumsubReportDownloader.migrate_storage_layout(batch_size=1)
+    assert stats == {'scanned': 2, 'moved': 1, 'skipped': 1, 'conflicts': 0}
+
+    sharded = storage_layout.sharded_path(str(storage), verification.id, filename)
+    assert not (storage / filename).exists()
+    assert Path(sharded).read_bytes() == b'%PDF- flat'
+    assert SumsubReportDownloader.list_reports_for_verification(verification.id)[0]['path'] == sharded
+    assert SumsubReportDownloader.resolve_report_path(verification.id, filename) == sharded
+    assert client.get(f'/report/sumsub/download/tok_7/{filename}').data == b'%PDF- flat'
+
+    # 重复运行无事可做；新文件直接写入分片目录
+    assert SumsubReportDownloader.migrate_storage_layout()['moved'] == 0
+    assert os.path.dirname(SumsubReportDownloader.report_filepath(verification.id, 'app_7', 'zh', 'pdf')) == os.path.dirname(sharded)
+    print("✅ 分片布局迁移测试通过")
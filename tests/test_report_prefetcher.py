@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Sumsub 多语言报告后台预取测试
+"""
+
+import os
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+@pytest.fixture
+def app(tmp_path):
+    # 下载线程会写报告清单，用文件数据库让每个线程有自己的连接
+    with patch.dict(os.environ, {'DATABASE_URL': f'sqlite:///{tmp_path}/kyc.db'}):
+        from app import create_app
+        from app.services import report_prefetcher
+        from app.services.sumsub_report_downloader import SumsubReportDownloader
+        app = create_app()
+        prefetcher = report_prefetcher.ReportPrefetcher(workers=3, attempts=2, backoff=0)
+        from app.services import job_queue, report_service
+        # 任务由 worker 处理（测试中手动运行 job_queue.work）
+        with patch.object(SumsubReportDownloader, 'REPORT_STORAGE_DIR', str(tmp_path)), \
+             patch.object(report_service, 'REPORTS_DIR', str(tmp_path / 'pdf')), \
+             patch.object(job_queue, 'JOB_WORKER_ENABLED', True), \
+             patch.object(report_prefetcher, 'SUMSUB_REPORT_LANGUAGES', ['en', 'zh']), \
+             patch.object(report_prefetcher, '_prefetcher', prefetcher):
+            yield app
+        prefetcher.shutdown()
+
+
+def _approved_verification(app):
+    from app import db
+    from app.models import Order
+    from app.services import sumsub_service
+
+    with app.app_context():
+        order = Order(taobao_order_id='TB_PREFETCH_1', buyer_id='b1', buyer_name='张三',
+                      buyer_email='buyer@example.com', platform='taobao')
+        db.session.add(order)
+        db.session.commit()
+        verification = sumsub_service.create_verification(order)
+        verification.status = 'approved'
+        db.session.commit()
+        return verification.id, verification.sumsub_applicant_id
+
+
+def test_approval_queues_prefetch(app):
+    """测试审核通过的 Webhook 自动排队下载 Sumsub 报告"""
+    from app import db
+    from app.models import Job, Order, ReportFetch
+    from app.services import sumsub_service, report_prefetcher
+
+    with app.app_context():
+        order = Order(taobao_order_id='TB_PREFETCH_2', buyer_id='b1', buyer_name='张三',
+                      buyer_email='buyer@example.com', platform='taobao')
+        db.session.add(order)
+        db.session.commit()
+        verification = sumsub_service.create_verification(order)
+        db.session.commit()
+        verification_id, applicant_id = verification.id, verification.sumsub_applicant_id
+
+    response = app.test_client().post('/webhook/sumsub/verification',
+                                      json={'applicantId': applicant_id, 'reviewStatus': 'approved'})
+    assert response.status_code == 200
+
+    with app.app_context():
+        job = Job.query.filter_by(kind=report_prefetcher.JOB_PREFETCH_SUMSUB_REPORTS).one()
+        assert job.payload == {'verification_id': verification_id}
+        rows = ReportFetch.query.filter_by(verification_id=verification_id).all()
+        assert sorted((row.lang, row.format, row.status) for row in rows) == [
+            ('en', 'json', 'queued'), ('en', 'pdf', 'queued'), ('zh', 'pdf', 'queued')
+        ]
+        assert report_prefetcher.fetch_status(verification_id)['status'] == 'downloading'
+    print("✅ 审核通过排队预取测试通过")
+
+
+def test_files_download_concurrently_with_retries(app):
+    """测试所有文件并发下载，失败的文件单独重试，任务重试时只下载缺失的文件"""
+    from app import db
+    from app.models import Job, ReportFetch
+    from app.services import job_queue, report_prefetcher
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    verification_id, applicant_id = _approved_verification(app)
+    with app.app_context():
+        report_prefetcher.schedule(verification_id)
+
+    barrier = threading.Barrier(3, timeout=5)
+    calls = []
+    zh_available = threading.Event()
+
+    def download(verification, applicant, report_type='applicantReport', lang='en', output_format='pdf'):
+        calls.append((lang, output_format))
+        if len(calls) <= 3:
+            barrier.wait()  # 三个文件同时在下载
+        if (lang, output_format) == ('en', 'pdf') and calls.count(('en', 'pdf')) == 1:
+            return None  # 第一次失败，重试成功
+        if lang == 'zh' and not zh_available.is_set():
+            return None
+        path = SumsubReportDownloader.save_report(verification, applicant, f'{lang}.{output_format}'.encode(),
+                                                  format=output_format, lang=lang)
+        return {'path': path}
+
+    with patch.object(SumsubReportDownloader, 'download_report_to_file', side_effect=download):
+        job_queue.work(app, worker_id='test', once=True)
+
+        with app.app_context():
+            status = report_prefetcher.fetch_status(verification_id)
+            assert status == {'status': 'failed', 'files': {'en_pdf': 'done', 'zh_pdf': 'failed', 'json': 'done'}}
+            en_pdf = ReportFetch.query.filter_by(verification_id=verification_id, lang='en', format='pdf').one()
+            assert en_pdf.attempts == 2
+            job = Job.query.filter_by(kind=report_prefetcher.JOB_PREFETCH_SUMSUB_REPORTS).one()
+            assert job.status == 'queued'
+            job.run_at = datetime.utcnow()
+            db.session.commit()
+
+        # 任务重试：只下载缺失的中文 PDF
+        zh_available.set()
+        calls.clear()
+        barrier = threading.Barrier(1)
+        job_queue.work(app, worker_id='test', once=True)
+        assert calls == [('zh', 'pdf')]
+
+    with app.app_context():
+        assert report_prefetcher.fetch_status(verification_id)['status'] == 'available'
+        reports = SumsubReportDownloader.list_reports_for_verification(verification_id)
+        assert sorted((r['lang'], r['format']) for r in reports) == [('en', 'json'), ('en', 'pdf'), ('zh', 'pdf')]
+        stats = report_prefetcher.get_stats()
+        assert stats['files_downloaded'] == 3
+        assert stats['files_skipped'] == 2
+        assert stats['retries'] == 2
+    print("✅ 并发下载与重试测试通过")
+
+
+def test_read_through_shares_one_download(app):
+    """测试报告不在磁盘上时按需下载：并发请求共享一次下载，超时返回 202 和轮询地址"""
+    from app import db
+    from app.models import Verification
+    from app.services import report_prefetcher
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    verification_id, _ = _approved_verification(app)
+    with app.app_context():
+        token = db.session.get(Verification, verification_id).verification_token
+
+    release = threading.Event()
+    calls = []
+
+    def download(verification, applicant, report_type='applicantReport', lang='en', output_format='pdf'):
+        calls.append((lang, output_format))
+        release.wait(5)
+        path = SumsubReportDownloader.save_report(verification, applicant, f'{lang}.{output_format}'.encode(),
+                                                  format=output_format, lang=lang)
+        return {'path': path}
+
+    client = app.test_client()
+    with patch.object(SumsubReportDownloader, 'download_report_to_file', side_effect=download), \
+         patch.object(report_prefetcher, 'SUMSUB_REPORT_READ_THROUGH_WAIT', 0.2):
+        responses = []
+        threads = [
+            threading.Thread(target=lambda: responses.append(client.get(f'/report/sumsub/list/{token}')))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert [r.status_code for r in responses] == [202] * 4
+        body = responses[0].get_json()
+        assert body['poll_url'] == f'/report/sumsub/list/{token}'
+        assert body['pending_files'] == ['en_pdf', 'json', 'zh_pdf']
+        assert body['download_status']['status'] == 'downloading'
+        assert responses[0].headers['Retry-After'] == str(report_prefetcher.READ_THROUGH_RETRY_AFTER)
+
+        # 预览只需要该语言的 PDF 和 JSON，加入正在进行的下载
+        preview = client.get(f'/report/sumsub/preview/{token}/zh')
+        assert preview.status_code == 202
+        assert preview.get_json()['pending_files'] == ['json', 'zh_pdf']
+
+        release.set()
+        response = client.get(f'/report/sumsub/list/{token}')
+        assert response.status_code == 200
+        assert response.get_json()['report_count'] == 3
+
+    # 每个文件只下载一次
+    assert sorted(calls) == [('en', 'json'), ('en', 'pdf'), ('zh', 'pdf')]
+    stats = report_prefetcher.get_stats()
+    assert stats['read_through'] == 3
+    assert stats['read_through_shared'] >= 3 * 3 + 2
+    print("✅ 按需下载共享测试通过")
+
+
+def test_read_through_honors_failed_cooldown(app):
+    """测试按需下载失败后在冷却期内不再重复下载，冷却期过后才重新下载"""
+    from datetime import timedelta
+    from app import db
+    from app.models import ReportFetch
+    from app.services import report_prefetcher
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    verification_id, applicant_id = _approved_verification(app)
+    calls = []
+
+    def download(verification, applicant, report_type='applicantReport', lang='en', output_format='pdf'):
+        calls.append((lang, output_format))
+        return None
+
+    prefetcher = report_prefetcher.get_prefetcher()
+    with patch.object(SumsubReportDownloader, 'download_report_to_file', side_effect=download), \
+         app.test_request_context():
+        files = [('en', 'pdf')]
+        assert prefetcher.read_through(verification_id, applicant_id, files, 5) == {'pending': [], 'failed': ['en_pdf']}
+        assert len(calls) == 2  # 两次尝试
+
+        # 冷却期内直接返回失败，不再请求 Sumsub
+        assert prefetcher.read_through(verification_id, applicant_id, files, 5) == {'pending': [], 'failed': ['en_pdf']}
+        assert len(calls) == 2
+
+        row = ReportFetch.query.filter_by(verification_id=verification_id, lang='en', format='pdf').one()
+        assert (row.status, row.attempts) == ('failed', 2)
+        assert prefetcher.cooldown(row) == report_prefetcher.SUMSUB_REPORT_FAILED_COOLDOWN
+        row.updated_at = datetime.utcnow() - timedelta(seconds=prefetcher.cooldown(row) + 1)
+        db.session.commit()
+
+        prefetcher.read_through(verification_id, applicant_id, files, 5)
+        assert len(calls) == 4
+        # 第二轮失败后冷却时间翻倍
+        row = ReportFetch.query.filter_by(verification_id=verification_id, lang='en', format='pdf').one()
+        assert prefetcher.cooldown(row) == 2 * report_prefetcher.SUMSUB_REPORT_FAILED_COOLDOWN
+    assert report_prefetcher.get_stats()['read_through_cooldowns'] == 1
+    print("✅ 按需下载失败冷却测试通过")
+
+
+def test_read_through_locked_by_other_process_is_pending(app):
+    """测试其他进程持有下载锁时按需下载返回进行中，不记为失败"""
+    from app.models import ReportFetch
+    from app.services import report_prefetcher
+    from app.services.sumsub_report_downloader import SumsubReportDownloader, ReportDownloadInProgress
+
+    verification_id, applicant_id = _approved_verification(app)
+    with patch.object(SumsubReportDownloader, 'download_report_to_file', side_effect=ReportDownloadInProgress('x')), \
+         app.test_request_context():
+        result = report_prefetcher.get_prefetcher().read_through(verification_id, applicant_id, [('en', 'pdf')], 5)
+        assert result == {'pending': ['en_pdf'], 'failed': []}
+        assert ReportFetch.query.filter_by(verification_id=verification_id).count() == 0
+    assert report_prefetcher.get_stats()['read_through_locked'] == 1
+    print("✅ 下载锁被占用返回进行中测试通过")
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+PDF 报告渲染进程池测试
+"""
+
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+@pytest.fixture
+def app(tmp_path):
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        from app.services import job_queue, report_prefetcher, report_service
+        app = create_app()
+        # 只测试本系统生成的 PDF，不下载 Sumsub 报告；任务由 worker 处理（测试中手动运行）
+        with patch.object(report_prefetcher, 'SUMSUB_REPORT_PREFETCH', False), \
+             patch.object(report_service, 'REPORTS_DIR', str(tmp_path)), \
+             patch.object(job_queue, 'JOB_WORKER_ENABLED', True):
+            yield app
+
+
+def _snapshot(order_id='order-render-1'):
+    return {
+        'id': order_id,
+        'taobao_order_id': 'TB_RENDER_1',
+        'platform': 'taobao',
+        'buyer_name': '张三',
+        'buyer_email': 'buyer@example.com',
+        'order_amount': 99.0,
+        'order_date': '2025-01-01 10:00:00',
+        'verification_status': 'approved',
+    }
+
+
+def test_render_in_process_pool(tmp_path):
+    """测试在进程池中渲染 PDF"""
+    from app.services.report_renderer import ReportRenderer
+
+    # 渲染进程以 spawn 启动，从环境变量读取报告目录
+    with patch.dict(os.environ, {'REPORTS_DIR': str(tmp_path)}):
+        renderer = ReportRenderer(workers=1, mode='process')
+        try:
+            pdf_path = renderer.render(_snapshot(), {'id': 'app_1', 'reviewStatus': 'completed'})
+        finally:
+            renderer.shutdown()
+
+    assert pdf_path.startswith(str(tmp_path))
+    with open(pdf_path, 'rb') as f:
+        assert f.read(5) == b'%PDF-'
+    stats = renderer.get_stats()
+    assert stats['rendered'] == 1
+    assert stats['in_flight'] == 0
+    print("✅ 进程池渲染测试通过")
+
+
+def _slow_render(order_snapshot, verification_result):
+    import time
+    time.sleep(30)
+
+
+def test_render_timeout_raises_deadline_exceeded():
+    """测试渲染超时抛出可重试的 DeadlineExceeded，并终止仍在运行的渲染进程"""
+    from types import SimpleNamespace
+
+    from app.services import report_renderer
+    from app.utils.deadline import DeadlineExceeded
+
+    renderer = report_renderer.ReportRenderer(workers=1, mode='process')
+    processes = []
+    reset = renderer._reset_executor
+
+    def _reset(**kwargs):
+        processes.extend(renderer._executor._processes.values())
+        reset(**kwargs)
+
+    try:
+        with patch.object(report_renderer, 'report_service', SimpleNamespace(render_report_pdf=_slow_render)), \
+             patch.object(renderer, '_reset_executor', _reset):
+            with pytest.raises(DeadlineExceeded):
+                renderer.render(_snapshot(), {}, timeout=1)
+        # 正在运行的渲染无法取消，进程池被重建
+        assert len(processes) == 1
+        for process in processes:
+            process.join(timeout=5)
+            assert not process.is_alive()
+        stats = renderer.get_stats()
+        assert (stats['timeouts'], stats['failed'], stats['in_flight']) == (1, 1, 0)
+    finally:
+        renderer.shutdown()
+    print("✅ 渲染超时测试通过")
+
+
+def test_render_over_request_budget_keeps_pool():
+    """测试只是调用方预算不足时不终止进程池（不影响其他渲染），渲染超过自身时限后才终止"""
+    import time
+    from types import SimpleNamespace
+
+    from app.services import report_renderer
+    from app.utils import deadline
+    from app.utils.deadline import DeadlineExceeded
+
+    renderer = report_renderer.ReportRenderer(workers=2, mode='process')
+    try:
+        with patch.object(report_renderer, 'report_service', SimpleNamespace(render_report_pdf=_slow_render)), \
+             patch.object(report_renderer, 'REPORT_RENDER_TIMEOUT', 3):
+            token = deadline.start(1)
+            try:
+                with pytest.raises(DeadlineExceeded):
+                    renderer.render(_snapshot(), {})
+            finally:
+                deadline.clear(token)
+            # 渲染仍在运行，进程池没有被重建
+            executor = renderer._executor
+            processes = list(executor._processes.values())
+            assert processes and all(process.is_alive() for process in processes)
+            assert renderer.get_stats()['pool_restarts'] == 0
+
+            # 到达 REPORT_RENDER_TIMEOUT 后卡住的渲染连同进程池一起终止
+            for process in processes:
+                process.join(timeout=10)
+                assert not process.is_alive()
+        stats = renderer.get_stats()
+        assert (stats['timeouts'], stats['abandoned'], stats['pool_restarts']) == (1, 1, 1)
+        assert renderer._executor is None
+    finally:
+        renderer._reset_executor(terminate=True)
+    print("✅ 预算不足时保留进程池测试通过")
+
+
+def test_webhook_marks_report_generating_until_rendered(app):
+    """测试 Sumsub Webhook 只记录报告待生成，页面显示生成中，worker 完成后可用"""
+    from app import db
+    from app.models import Order, Report
+    from app.services import sumsub_service, job_queue, report_renderer, report_service
+
+    with app.app_context():
+        order = Order(taobao_order_id='TB_REPORT_1', buyer_id='b1', buyer_name='张三',
+                      buyer_email='buyer@example.com', platform='taobao')
+        db.session.add(order)
+        db.session.commit()
+        verification = sumsub_service.create_verification(order)
+        db.session.commit()
+        order_id, applicant_id = order.id, verification.sumsub_applicant_id
+
+    client = app.test_client()
+    with patch.object(sumsub_service, 'get_verification_result') as fetch:
+        response = client.post('/webhook/sumsub/verification',
+                               json={'applicantId': applicant_id, 'reviewStatus': 'approved'})
+        assert response.status_code == 200
+        fetch.assert_not_called()
+
+    response = client.get(f'/report/{order_id}')
+    assert response.status_code == 200
+    assert 'Refresh' in response.headers
+    assert '报告生成中' in response.get_data(as_text=True)
+    assert client.get(f'/report/{order_id}/download').status_code == 202
+
+    # 报告详情直接取自 Webhook 内容，不再向 Sumsub 查询审核结果
+    renderer = report_renderer.ReportRenderer(mode='inline')
+    with patch.object(sumsub_service, 'get_verification_result') as fetch, \
+         patch.object(report_renderer, '_renderer', renderer):
+        job_queue.work(app, worker_id='test', once=True)
+        fetch.assert_not_called()
+
+    with app.app_context():
+        report = Report.query.filter_by(order_id=order_id).one()
+        assert report.status == 'ready'
+        assert report.verification_result == 'approved'
+        assert report.verification_details == {
+            'id': applicant_id, 'applicantId': applicant_id, 'reviewStatus': 'approved'
+        }
+        assert report.pdf_path.startswith(report_service.REPORTS_DIR)
+    print("✅ 报告生成状态测试通过")
+
+
+def test_report_fetches_review_when_details_missing(app):
+    """测试没有 Webhook 审核详情时才向 Sumsub 查询"""
+    from app import db
+    from app.models import Order, Report
+    from app.services import sumsub_service, job_queue, report_renderer
+
+    with app.app_context():
+        order = Order(taobao_order_id='TB_REPORT_2', buyer_id='b1', buyer_name='张三',
+                      buyer_email='buyer@example.com', platform='taobao')
+        db.session.add(order)
+        db.session.commit()
+        verification = sumsub_service.create_verification(order)
+        verification.status = 'approved'
+        db.session.commit()
+        order_id, applicant_id = order.id, verification.sumsub_applicant_id
+        sumsub_service.request_report(order_id, 'approved')
+
+    review = {'id': applicant_id, 'reviewStatus': 'completed', 'reviewResult': {'reviewAnswer': 'GREEN'}}
+    renderer = report_renderer.ReportRenderer(mode='inline')
+    with patch.object(sumsub_service, 'get_verification_result', return_value=review) as fetch, \
+         patch.object(report_renderer, '_renderer', renderer):
+        job_queue.work(app, worker_id='test', once=True)
+        fetch.assert_called_once_with(applicant_id)
+
+    with app.app_context():
+        report = Report.query.filter_by(order_id=order_id).one()
+        assert report.status == 'ready'
+        assert report.verification_details == review
+        assert os.path.isfile(report.pdf_path)
+    print("✅ 缺少详情时查询测试通过")
+
+
+def test_webhook_returns_before_report_jobs_run(tmp_path):
+    """测试没有 worker 进程（默认同步模式）时 Webhook 先返回，报告渲染和 Sumsub 报告下载在后台线程中进行"""
+    import threading
+    import time
+
+    # 后台线程会写数据库，用文件数据库让每个线程有自己的连接
+    with patch.dict(os.environ, {'DATABASE_URL': f'sqlite:///{tmp_path}/kyc.db'}):
+        from app import create_app, db
+        from app.models import Job, Order, Report
+        from app.services import sumsub_service, job_queue, report_renderer, report_prefetcher, report_service
+        app = create_app()
+
+    with app.app_context():
+        order = Order(taobao_order_id='TB_REPORT_3', buyer_id='b1', buyer_name='张三',
+                      buyer_email='buyer@example.com', platform='taobao')
+        db.session.add(order)
+        db.session.commit()
+        verification = sumsub_service.create_verification(order)
+        db.session.commit()
+        order_id, applicant_id = order.id, verification.sumsub_applicant_id
+
+    responded = threading.Event()
+    started = []
+    inline = report_renderer.ReportRenderer(mode='inline')
+
+    class GatedRenderer:
+        def render(self, *args, **kwargs):
+            started.append(('render', threading.current_thread()))
+            responded.wait(10)
+            return inline.render(*args, **kwargs)
+
+    class GatedPrefetcher:
+        def prefetch(self, verification_id, applicant_id):
+            started.append(('download', threading.current_thread()))
+            responded.wait(10)
+            return report_prefetcher.report_files()
+
+    with patch.object(job_queue, 'JOB_WORKER_ENABLED', False), \
+         patch.object(report_service, 'REPORTS_DIR', str(tmp_path / 'pdf')), \
+         patch.object(report_prefetcher, 'SUMSUB_REPORT_PREFETCH', True), \
+         patch.object(report_prefetcher, '_prefetcher', GatedPrefetcher()), \
+         patch.object(report_renderer, '_renderer', GatedRenderer()):
+        response = app.test_client().post('/webhook/sumsub/verification',
+                                          json={'applicantId': applicant_id, 'reviewStatus': 'approved'})
+        assert response.status_code == 200
+        # 返回时报告还在生成中（渲染被挡住，不在请求线程中等待）
+        with app.app_context():
+            assert Report.query.filter_by(order_id=order_id).one().status == 'generating'
+        responded.set()
+
+        with app.app_context():
+            for _ in range(100):
+                statuses = [job.status for job in Job.query.all()]
+                if statuses == [job_queue.STATUS_DONE] * 2:
+                    break
+                db.session.remove()
+                time.sleep(0.1)
+            report = Report.query.filter_by(order_id=order_id).one()
+            assert statuses == [job_queue.STATUS_DONE] * 2
+            assert report.status == 'ready'
+            assert os.path.isfile(report.pdf_path)
+
+    assert sorted(what for what, _ in started) == ['download', 'render']
+    assert all(thread is not threading.current_thread() for _, thread in started)
+    print("✅ 无 worker 时后台生成报告测试通过")
+
+
+def test_existing_reports_table_gets_status_column(tmp_path):
+    """测试升级前创建的 reports 表（没有 status 列）启动时自动补列，旧报告视为已生成"""
+    import sqlite3
+
+    db_path = tmp_path / 'old.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        'CREATE TABLE reports (id VARCHAR(36) PRIMARY KEY, order_id VARCHAR(36) NOT NULL UNIQUE, '
+        'verification_result VARCHAR(50), verification_details JSON, pdf_url VARCHAR(512), '
+        'pdf_path VARCHAR(512), created_at DATETIME, updated_at DATETIME)'
+    )
+    conn.execute("INSERT INTO reports (id, order_id, verification_result) VALUES ('r1', 'o1', 'approved')")
+    conn.commit()
+    conn.close()
+
+    with patch.dict(os.environ, {'DATABASE_URL': f'sqlite:///{db_path}'}):
+        from app import create_app
+        from app.models import Report
+        from app.utils import schema
+
+        app = create_app()
+        with app.app_context():
+            assert Report.query.filter_by(order_id='o1').one().status == 'ready'
+            # 再次启动不会重复添加
+            from app import db
+            assert schema.upgrade(db) == []
+    print("✅ reports.status 升级测试通过")
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+报告存储后端测试（本地磁盘 / S3 兼容存储）
+"""
+
+import hashlib
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+import requests
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+from fake_s3 import FakeS3Config, FakeS3Server
+
+PART_SIZE = 1024 * 1024
+
+
+@pytest.fixture
+def fake_s3():
+    server = FakeS3Server(config=FakeS3Config(min_part_size=PART_SIZE)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def s3(fake_s3):
+    from app.services.report_storage import S3Storage
+
+    return S3Storage(endpoint=fake_s3.url, bucket='kyc-reports', access_key='minio', secret_key='minio123',
+                     prefix='test/', part_size=PART_SIZE)
+
+
+@pytest.fixture
+def app():
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        app = create_app()
+        with app.app_context():
+            yield app
+
+
+def _chunks(total, chunk_size=64 * 1024):
+    """确定性的测试数据，按块产生"""
+    sent = 0
+    while sent < total:
+        size = min(chunk_size, total - sent)
+        yield bytes((sent + i) % 251 for i in range(size))
+        sent += size
+
+
+def test_multipart_upload_streams_in_parts(s3, fake_s3):
+    """测试大文件按分片上传：请求体不超过分片大小，读回内容与 sha256 一致"""
+    total = 3 * PART_SIZE + 12345
+    expected = b''.join(_chunks(total))
+
+    saved = s3.save('sumsub', '/unused', 'ver_1', 'kyc_report_ver_1_app_1_en.pdf', _chunks(total),
+                    content_type='application/pdf')
+
+    assert saved['ref'].startswith('s3://kyc-reports/test/sumsub/')
+    assert saved['ref'].endswith('/kyc_report_ver_1_app_1_en.pdf')
+    assert saved['size'] == total
+    assert saved['sha256'] == hashlib.sha256(expected).hexdigest()
+    assert b''.join(s3.open(saved['ref'])) == expected
+    assert s3.exists(saved['ref'])
+
+    stats = fake_s3.get_stats()
+    assert stats['parts'] == 4
+    assert stats['max_request_body'] <= PART_SIZE
+    assert stats['auth_failures'] == {}
+    assert stats['open_uploads'] == 0
+    assert s3.get_stats()['multipart_uploads'] == 1
+
+    # 小文件一次 PUT
+    small = s3.save('sumsub', '/unused', 'ver_1', 'small.json', [b'{}'], content_type='application/json')
+    assert b''.join(s3.open(small['ref'])) == b'{}'
+    assert fake_s3.get_stats()['parts'] == 4
+    print("✅ 分片上传测试通过")
+
+
+def test_failed_upload_is_aborted(s3, fake_s3):
+    """测试上传中途出错时取消分片上传，不留下对象或未完成的上传"""
+    from app.services.report_storage import S3Storage, StorageError
+
+    def broken():
+        yield from _chunks(2 * PART_SIZE)
+        raise ConnectionError('connection reset')
+
+    with pytest.raises(ConnectionError):
+        s3.save('sumsub', '/unused', 'ver_2', 'kyc_report_ver_2_app_2_en.pdf', broken())
+
+    stats = fake_s3.get_stats()
+    assert stats['objects'] == 0
+    assert stats['open_uploads'] == 0
+    assert s3.get_stats()['aborted_uploads'] == 1
+
+    # 错误的密钥被拒绝
+    wrong = S3Storage(endpoint=fake_s3.url, bucket='kyc-reports', access_key='minio', secret_key='wrong')
+    with pytest.raises(StorageError):
+        wrong.save('sumsub', '/unused', 'ver_2', 'x.pdf', [b'x'])
+    assert fake_s3.get_stats()['auth_failures'] == {'SignatureDoesNotMatch': 1}
+    print("✅ 上传失败取消测试通过")
+
+
+def test_presigned_download_url(s3):
+    """测试预签名 URL 无需凭据即可下载，被篡改的 URL 返回 403"""
+    saved = s3.save('reports', '/unused', 'order_1', 'kyc_report_order_1.pdf', [b'%PDF- signed'])
+
+    url = s3.presign(saved['ref'], params={'response-content-disposition': 'attachment; filename="r.pdf"'})
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.content == b'%PDF- signed'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="r.pdf"'
+
+    assert requests.get(url.replace('order_1', 'order_2')).status_code == 403
+    print("✅ 预签名下载测试通过")
+
+
+def test_sumsub_report_in_s3(s3, app, tmp_path):
+    """测试 S3 后端：报告上传到存储桶，清单记录 s3:// 引用，下载接口重定向到预签名 URL"""
+    from app import db
+    from app.models import Order, ReportFile, Verification
+    from app.services import report_storage
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    order = Order(taobao_order_id='TB_S3_1', buyer_id='b1', buyer_name='张三',
+                  buyer_email='buyer@example.com', platform='taobao')
+    db.session.add(order)
+    db.session.flush()
+    verification = Verification(order_id=order.id, sumsub_applicant_id='app_3', verification_link='https://x',
+                                verification_token='tok_s3', status='approved')
+    db.session.add(verification)
+    db.session.commit()
+
+    with patch.object(report_storage, 'REPORT_STORAGE_BACKEND', 's3'), \
+         patch.dict(report_storage._backends, {'s3': s3}), \
+         patch.object(SumsubReportDownloader, 'REPORT_STORAGE_DIR', str(tmp_path)):
+        ref = SumsubReportDownloader.save_report(verification.id, 'app_3', b'%PDF- in the bucket')
+        assert ref.startswith('s3://')
+        assert list(tmp_path.rglob('*')) == []
+
+        row = ReportFile.query.filter_by(verification_id=verification.id).one()
+        assert row.path == ref
+
+        filename = f'kyc_report_{verification.id}_app_3_en.pdf'
+        response = app.test_client().get(f'/report/sumsub/download/tok_s3/{filename}')
+        assert response.status_code == 302
+        download = requests.get(response.headers['Location'])
+        assert download.content == b'%PDF- in the bucket'
+        assert download.headers['Content-Type'] == 'application/pdf'
+        assert filename in download.headers['Content-Disposition']
+    print("✅ S3 报告下载测试通过")
+
+
+def test_local_download_uses_accel_redirect(app, tmp_path):
+    """测试本地后端配置了 nginx internal location 时只返回 X-Accel-Redirect 头"""
+    from app.services.report_storage import LocalStorage
+
+    storage = LocalStorage(accel_prefix='/protected-reports')
+    saved = storage.save('reports', str(tmp_path), 'order_2', 'kyc_report_order_2.pdf', [b'%PDF- local'])
+    assert Path(saved['ref']).read_bytes() == b'%PDF- local'
+
+    with app.test_request_context():
+        response = storage.download_response(saved['ref'], 'kyc_report_order_2.pdf', 'application/pdf')
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-reports' + os.path.abspath(saved['ref'])
+    assert response.get_data() == b''
+    print("✅ X-Accel-Redirect 测试通过")
+
+
+def test_read_through_finds_report_saved_to_s3(s3, app, tmp_path):
+    """测试 S3 后端按需下载：重试前通过清单和存储桶发现其他进程已上传的报告，不再重复下载"""
+    from app import db
+    from app.models import Order, Verification
+    from app.services import report_prefetcher, report_storage
+    from app.services.sumsub_report_downloader import SumsubReportDownloader
+
+    order = Order(taobao_order_id='TB_S3_2', buyer_id='b1', buyer_name='张三',
+                  buyer_email='buyer@example.com', platform='taobao')
+    db.session.add(order)
+    db.session.flush()
+    verification = Verification(order_id=order.id, sumsub_applicant_id='app_4', verification_link='https://x',
+                                verification_token='tok_s3_2', status='approved')
+    db.session.add(verification)
+    db.session.commit()
+    verification_id = verification.id
+    calls = []
+
+    def download(verification, applicant, report_type='applicantReport', lang='en', output_format='pdf'):
+        calls.append((lang, output_format))
+        # 本进程下载失败期间，另一个进程完成下载并上传到存储桶
+        SumsubReportDownloader.save_report(verification, applicant, b'%PDF- uploaded elsewhere',
+                                           format=output_format, lang=lang)
+        return None
+
+    prefetcher = report_prefetcher.ReportPrefetcher(workers=1, attempts=3, backoff=0)
+    try:
+        with patch.object(report_storage, 'REPORT_STORAGE_BACKEND', 's3'), \
+             patch.dict(report_storage._backends, {'s3': s3}), \
+             patch.object(SumsubReportDownloader, 'REPORT_STORAGE_DIR', str(tmp_path)), \
+             patch.object(SumsubReportDownloader, 'download_report_to_file', side_effect=download):
+            result = prefetcher.read_through(verification_id, 'app_4', [('en', 'pdf')], 5)
+            assert result == {'pending': [], 'failed': []}
+            assert calls == [('en', 'pdf')]
+
+            reports = SumsubReportDownloader.list_reports_for_verification(verification_id)
+            assert [r['path'].startswith('s3://') for r in reports] == [True]
+            assert b''.join(s3.open(reports[0]['path'])) == b'%PDF- uploaded elsewhere'
+            # 已在存储桶中的文件不再按需下载
+            assert prefetcher.read_through(verification_id, 'app_4', [('en', 'pdf')], 5) == {'pending': [], 'failed': []}
+            assert len(calls) == 1
+    finally:
+        prefetcher.shutdown()
+    assert list(tmp_path.rglob('*.pdf')) == []
+    print("✅ S3 按需下载测试通过")
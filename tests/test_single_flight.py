@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Single-flight 请求合并测试
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+def test_concurrent_callers_share_one_call():
+    """测试同一 key 的并发调用只执行一次"""
+    from app.services.single_flight import SingleFlight
+
+    group = SingleFlight('test')
+    calls = []
+    release = threading.Event()
+
+    def slow_fetch():
+        calls.append(1)
+        release.wait(2)
+        return 'token'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(group.do('order_1', slow_fetch)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert results == ['token'] * 5
+    assert len(calls) == 1
+    stats = group.get_stats()
+    assert stats['executions'] == 1
+    assert stats['saved_calls'] == 4
+    assert stats['in_flight'] == 0
+    print("✅ 并发合并测试通过")
+
+
+def test_errors_are_shared_and_not_cached():
+    """测试错误会传递给等待者，且下一次调用重新执行"""
+    from app.services.single_flight import SingleFlight
+
+    group = SingleFlight('test')
+
+    def failing():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        group.do('k', failing)
+    assert group.do('k', lambda: 'ok') == 'ok'
+    print("✅ 错误传递测试通过")
+
+
+def test_follower_timeout():
+    """测试等待者超时"""
+    from app.services.single_flight import SingleFlight, SingleFlightTimeout
+
+    group = SingleFlight('test')
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: group.do('k', lambda: release.wait(2)))
+    leader.start()
+    time.sleep(0.05)
+
+    with pytest.raises(SingleFlightTimeout):
+        group.do('k', lambda: None, timeout=0.05)
+
+    release.set()
+    leader.join()
+    assert group.get_stats()['timeouts'] == 1
+    print("✅ 等待超时测试通过")
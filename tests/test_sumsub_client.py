@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+共享 Sumsub 客户端测试
+验证签名、连接复用和连接池统计
+"""
+
+import hmac
+import hashlib
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    seen = []
+
+    def do_GET(self):
+        _EchoHandler.seen.append((self.path, dict(self.headers), self.client_address))
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    _EchoHandler.seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _EchoHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_signature_includes_query_string(local_server):
+    """测试签名覆盖 path + 查询参数"""
+    from app.services.sumsub_client import SumsubClient
+
+    client = SumsubClient(app_token='tok', secret_key='secret', api_url=local_server, pool_size=2)
+    response = client.request('GET', '/resources/applicants/a1/summary/report', params={'lang': 'en'})
+    assert response.status_code == 200
+
+    path, headers, _ = _EchoHandler.seen[0]
+    assert path == '/resources/applicants/a1/summary/report?lang=en'
+    expected = hmac.new(
+        b'secret',
+        f"{headers['X-App-Access-Ts']}GET{path}".encode(),
+        hashlib.sha256
+    ).hexdigest()
+    assert headers['X-App-Access-Sig'] == expected
+    assert headers['X-App-Token'] == 'tok'
+    client.close()
+    print("✅ 签名测试通过")
+
+
+def test_connections_are_reused(local_server):
+    """测试多次请求复用同一个 keep-alive 连接"""
+    from app.services.sumsub_client import SumsubClient
+
+    client = SumsubClient(app_token='tok', secret_key='secret', api_url=local_server, pool_size=2)
+    for _ in range(5):
+        client.request('GET', '/resources/ping').close()
+
+    stats = client.get_stats()
+    assert stats['requests'] == 5
+    assert stats['in_flight'] == 0
+    assert stats['pools'][0]['connections_opened'] == 1
+    assert stats['pools'][0]['requests_sent'] == 5
+    assert len({addr for _, _, addr in _EchoHandler.seen}) == 1
+    client.close()
+    print("✅ 连接复用测试通过")
+
+
+def test_shared_client_singleton():
+    """测试进程级共享客户端"""
+    from app.services.sumsub_client import get_client
+
+    assert get_client() is get_client()
+    print("✅ 共享客户端测试通过")
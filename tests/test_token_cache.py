@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+WebSDK 令牌缓存测试
+"""
+
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+def test_cache_hit_and_expiry_margin():
+    """测试缓存命中以及提前过期"""
+    from app.services.token_cache import TokenCache
+
+    cache = TokenCache(expiry_margin=60, min_remaining=600)
+    assert cache.get('order_1', 'basic') is None
+
+    lifetime = cache.set('order_1', 'basic', 'tok-1', ttl=1800)
+    assert lifetime == 1740
+
+    token, remaining = cache.get('order_1', 'basic')
+    assert token == 'tok-1'
+    assert 600 <= remaining <= 1740
+
+    # 不同 level 不共享
+    assert cache.get('order_1', 'other') is None
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    print("✅ 令牌缓存命中测试通过")
+
+
+def test_cache_skips_tokens_close_to_expiry():
+    """测试剩余有效期不足时不再返回缓存令牌"""
+    from app.services.token_cache import TokenCache
+
+    cache = TokenCache(expiry_margin=0, min_remaining=600)
+    cache.backend.set(('order_2', 'basic'), 'tok-old', time.time() + 300)
+    assert cache.get('order_2', 'basic') is None
+    print("✅ 令牌临近过期测试通过")
+
+
+def test_memory_backend_lru_eviction():
+    """测试 LRU 淘汰"""
+    from app.services.token_cache import MemoryBackend
+
+    backend = MemoryBackend(max_size=2)
+    backend.set('a', 1, time.time() + 100)
+    backend.set('b', 2, time.time() + 100)
+    backend.get('a')
+    backend.set('c', 3, time.time() + 100)
+
+    assert backend.get('b') is None
+    assert backend.get('a') is not None
+    assert len(backend) == 2
+    print("✅ LRU 淘汰测试通过")
+
+
+def test_get_access_token_uses_cache():
+    """测试重复获取令牌只调用一次 Sumsub"""
+    from app.services import sumsub_service, token_cache
+
+    with patch.object(token_cache, '_cache', token_cache.TokenCache()), \
+         patch.object(sumsub_service, '_generate_access_token', return_value='tok-x') as generate:
+        first = sumsub_service.get_access_token('order_9', 'order_9', 'a@example.com')
+        second = sumsub_service.get_access_token('order_9', 'order_9', 'a@example.com')
+
+    assert first[0] == second[0] == 'tok-x'
+    assert generate.call_count == 1
+    print("✅ 令牌缓存集成测试通过")
+
+
+def test_prewarmer_fills_cache_and_caps_pending():
+    """测试令牌预热写入缓存，且超过上限的预热被拒绝"""
+    import threading
+    from app.services import sumsub_service, token_cache
+    from app.services.token_prewarmer import TokenPrewarmer
+
+    release = threading.Event()
+
+    def slow_generate(applicant_id, user_id, email=None):
+        release.wait(2)
+        return f'tok-{user_id}'
+
+    prewarmer = TokenPrewarmer(workers=1, max_pending=1)
+    with patch.object(token_cache, '_cache', token_cache.TokenCache()), \
+         patch.object(sumsub_service, '_generate_access_token', side_effect=slow_generate):
+        assert prewarmer.schedule('order_a', 'order_a') is True
+        assert prewarmer.schedule('order_b', 'order_b') is False
+        release.set()
+        prewarmer.shutdown(wait=True)
+
+        assert token_cache.get_cache().get('order_a', sumsub_service.SUMSUB_VERIFICATION_LEVEL)[0] == 'tok-order_a'
+
+    stats = prewarmer.get_stats()
+    assert stats['succeeded'] == 1
+    assert stats['rejected'] == 1
+    assert stats['pending'] == 0
+    print("✅ 令牌预热测试通过")
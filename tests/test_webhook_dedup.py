@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Sumsub Webhook 去重与合并测试
+"""
+
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# 添加项目路径
+project_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+@pytest.fixture
+def app():
+    with patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+        from app import create_app
+        from app.services import job_queue, webhook_dedup
+        app = create_app()
+        # 报告生成任务留给 worker
+        with patch.object(webhook_dedup, '_deduplicator', webhook_dedup.EventDeduplicator()), \
+             patch.object(job_queue, 'JOB_WORKER_ENABLED', True):
+            yield app
+
+
+def _applicant(app, taobao_order_id):
+    from app import db
+    from app.models import Order
+    from app.services import sumsub_service
+
+    with app.app_context():
+        order = Order(taobao_order_id=taobao_order_id, buyer_id='b1', buyer_name='张三',
+                      buyer_email='buyer@example.com', platform='taobao')
+        db.session.add(order)
+        db.session.commit()
+        verification = sumsub_service.create_verification(order)
+        db.session.commit()
+        return verification.sumsub_applicant_id
+
+
+def _report_jobs(app):
+    from app.models import Job
+    from app.services import sumsub_service
+
+    with app.app_context():
+        return Job.query.filter_by(kind=sumsub_service.JOB_GENERATE_REPORT).count()
+
+
+def test_redelivery_is_skipped(app):
+    """测试重复投递（内存和数据库两级）不会重复处理"""
+    from app.models import WebhookEvent
+    from app.services import webhook_dedup
+
+    applicant_id = _applicant(app, 'TB_DEDUP_1')
+    client = app.test_client()
+    event = {'applicantId': applicant_id, 'reviewStatus': 'approved', 'createdAtMs': '1'}
+
+    assert client.post('/webhook/sumsub/verification', json=event).get_json()['status'] == 'success'
+    assert client.post('/webhook/sumsub/verification', json=event).get_json()['status'] == 'duplicate'
+
+    # 其他进程（内存缓存为空）通过 webhook_events 表识别
+    with patch.object(webhook_dedup, '_deduplicator', webhook_dedup.EventDeduplicator()):
+        assert client.post('/webhook/sumsub/verification', json=event).get_json()['status'] == 'duplicate'
+        stats = webhook_dedup.get_stats()
+        assert stats['duplicates_db'] == 1
+
+    # 内容不同但状态相同的事件：不重复请求报告
+    repeat = dict(event, createdAtMs='2')
+    assert client.post('/webhook/sumsub/verification', json=repeat).get_json()['status'] == 'success'
+
+    assert _report_jobs(app) == 1
+    with app.app_context():
+        assert WebhookEvent.query.count() == 2
+    print("✅ 重复投递测试通过")
+
+
+def test_failed_event_can_be_retried(app):
+    """测试处理失败时释放摘要，Sumsub 重试可以再次处理"""
+    from app.services import sumsub_service
+
+    applicant_id = _applicant(app, 'TB_DEDUP_2')
+    client = app.test_client()
+    event = {'applicantId': applicant_id, 'reviewStatus': 'approved'}
+
+    with patch.object(sumsub_service, 'request_report', side_effect=Exception('db down')):
+        assert client.post('/webhook/sumsub/verification', json=event).status_code == 500
+
+    assert client.post('/webhook/sumsub/verification', json=event).get_json()['status'] == 'success'
+    assert _report_jobs(app) == 1
+    print("✅ 失败重试测试通过")
+
+
+def test_burst_is_merged_into_one_run():
+    """测试同一申请人的突发事件合并为一次处理，只应用最新的事件"""
+    from app.services.webhook_dedup import Coalescer
+
+    coalescer = Coalescer('test')
+    applied = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def apply(value):
+        applied.append(value)
+        if value == 1:
+            started.set()
+            release.wait(5)
+
+    leader = threading.Thread(target=coalescer.submit, args=('applicant', apply, 1))
+    leader.start()
+    assert started.wait(5)
+
+    followers = []
+    for value in (2, 3, 4):
+        t = threading.Thread(target=coalescer.submit, args=('applicant', apply, value))
+        t.start()
+        followers.append(t)
+        time.sleep(0.05)
+
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert applied == [1, 4]
+    stats = coalescer.get_stats()
+    assert stats['runs'] == 2
+    assert stats['merged'] == 2
+    assert stats['active'] == 0
+    print("✅ 突发事件合并测试通过")
+
+
+def test_out_of_order_events_keep_newest():
+    """测试合并时按事件时间 createdAtMs 保留最新事件，迟到的旧事件被丢弃"""
+    from app.services.webhook_dedup import Coalescer
+
+    coalescer = Coalescer('test_order')
+    applied = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def apply(value):
+        applied.append(value)
+        if value == 'pending':
+            started.set()
+            release.wait(5)
+
+    def submit(value, created_at):
+        coalescer.submit('applicant', apply, value, order=created_at)
+
+    leader = threading.Thread(target=submit, args=('pending', '2024-01-01 10:00:00.200'))
+    leader.start()
+    assert started.wait(5)
+
+    # 比正在处理的事件更早的投递直接丢弃
+    submit('init', '2024-01-01 10:00:00.100')
+
+    # 最新的事件先到，较早的后到：合并后仍应用最新的
+    followers = []
+    for value, created_at in (('completed', '2024-01-01 10:00:00.400'), ('onHold', '2024-01-01 10:00:00.300')):
+        t = threading.Thread(target=submit, args=(value, created_at))
+        t.start()
+        followers.append(t)
+        time.sleep(0.05)
+
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert applied == ['pending', 'completed']
+    stats = coalescer.get_stats()
+    assert stats['stale'] == 2
+    assert stats['runs'] == 2
+    assert stats['active'] == 0
+    print("✅ 乱序事件合并测试通过")
+
+
+def test_batch_claims_commit_once(app):
+    """测试批量投递的事件一次查询、一次提交完成去重登记，异步模式下与任务一起提交"""
+    from app import db
+    from app.models import Job, WebhookEvent
+    from app.routes import webhook
+    from app.services import sumsub_service
+
+    applicant_id = _applicant(app, 'TB_DEDUP_3')
+    client = app.test_client()
+    events = [
+        {'applicantId': applicant_id, 'reviewStatus': 'pending', 'createdAtMs': '1'},
+        {'applicantId': applicant_id, 'reviewStatus': 'approved', 'createdAtMs': '2'},
+    ]
+    assert client.post('/webhook/sumsub/verification', json=events[0]).get_json()['status'] == 'success'
+
+    with patch.object(webhook, 'WEBHOOK_ASYNC', True), \
+         patch.object(db.session, 'commit', wraps=db.session.commit) as commit:
+        response = client.post('/webhook/sumsub/verification', json=events + [events[1]])
+        assert response.status_code == 202
+        assert commit.call_count == 1
+
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['duplicate', 'accepted', 'duplicate']
+    with app.app_context():
+        assert WebhookEvent.query.count() == 2
+        assert Job.query.filter_by(kind=sumsub_service.JOB_SUMSUB_VERIFICATION).one().id == results[1]['job_id']
+    print("✅ 批量登记一次提交测试通过")